@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# Benchmark runs log hundreds of thousands of lines; keep them out of src/agent-sandbox.log
+os.environ.setdefault(
+    "AGENT_LOG_FILE",
+    os.path.join(tempfile.gettempdir(), "agent-sandbox-benchmarks.log"),
+)
@@ -0,0 +1,132 @@
+"""
+Disk footprint and load latency of hot vs. archived (cold) conversations.
+
+Usage: python -m benchmarks.cold_storage [--conversations 200] [--messages 60]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from models.chat import ChatRole, Conversation, Message, MessageType
+from storage.json_store import JsonConversationStore
+
+
+def make_conversation(
+    conversation_id: int, message_count: int, rng: random.Random
+) -> Conversation:
+    """Builds a conversation that mixes chat text with large tool outputs."""
+    messages = []
+    for message_id in range(message_count):
+        if message_id % 3 == 2:
+            lines = [
+                f"-rw-r--r-- 1 user user {rng.randint(100, 99999):>6} Jan {rng.randint(1, 28):>2} file_{rng.randint(0, 999)}.py"
+                for _ in range(rng.randint(20, 200))
+            ]
+            content, role, message_type = (
+                "STDOUT:\n" + "\n".join(lines),
+                ChatRole.ASSISTANT,
+                MessageType.TOOL,
+            )
+        else:
+            words = [
+                rng.choice(
+                    [
+                        "list",
+                        "files",
+                        "count",
+                        "lines",
+                        "python",
+                        "the",
+                        "in",
+                        "project",
+                        "and",
+                        "show",
+                    ]
+                )
+                for _ in range(rng.randint(5, 60))
+            ]
+            content, role, message_type = (
+                " ".join(words),
+                rng.choice([ChatRole.USER, ChatRole.ASSISTANT]),
+                MessageType.TEXT,
+            )
+        messages.append(
+            Message(id=message_id, content=content, role=role, type=message_type)
+        )
+    return Conversation(
+        id=conversation_id, title=f"Conversation {conversation_id}", messages=messages
+    )
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def time_loads(
+    store: JsonConversationStore, conversation_ids: list[int]
+) -> list[float]:
+    latencies = []
+    for conversation_id in conversation_ids:
+        start = time.perf_counter()
+        store.read_conversation(conversation_id)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def time_listing(store: JsonConversationStore) -> float:
+    start = time.perf_counter()
+    store.list_conversations()
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as conversation_dir:
+        store = JsonConversationStore(conversation_dir)
+        conversation_ids = list(range(1, args.conversations + 1))
+        for conversation_id in conversation_ids:
+            store.write_conversation(
+                make_conversation(conversation_id, args.messages, rng)
+            )
+
+        hot_size = directory_size(conversation_dir)
+        hot_list = time_listing(store)
+        hot_loads = time_loads(store, conversation_ids)
+
+        archived = store.archive_conversations(max_age_seconds=-1)
+        cold_size = directory_size(conversation_dir)
+        cold_list = time_listing(store)
+        cold_loads = time_loads(store, conversation_ids)
+        store.close()
+
+    print(
+        f"Conversations: {args.conversations} x {args.messages} messages, archived: {archived}"
+    )
+    print(
+        f"{'tier':<6} {'disk (KiB)':>12} {'list (ms)':>10} {'load p50 (ms)':>14} {'load p95 (ms)':>14}"
+    )
+    for tier, size, listing, loads in (
+        ("hot", hot_size, hot_list, hot_loads),
+        ("cold", cold_size, cold_list, cold_loads),
+    ):
+        p95 = statistics.quantiles(loads, n=20)[-1]
+        print(
+            f"{tier:<6} {size / 1024:>12.1f} {listing:>10.2f} {statistics.median(loads):>14.3f} {p95:>14.3f}"
+        )
+    print(f"Compression ratio: {hot_size / cold_size:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
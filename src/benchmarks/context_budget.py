@@ -0,0 +1,125 @@
+"""
+Compares fixed message-count context windows with token-budgeted context on long conversations.
+
+Builds a synthetic conversation with regular large tool outputs, then, at every
+position of the conversation, measures the prompt tokens of the previous
+"last 10 messages" window against the ContextBuilder's chat budget, and how
+long context assembly takes with cached versus freshly counted tokens.
+
+Usage: python -m benchmarks.context_budget [--messages 400] [--tool-every 7] [--tool-output-kb 40]
+"""
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from models.chat import ChatRole, Message, MessageType, MessageView
+from services.context_builder import ContextBuilder, count_tokens, message_text
+from services.conversation_manager import ConversationManager
+
+WORDS = (
+    "the agent runs a command and reads its output before planning next step".split()
+)
+
+
+def make_text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def make_tool_output(rng: random.Random, kilobytes: int) -> str:
+    lines = []
+    while sum(len(line) + 1 for line in lines) < kilobytes * 1024:
+        lines.append(f"{rng.randint(0, 99999):05d} {make_text(rng, 8)}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=400)
+    parser.add_argument("--tool-every", type=int, default=7)
+    parser.add_argument("--tool-output-kb", type=int, default=40)
+    parser.add_argument("--window", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    builder = ContextBuilder()
+
+    with tempfile.TemporaryDirectory() as conversation_dir:
+        manager = ConversationManager(
+            conversation_dir=conversation_dir, archive_after_days=None
+        )
+        conversation = manager.create_conversation()
+
+        start = time.perf_counter()
+        for i in range(args.messages):
+            is_tool = i % args.tool_every == args.tool_every - 1
+            conversation.messages.append(
+                Message(
+                    id=len(conversation.messages),
+                    content=(
+                        make_tool_output(rng, args.tool_output_kb)
+                        if is_tool
+                        else make_text(rng, rng.randint(10, 120))
+                    ),
+                    role=ChatRole.USER if i % 2 == 0 else ChatRole.ASSISTANT,
+                    type=MessageType.TOOL if is_tool else MessageType.TEXT,
+                )
+            )
+            manager.save_conversation(conversation)
+        save_seconds = time.perf_counter() - start
+        manager.flush()
+
+        # Read back the way prompts read history, to check the counts were stored
+        recent_views = manager.load_recent_messages(conversation.id, 50)
+        stored_counts = sum(view.token_count is not None for view in recent_views)
+        views = [MessageView.from_message(message) for message in conversation.messages]
+        manager.close()
+
+    fixed_tokens, budgeted_tokens = [], []
+    for end in range(1, len(views) + 1):
+        fixed_tokens.append(
+            sum(view.token_count for view in views[max(0, end - args.window) : end])
+        )
+        selected = builder.select_messages("chat", views[max(0, end - 50) : end])
+        budgeted_tokens.append(
+            sum(count_tokens(builder.render_content("chat", view)) for view in selected)
+        )
+
+    window = views[-50:]
+    runs = 200
+    start = time.perf_counter()
+    for _ in range(runs):
+        builder.select_messages("chat", window)
+    cached_ms = (time.perf_counter() - start) / runs * 1000
+    start = time.perf_counter()
+    for _ in range(runs // 20):
+        for view in window:
+            count_tokens(message_text(view))
+    uncached_ms = (time.perf_counter() - start) / (runs // 20) * 1000
+
+    print(
+        f"Conversation: {len(views)} messages, "
+        f"{sum(view.token_count for view in views)} tokens, "
+        f"token counting on save {save_seconds / len(views) * 1000:.2f} ms/message"
+    )
+    print(
+        f"Stored token counts in recent messages: {stored_counts}/{len(recent_views)}"
+    )
+    print(
+        f"Last {args.window} messages: mean {statistics.mean(fixed_tokens):.0f}, "
+        f"max {max(fixed_tokens)} prompt tokens"
+    )
+    print(
+        f"Chat budget {builder.stage_budgets['chat']}: mean "
+        f"{statistics.mean(budgeted_tokens):.0f}, max {max(budgeted_tokens)} prompt tokens"
+    )
+    print(
+        f"Context selection: {cached_ms:.3f} ms with cached counts, "
+        f"{uncached_ms:.1f} ms when counting every time"
+    )
+
+
+if __name__ == "__main__":
+    main()
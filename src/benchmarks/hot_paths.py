@@ -0,0 +1,407 @@
+"""
+Microbenchmarks of the local hot paths at several input sizes, with stored baselines.
+
+Times conversation saving and loading, token totals, CLI message rendering,
+placeholder substitution and the tool catalog on synthetic data, reports the
+median time per call and how it scales between sizes (the exponent k in
+time ~ size^k), and compares the fastest round with a stored baseline. Cases
+that got slower than the baseline by more than `--threshold` are flagged and
+make the run exit with status 1.
+
+Baselines are machine-specific, so none is committed: record one with
+`--update-baseline` before comparing. Without a baseline the run warns on
+stderr, or exits with status 2 under `--require-baseline`.
+
+Usage: python -m benchmarks.hot_paths [--filter save] [--quick] [--baseline PATH] [--update-baseline] [--require-baseline] [--output results.json]
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Callable
+from prompt_toolkit.buffer import Buffer
+from prompt_toolkit.document import Document
+from models.chat import ChatRole, Conversation, Message, MessageType
+from services.cli_service import CLIService
+from services.completion_backend import FakeBackend
+from services.conversation_manager import ConversationManager
+from services.llm_service import LLMService
+from services.tool_manager import ToolManager
+
+DEFAULT_BASELINE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "hot_paths_baseline.json"
+)
+WORDS = "the agent reads a file runs a command and reports what it found".split()
+
+
+def make_message(message_id: int, rng: random.Random) -> Message:
+    """A chat message, with a larger tool output for every third message."""
+    if message_id % 3 == 2:
+        content = "\n".join(
+            f"{rng.randint(0, 99999):05d} " + " ".join(rng.choices(WORDS, k=8))
+            for _ in range(rng.randint(5, 40))
+        )
+        role, message_type = ChatRole.ASSISTANT, MessageType.TOOL
+    else:
+        content = " ".join(rng.choices(WORDS, k=rng.randint(5, 60)))
+        role = ChatRole.USER if message_id % 3 == 0 else ChatRole.ASSISTANT
+        message_type = MessageType.TEXT
+    message = Message(id=message_id, content=content, role=role, type=message_type)
+    if role == ChatRole.ASSISTANT:
+        message.input_tokens = rng.randint(100, 4000)
+        message.output_tokens = rng.randint(10, 400)
+    return message
+
+
+def make_conversation(conversation_id: int, messages: int, seed: int = 0):
+    rng = random.Random(seed)
+    return Conversation(
+        id=conversation_id,
+        title=f"Conversation {conversation_id}",
+        messages=[make_message(i, rng) for i in range(messages)],
+    )
+
+
+def make_manager(conversation_dir: str) -> ConversationManager:
+    return ConversationManager(
+        conversation_dir=conversation_dir, archive_after_days=None
+    )
+
+
+def make_cli(conversation: Conversation) -> CLIService:
+    """A CLIService with only the state its rendering methods use."""
+    cli = CLIService.__new__(CLIService)
+    cli.conversation = conversation
+    cli.view_buffer = Buffer(read_only=True)
+    cli.app = SimpleNamespace(invalidate=lambda: None)
+    return cli
+
+
+class Case:
+    """One benchmarked path: `setup(size, workdir)` returns the function to time."""
+
+    def __init__(
+        self,
+        name: str,
+        size_name: str,
+        sizes: list[int],
+        quick_sizes: list[int],
+        setup: Callable[[int, str], Callable[[], object]],
+    ):
+        self.name = name
+        self.size_name = size_name
+        self.sizes = sizes
+        self.quick_sizes = quick_sizes
+        self.setup = setup
+
+    def key(self, size: int) -> str:
+        return f"{self.name}[{self.size_name}={size}]"
+
+
+def setup_save_conversation(messages: int, workdir: str):
+    manager = make_manager(workdir)
+    conversation = make_conversation(1, messages)
+    manager.save_conversation(conversation)
+    manager.flush()
+    rng = random.Random(1)
+
+    def run():
+        conversation.messages.append(make_message(len(conversation.messages), rng))
+        manager.save_conversation(conversation)
+        manager.flush(conversation.id)
+
+    run.cleanup = manager.close
+    return run
+
+
+def setup_load_conversation(messages: int, workdir: str):
+    manager = make_manager(workdir)
+    conversation = make_conversation(1, messages)
+    manager.save_conversation(conversation)
+    manager.flush()
+
+    def run():
+        # Cold load from the store, not from the conversation cache
+        manager._cache_remove(conversation.id)
+        return manager.load_conversation(conversation.id)
+
+    run.cleanup = manager.close
+    return run
+
+
+def setup_load_conversations(conversations: int, workdir: str):
+    manager = make_manager(workdir)
+    for i in range(conversations):
+        manager.save_conversation(make_conversation(i + 1, 6, seed=i))
+    manager.flush()
+
+    def run():
+        for conversation_id in list(manager._cache):
+            manager._cache_remove(conversation_id)
+        return manager.load_conversations()
+
+    run.cleanup = manager.close
+    return run
+
+
+def setup_get_total_tokens(messages: int, workdir: str):
+    conversation = make_conversation(1, messages)
+    return conversation.get_total_tokens
+
+
+def setup_get_formatted_messages(messages: int, workdir: str):
+    return make_cli(make_conversation(1, messages)).get_formatted_messages
+
+
+def setup_append_to_view(view_kb: int, workdir: str):
+    cli = make_cli(None)
+    initial = make_cli(make_conversation(1, 1000)).get_formatted_messages()
+    initial = (initial * (view_kb * 1024 // len(initial) + 1))[: view_kb * 1024]
+    chunk = "[Assistant]: " + " ".join(WORDS) + "\n"
+
+    def run():
+        cli.view_buffer.set_document(Document(initial), bypass_readonly=True)
+        cli.append_to_view(chunk)
+
+    return run
+
+
+_service: LLMService | None = None
+
+
+def setup_substitute_placeholders(output_kb: int, workdir: str):
+    global _service
+    if _service is None:
+        _service = LLMService(
+            conversation_manager=make_manager(tempfile.mkdtemp(dir=workdir)),
+            completion_backend=FakeBackend(),
+            enable_intent_cache=False,
+            enable_plan_cache=False,
+            enable_local_classifier=False,
+        )
+    rng = random.Random(0)
+    outputs = {
+        f"step_{step_id}_output": "".join(
+            rng.choices("abcdefghij \n", k=output_kb * 1024)
+        )
+        for step_id in range(1, 4)
+    }
+    text = json.dumps(
+        {"code": "print(len('$step_1_output' + '$step_2_output' + '$step_3_output'))"}
+    )
+    return lambda: _service.substitute_placeholders(text, outputs)
+
+
+def setup_get_tool_descriptions(calls: int, workdir: str):
+    tool_manager = ToolManager()
+
+    def run():
+        for _ in range(calls):
+            tool_manager.get_tool_descriptions()
+
+    return run
+
+
+CASES = [
+    Case(
+        "save_conversation",
+        "messages",
+        [100, 1000, 10000],
+        [100, 1000],
+        setup_save_conversation,
+    ),
+    Case(
+        "load_conversation",
+        "messages",
+        [100, 1000, 10000],
+        [100, 1000],
+        setup_load_conversation,
+    ),
+    Case(
+        "load_conversations",
+        "conversations",
+        [100, 1000, 10000],
+        [100, 1000],
+        setup_load_conversations,
+    ),
+    Case(
+        "get_total_tokens",
+        "messages",
+        [100, 1000, 10000],
+        [100, 1000],
+        setup_get_total_tokens,
+    ),
+    Case(
+        "get_formatted_messages",
+        "messages",
+        [100, 1000, 10000],
+        [100, 1000],
+        setup_get_formatted_messages,
+    ),
+    Case("append_to_view", "view_kb", [10, 100, 1000], [10, 100], setup_append_to_view),
+    Case(
+        "substitute_placeholders",
+        "output_kb",
+        [1, 100, 1000],
+        [1, 100],
+        setup_substitute_placeholders,
+    ),
+    Case(
+        "get_tool_descriptions",
+        "calls",
+        [1000],
+        [1000],
+        setup_get_tool_descriptions,
+    ),
+]
+
+
+def time_call(function: Callable, min_time: float, rounds: int) -> dict:
+    """
+    Runs `function` in rounds of enough calls to take about min_time / rounds
+    each, and returns the median and minimum time per call in microseconds.
+    """
+    start = time.perf_counter()
+    function()
+    first = time.perf_counter() - start
+    loops = max(1, int(min_time / rounds / max(first, 1e-9)))
+
+    per_call = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        per_call.append((time.perf_counter() - start) / loops * 1e6)
+    return {
+        "median_us": statistics.median(per_call),
+        "min_us": min(per_call),
+        "calls": loops * rounds,
+    }
+
+
+def scaling_exponents(case: Case, sizes: list[int], results: dict) -> list[float]:
+    """The exponent k of time ~ size^k between each pair of consecutive sizes."""
+    exponents = []
+    for small, large in zip(sizes, sizes[1:]):
+        small_us = results[case.key(small)]["median_us"]
+        large_us = results[case.key(large)]["median_us"]
+        exponents.append(math.log(large_us / small_us) / math.log(large / small))
+    return exponents
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--filter", help="Only run cases whose name contains this")
+    parser.add_argument(
+        "--quick", action="store_true", help="Skip the largest input sizes"
+    )
+    parser.add_argument("--min-time", type=float, default=0.5)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Store this run's medians as the new baseline",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="Flag cases slower than the baseline by more than this fraction",
+    )
+    parser.add_argument(
+        "--require-baseline",
+        action="store_true",
+        help="Exit with status 2 when there is no baseline to compare with",
+    )
+    parser.add_argument("--output", help="Also write the results as JSON here")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    elif not args.update_baseline:
+        # Baselines are machine-specific, so none is committed; without one
+        # nothing can be flagged as a regression
+        print(
+            f"WARNING: no baseline at {args.baseline}; regressions will NOT be "
+            "detected. Record one with --update-baseline on this machine.",
+            file=sys.stderr,
+        )
+        if args.require_baseline:
+            sys.exit(2)
+
+    results, scaling, regressions = {}, {}, []
+    with tempfile.TemporaryDirectory() as workdir:
+        for case in CASES:
+            if args.filter and args.filter not in case.name:
+                continue
+            sizes = case.quick_sizes if args.quick else case.sizes
+            for size in sizes:
+                key = case.key(size)
+                function = case.setup(size, tempfile.mkdtemp(dir=workdir))
+                try:
+                    result = time_call(function, args.min_time, args.rounds)
+                finally:
+                    if hasattr(function, "cleanup"):
+                        function.cleanup()
+
+                line = f"{key:<45} {result['median_us']:>12.1f} us"
+                # The fastest round is the least disturbed by other load
+                baseline_us = baseline.get(key, {}).get("min_us")
+                if baseline_us:
+                    result["baseline_us"] = baseline_us
+                    result["change"] = result["min_us"] / baseline_us - 1
+                    line += f"  {result['change']:+7.1%} vs baseline"
+                    if result["change"] > args.threshold:
+                        regressions.append(key)
+                        line += "  REGRESSION"
+                results[key] = result
+                print(line, flush=True)
+            scaling[case.name] = scaling_exponents(case, sizes, results)
+            if scaling[case.name]:
+                print(
+                    f"{'':<45} scaling exponents: "
+                    + ", ".join(f"{exponent:.2f}" for exponent in scaling[case.name])
+                )
+        if _service is not None:
+            _service.conversation_manager.close()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {"results": results, "scaling": scaling, "regressions": regressions},
+                f,
+                indent=2,
+            )
+    if args.update_baseline:
+        baseline.update(
+            {
+                key: {"median_us": result["median_us"], "min_us": result["min_us"]}
+                for key, result in results.items()
+            }
+        )
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Updated baseline {args.baseline}")
+
+    if not baseline and not args.update_baseline:
+        print("WARNING: results were not compared with a baseline", file=sys.stderr)
+    elif regressions:
+        print(
+            f"{len(regressions)} regressions beyond {args.threshold:.0%}: "
+            + ", ".join(regressions)
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Offline evaluation of the local intent classifier against logged LLM classifications.
+
+Trains on the first part of conversations/intent_log.jsonl, evaluates on the rest
+and reports how often the local classifier answers, how often it agrees with the
+LLM, and how much classification latency it would have saved. Before that, the
+arithmetic rule is checked on fixed messages: unspaced arithmetic must resolve
+locally and dates must not. Exits with status 1 if a rule check fails.
+
+Usage: python -m benchmarks.intent_eval [--log PATH] [--holdout 0.3] [--threshold 0.9]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from models.intent import IntentClassification
+from services.intent_classifier import LocalIntentClassifier, read_intent_log
+
+# Messages with the expression the arithmetic rule must extract, or None for dates
+RULE_CASES = {
+    "5-3": "5-3",
+    "10/2": "10/2",
+    "what is 5-3?": "5-3",
+    "3.5*2": "3.5*2",
+    "calculate (2+3)/4": "(2+3)/4",
+    "2024-01-15": None,
+    "12/25/2024": None,
+    "1.2.2024": None,
+    "what is 2024-01-15": None,
+}
+
+
+def check_rules(classifier: LocalIntentClassifier) -> int:
+    """Prints the result of every rule case and returns the number of failures."""
+    failures = 0
+    print("Arithmetic rule:")
+    for message, expected in RULE_CASES.items():
+        expression = classifier.extract_expression(message)
+        ok = expression == expected
+        failures += not ok
+        print(f"  {'ok' if ok else 'FAIL':<4} {message!r:<22} {expression}")
+    return failures
+
+
+def main():
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--log",
+        default=os.path.join(project_root, "conversations", "intent_log.jsonl"),
+    )
+    parser.add_argument("--holdout", type=float, default=0.3)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--min-examples", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if check_rules(LocalIntentClassifier()):
+        sys.exit(1)
+
+    records = read_intent_log(args.log)
+    if not records:
+        print(f"No logged classifications found in {args.log}")
+        return
+    examples = [
+        (
+            record["user_message"],
+            IntentClassification.model_validate(record["intent"]),
+            record.get("latency_ms", 0.0),
+        )
+        for record in records
+    ]
+    random.Random(args.seed).shuffle(examples)
+    split = int(len(examples) * (1 - args.holdout))
+    train, test = examples[:split], examples[split:]
+
+    classifier = LocalIntentClassifier(
+        threshold=args.threshold, min_examples=args.min_examples
+    )
+    classifier.train([(message, intent) for message, intent, _ in train])
+
+    answered = agreed = 0
+    local_latencies = []
+    saved_ms = 0.0
+    for message, llm_intent, llm_latency in test:
+        start = time.perf_counter()
+        local_intent = classifier.classify(message)
+        local_latencies.append((time.perf_counter() - start) * 1000)
+        if local_intent is None:
+            continue
+        answered += 1
+        saved_ms += llm_latency
+        if local_intent.intent_type == llm_intent.intent_type and (
+            local_intent.suggested_tool or None
+        ) == (llm_intent.suggested_tool or None):
+            agreed += 1
+
+    llm_latencies = [latency for _, _, latency in test if latency]
+    print(f"Examples: {len(train)} train / {len(test)} test")
+    print(f"Coverage: {answered / len(test):.1%} answered locally")
+    print(
+        f"Agreement with LLM on answered: {agreed / answered:.1%}"
+        if answered
+        else "Agreement with LLM on answered: n/a"
+    )
+    print(f"Local classify latency p50: {statistics.median(local_latencies):.3f} ms")
+    if llm_latencies:
+        print(f"LLM classify latency p50: {statistics.median(llm_latencies):.0f} ms")
+    print(
+        f"Latency saved: {saved_ms / 1000:.1f} s total, {saved_ms / len(test):.0f} ms per request"
+    )
+
+
+if __name__ == "__main__":
+    main()
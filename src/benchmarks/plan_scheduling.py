@@ -0,0 +1,205 @@
+"""
+Checks how plans are scheduled and which execution mode "auto" picks for them.
+
+Independent calculator steps and read-only shell commands must run at the same
+time, while commands that can change state run one at a time in step order.
+Every step runs its tool in a worker thread after a fixed delay standing in
+for slow tools, and the plan wall time is reported against the sum of the step
+times. Then choose_plan_execution is checked on one plan per branch. Exits with
+status 1 if a check fails.
+
+Usage: python -m benchmarks.plan_scheduling [--step-ms 200]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from models.plan import Plan, Step
+from models.tools import ToolType
+from services.completion_backend import FakeBackend
+from services.conversation_manager import ConversationManager
+from services.llm_service import LLMService
+
+
+def make_step(
+    step_id: int, tool_type: ToolType | None = None, tool_input: dict | None = None
+) -> Step:
+    return Step(
+        step_id=step_id,
+        thought="",
+        tool_type=tool_type,
+        tool_input=json.dumps(tool_input) if tool_input is not None else None,
+    )
+
+
+def calculate(step_id: int, expression: str) -> Step:
+    return make_step(step_id, ToolType.CALCULATOR, {"expression": expression})
+
+
+def shell(step_id: int, command: str) -> Step:
+    return make_step(step_id, ToolType.SHELL_COMMAND, {"command": command})
+
+
+def scheduling_plans(work_dir: str) -> dict[str, tuple[Plan, int]]:
+    """Plans by name, with the most steps expected to run at once."""
+    out_dir = os.path.join(work_dir, "out")
+    return {
+        # Two independent calculations and one that combines them
+        "calculator": (
+            Plan(
+                steps=[
+                    calculate(1, "12 * 7"),
+                    calculate(2, "2 ** 10"),
+                    calculate(3, "$step_1_output + $step_2_output"),
+                ]
+            ),
+            2,
+        ),
+        "read-only": (
+            Plan(steps=[shell(1, f"ls {work_dir}"), shell(2, "pwd")]),
+            2,
+        ),
+        # The reads wait for the directory, then overlap; the last write waits for both
+        "write-read": (
+            Plan(
+                steps=[
+                    shell(1, f"mkdir -p {out_dir}"),
+                    shell(2, f"ls {out_dir}"),
+                    shell(3, f"stat {out_dir}"),
+                    shell(4, f"rmdir {out_dir}"),
+                ]
+            ),
+            2,
+        ),
+        "python": (
+            Plan(
+                steps=[
+                    make_step(1, ToolType.PYTHON_INTERPRETER, {"code": "print(1)"}),
+                    make_step(2, ToolType.PYTHON_INTERPRETER, {"code": "print(2)"}),
+                ]
+            ),
+            1,
+        ),
+    }
+
+
+# One plan per branch of choose_plan_execution, with the expected mode
+MODE_PLANS = {
+    "cyclic dependencies": (
+        Plan(
+            steps=[
+                calculate(1, "$step_2_output + 1"),
+                calculate(2, "$step_1_output + 1"),
+            ]
+        ),
+        "interactive",
+    ),
+    "unregistered tool": (
+        Plan(steps=[make_step(1, ToolType.GOOGLE_SEARCH, {"query": "weather"})]),
+        "interactive",
+    ),
+    "missing tool input": (
+        Plan(steps=[make_step(1, ToolType.CALCULATOR)]),
+        "interactive",
+    ),
+    "python step": (
+        Plan(steps=[make_step(1, ToolType.PYTHON_INTERPRETER, {"code": "print(1)"})]),
+        "interactive",
+    ),
+    "command with side effects": (
+        Plan(steps=[shell(1, "ls"), shell(2, "mkdir out")]),
+        "interactive",
+    ),
+    "command with a placeholder": (
+        Plan(steps=[calculate(1, "1 + 1"), shell(2, "head -n $step_1_output a.txt")]),
+        "interactive",
+    ),
+    "read-only commands": (
+        Plan(steps=[shell(1, "ls -la"), shell(2, "cat a.txt | wc -l")]),
+        "deterministic",
+    ),
+    "calculations": (
+        Plan(steps=[calculate(1, "2 + 2"), make_step(2), calculate(3, "3 * 3")]),
+        "deterministic",
+    ),
+}
+
+
+async def run_plan(
+    service: LLMService, plan: Plan, step_ms: float
+) -> tuple[int, float, dict[str, str]]:
+    """Runs the plan and returns the most steps in flight at once, the wall time and the outputs."""
+    in_flight = max_in_flight = 0
+
+    def run_tool(step: Step, tool_input: str) -> str:
+        time.sleep(step_ms / 1000)
+        result, _ = service.tool_manager.execute_tool(
+            step.tool_type, tool_input, confirmed=True
+        )
+        return result
+
+    async def run_step(step: Step, outputs: dict[str, str]) -> str:
+        nonlocal in_flight, max_in_flight
+        tool_input = step.tool_input
+        for key, value in outputs.items():
+            tool_input = tool_input.replace(f"${key}", value)
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        try:
+            return await asyncio.to_thread(run_tool, step, tool_input)
+        finally:
+            in_flight -= 1
+
+    start = time.perf_counter()
+    outputs = await service.plan_scheduler.run(plan, run_step)
+    return max_in_flight, time.perf_counter() - start, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--step-ms", type=float, default=200.0)
+    args = parser.parse_args()
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as work_dir:
+        manager = ConversationManager(conversation_dir=work_dir)
+        service = LLMService(
+            conversation_manager=manager,
+            completion_backend=FakeBackend(),
+            enable_plan_cache=False,
+            enable_usage_ledger=False,
+        )
+
+        print("Scheduling:")
+        for name, (plan, expected) in scheduling_plans(work_dir).items():
+            max_in_flight, elapsed, outputs = asyncio.run(
+                run_plan(service, plan, args.step_ms)
+            )
+            serial = len(plan.steps) * args.step_ms
+            ok = max_in_flight == expected and len(outputs) == len(plan.steps)
+            failures += not ok
+            print(
+                f"  {'ok' if ok else 'FAIL':<4} {name:<11} {max_in_flight} of "
+                f"{len(plan.steps)} steps at once (expected {expected}), critical "
+                f"path {service.plan_scheduler.critical_path_length(plan)}, "
+                f"{elapsed * 1000:.0f} ms vs {serial:.0f} ms one after another"
+            )
+
+        print("Auto mode:")
+        for name, (plan, expected) in MODE_PLANS.items():
+            mode = service.choose_plan_execution(plan)
+            ok = mode == expected
+            failures += not ok
+            print(f"  {'ok' if ok else 'FAIL':<4} {name:<27} {mode}")
+
+        asyncio.run(service.aclose())
+        manager.close()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
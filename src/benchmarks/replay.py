@@ -0,0 +1,385 @@
+"""
+Replays a corpus of user messages through process_user_request across concurrent conversations.
+
+Each line of the corpus is a JSON string or an object with a "message" and an
+optional "conversation" key; messages with the same key are replayed in order
+within one conversation, the others are spread round-robin over
+`--conversations` conversations. All conversations run concurrently against a
+FakeBackend (default) or the real provider, and the run is reported as JSON:
+throughput, turn latency percentiles, time per stage (LLM calls per router
+stage, tool runs, handing conversations to the persistence scheduler as
+"save_enqueue" and the remaining "other" time), LLM calls and tokens per turn.
+The "store_write" stage is the time the scheduler's writer thread spends
+writing each turn's conversation to the store; it runs off the turn's path,
+so it is not part of the turn latency or of "other".
+
+Usage: python -m benchmarks.replay [--corpus messages.jsonl] [--conversations 20] [--turns 1000] [--backend fake|litellm] [--output run.json]
+"""
+
+import argparse
+import asyncio
+import contextvars
+import functools
+import inspect
+import json
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from models.chat import get_cached_tokens
+from services.completion_backend import FakeBackend
+from services.conversation_manager import ConversationManager
+from services.llm_service import LLMService
+from metrics import registry
+from tracing import tracer
+
+SAMPLE_MESSAGES = [
+    "Hello! What can you do?",
+    "Calculate 12 * (3 + 4)",
+    "How much is seventeen percent of 250?",
+    "Find all Python files in this directory and count their lines",
+    "Can you explain how you made that plan?",
+    "What is 2 ** 10?",
+    "List the files here, then show the size of the largest one",
+    "Thanks, that is all for now",
+]
+
+# Per-turn metrics of the turn the current task belongs to; tasks and threads
+# started during the turn inherit it
+_current_turn: contextvars.ContextVar[dict | None] = contextvars.ContextVar(
+    "current_turn", default=None
+)
+# Metrics of the latest turn of each conversation, which its writes are counted for
+_turn_by_conversation: dict[int, dict] = {}
+# Set while an LLM call is measured, so nested wrappers do not count it twice
+_in_llm_call: contextvars.ContextVar[bool] = contextvars.ContextVar(
+    "in_llm_call", default=False
+)
+
+
+def new_turn_metrics() -> dict:
+    return {
+        "stage_ms": defaultdict(float),
+        "stage_calls": defaultdict(int),
+        "llm_calls": 0,
+        "llm_errors": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "cached_tokens": 0,
+    }
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(values: list[float]) -> dict:
+    return {
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 0.5),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values, default=0.0),
+    }
+
+
+def read_corpus(path: str | None) -> list[tuple[str | None, str]]:
+    """Returns (conversation key, message) pairs; the key is None for loose messages."""
+    if path is None:
+        return [(None, message) for message in SAMPLE_MESSAGES]
+    corpus = []
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                corpus.append((None, record))
+            else:
+                key = record.get("conversation")
+                corpus.append(
+                    (str(key) if key is not None else None, record["message"])
+                )
+    return corpus
+
+
+def assign_conversations(
+    corpus: list[tuple[str | None, str]], conversations: int, turns: int | None
+) -> list[list[str]]:
+    """Splits the corpus into per-conversation scripts, repeating it up to `turns` messages."""
+    if turns:
+        corpus = [corpus[i % len(corpus)] for i in range(turns)]
+    keyed: dict[str, list[str]] = defaultdict(list)
+    loose: list[list[str]] = [[] for _ in range(conversations)]
+    for i, (key, message) in enumerate(corpus):
+        if key is None:
+            loose[i % conversations].append(message)
+        else:
+            keyed[key].append(message)
+    return [script for script in loose + list(keyed.values()) if script]
+
+
+def instrument(service: LLMService):
+    """Wraps the service's LLM, tool and save calls to record their time per turn."""
+
+    def record(stage: str, elapsed_ms: float, metrics: dict | None = None):
+        metrics = metrics or _current_turn.get()
+        if metrics is not None:
+            metrics["stage_ms"][stage] += elapsed_ms
+            metrics["stage_calls"][stage] += 1
+
+    def measure_llm_call(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            if _in_llm_call.get():
+                return await method(*args, **kwargs)
+            stage = signature.bind(*args, **kwargs).arguments["stage"]
+            metrics = _current_turn.get()
+            token = _in_llm_call.set(True)
+            start = time.perf_counter()
+            try:
+                result = await method(*args, **kwargs)
+            except Exception:
+                if metrics is not None:
+                    metrics["llm_errors"] += 1
+                raise
+            finally:
+                _in_llm_call.reset(token)
+                record(stage, (time.perf_counter() - start) * 1000)
+
+            usage = result[1] if isinstance(result, tuple) else result.usage
+            if metrics is not None:
+                metrics["llm_calls"] += 1
+                if usage:
+                    metrics["prompt_tokens"] += usage.get("prompt_tokens", 0) or 0
+                    metrics["completion_tokens"] += (
+                        usage.get("completion_tokens", 0) or 0
+                    )
+                    metrics["cached_tokens"] += get_cached_tokens(usage)
+            return result
+
+        return wrapper
+
+    def measure(stage: str, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(stage, (time.perf_counter() - start) * 1000)
+
+        return wrapper
+
+    service._complete = measure_llm_call(service._complete)
+    service._complete_text = measure_llm_call(service._complete_text)
+    service._run_tool = measure("tool", service._run_tool)
+    manager = service.conversation_manager
+    manager.save_conversation = measure("save_enqueue", manager.save_conversation)
+
+    write_conversation = manager.store.write_conversation
+
+    @functools.wraps(write_conversation)
+    def measure_write(conversation):
+        start = time.perf_counter()
+        try:
+            return write_conversation(conversation)
+        finally:
+            record(
+                "store_write",
+                (time.perf_counter() - start) * 1000,
+                _turn_by_conversation.get(conversation.id),
+            )
+
+    manager.store.write_conversation = measure_write
+
+
+async def replay(service: LLMService, scripts: list[list[str]]) -> dict:
+    manager = service.conversation_manager
+    turns = []
+
+    async def run_conversation(script: list[str]):
+        conversation = await manager.create_conversation_async()
+        for message in script:
+            metrics = new_turn_metrics()
+            _current_turn.set(metrics)
+            _turn_by_conversation[conversation.id] = metrics
+            start = time.perf_counter()
+            await service.process_user_request(conversation.id, message)
+            metrics["latency_ms"] = (time.perf_counter() - start) * 1000
+            # Waiting for slots, threads and the event loop; parallel steps can overlap
+            metrics["stage_ms"]["other"] = max(
+                0.0,
+                metrics["latency_ms"]
+                - sum(
+                    elapsed_ms
+                    for stage, elapsed_ms in metrics["stage_ms"].items()
+                    if stage != "store_write"
+                ),
+            )
+            turns.append(metrics)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[run_conversation(script) for script in scripts])
+    duration = time.perf_counter() - start
+
+    # Time until the writer thread has persisted every turn
+    flush_start = time.perf_counter()
+    manager.flush()
+    flush_ms = (time.perf_counter() - flush_start) * 1000
+
+    count = len(turns) or 1
+    stage_ms: dict[str, list[float]] = defaultdict(list)
+    stage_calls: dict[str, int] = defaultdict(int)
+    for turn in turns:
+        for stage, elapsed_ms in turn["stage_ms"].items():
+            stage_ms[stage].append(elapsed_ms)
+            stage_calls[stage] += turn["stage_calls"][stage]
+
+    return {
+        "turns": len(turns),
+        "conversations": len(scripts),
+        "duration_s": duration,
+        "throughput_turns_per_s": len(turns) / duration if duration else 0.0,
+        "turn_latency_ms": summarize([turn["latency_ms"] for turn in turns]),
+        "stages": {
+            stage: {
+                "calls": stage_calls[stage],
+                "total_ms": sum(values),
+                "ms_per_turn": sum(values) / count,
+                "turn_p50_ms": percentile(values, 0.5),
+                "turn_p95_ms": percentile(values, 0.95),
+            }
+            for stage, values in sorted(stage_ms.items())
+        },
+        "llm_calls_per_turn": sum(turn["llm_calls"] for turn in turns) / count,
+        "llm_errors": sum(turn["llm_errors"] for turn in turns),
+        "tokens_per_turn": {
+            kind: sum(turn[kind] for turn in turns) / count
+            for kind in ("prompt_tokens", "completion_tokens", "cached_tokens")
+        },
+        "flush_ms": flush_ms,
+        "plan_execution": service.get_plan_execution_stats(),
+    }
+
+
+async def run(args, scripts: list[list[str]], conversation_dir: str) -> dict:
+    backend = None
+    if args.backend == "fake":
+        backend = FakeBackend(
+            latency_ms=args.latency_ms,
+            latency_distribution=args.latency_distribution,
+            failure_rate=args.failure_rate,
+            seed=args.seed,
+        )
+    manager = ConversationManager(
+        conversation_dir=conversation_dir, archive_after_days=None
+    )
+    service = LLMService(
+        model=args.model,
+        stream_responses=args.stream,
+        enable_intent_cache=args.intent_cache,
+        enable_local_classifier=args.local_classifier,
+        enable_plan_cache=args.plan_cache,
+        plan_execution=args.plan_execution,
+        max_concurrent_requests=args.max_concurrent_requests,
+        conversation_manager=manager,
+        completion_backend=backend,
+    )
+    instrument(service)
+    try:
+        results = await replay(service, scripts)
+        if args.metrics:
+            # Before aclose(), which unregisters the service's cache collector
+            registry.write_textfile(args.metrics)
+    finally:
+        await service.aclose()
+        manager.close()
+    if backend:
+        results["backend"] = backend.get_stats()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--corpus", help="JSONL file of user messages")
+    parser.add_argument("--conversations", type=int, default=20)
+    parser.add_argument(
+        "--turns", type=int, help="Replay this many messages, repeating the corpus"
+    )
+    parser.add_argument("--backend", choices=("fake", "litellm"), default="fake")
+    parser.add_argument("--model", default="gemini/gemini-2.5-flash-lite")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument(
+        "--latency-distribution",
+        choices=("fixed", "exponential", "lognormal"),
+        default="lognormal",
+    )
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--plan-execution",
+        choices=("interactive", "deterministic", "auto"),
+        default="auto",
+    )
+    parser.add_argument("--max-concurrent-requests", type=int, default=16)
+    parser.add_argument(
+        "--stream", action=argparse.BooleanOptionalAction, default=False
+    )
+    parser.add_argument(
+        "--intent-cache", action=argparse.BooleanOptionalAction, default=True
+    )
+    parser.add_argument(
+        "--local-classifier", action=argparse.BooleanOptionalAction, default=True
+    )
+    parser.add_argument(
+        "--plan-cache", action=argparse.BooleanOptionalAction, default=True
+    )
+    parser.add_argument(
+        "--conversation-dir",
+        help="Keep the replayed conversations here instead of a temporary directory",
+    )
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--trace", help="Record tracing spans to this JSONL file")
+    parser.add_argument("--trace-sample-rate", type=float, default=1.0)
+    parser.add_argument(
+        "--metrics", help="Write the Prometheus metrics of the run to this file"
+    )
+    args = parser.parse_args()
+
+    if args.trace:
+        tracer.configure(args.trace, args.trace_sample_rate)
+
+    scripts = assign_conversations(
+        read_corpus(args.corpus), args.conversations, args.turns
+    )
+    if args.conversation_dir:
+        results = asyncio.run(run(args, scripts, args.conversation_dir))
+    else:
+        with tempfile.TemporaryDirectory() as conversation_dir:
+            results = asyncio.run(run(args, scripts, conversation_dir))
+
+    report = json.dumps({"config": vars(args), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+    latency = results["turn_latency_ms"]
+    print(
+        f"{results['turns']} turns in {results['duration_s']:.2f} s: "
+        f"{results['throughput_turns_per_s']:.0f} turns/s, latency p50 "
+        f"{latency['p50']:.1f} / p95 {latency['p95']:.1f} / p99 {latency['p99']:.1f} ms, "
+        f"{results['llm_calls_per_turn']:.2f} LLM calls/turn",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Compares the single-tool path against the planning path for simple tool requests.
+
+Every request is run once through handle_simple_tool and once through
+handle_complex_task against a FakeBackend with a fixed latency,
+and the number of LLM calls and the wall time per request are reported.
+
+Usage: python -m benchmarks.simple_tool [--requests 20] [--latency-ms 300]
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+from models.tools import ToolType
+from services.completion_backend import FakeBackend
+from services.conversation_manager import ConversationManager
+from services.llm_service import LLMService
+
+REQUESTS = [
+    "Calculate 12 * (3 + 4)",
+    "what is 2 ** 10?",
+    "How much is seventeen percent of 250?",
+    "Add up 19.99, 5.49 and 3.75 for me",
+]
+
+
+async def run(path: str, requests: list[str], latency_ms: float) -> tuple[int, float]:
+    backend = FakeBackend(latency_ms=latency_ms)
+    with tempfile.TemporaryDirectory() as conversation_dir:
+        manager = ConversationManager(
+            conversation_dir=conversation_dir, archive_after_days=None
+        )
+        service = LLMService(
+            stream_responses=False,
+            enable_intent_cache=False,
+            conversation_manager=manager,
+            completion_backend=backend,
+        )
+        start = time.perf_counter()
+        for user_message in requests:
+            conversation = manager.create_conversation()
+            if path == "simple":
+                await service.handle_simple_tool(
+                    conversation.id, user_message, ToolType.CALCULATOR.value
+                )
+            else:
+                await service.handle_complex_task(conversation.id, user_message)
+        elapsed = time.perf_counter() - start
+        await service.aclose()
+        manager.close()
+    return backend.calls, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    args = parser.parse_args()
+
+    requests = [REQUESTS[i % len(REQUESTS)] for i in range(args.requests)]
+
+    results = {}
+    for path in ("plan", "simple"):
+        calls, elapsed = asyncio.run(run(path, requests, args.latency_ms))
+        results[path] = (calls, elapsed)
+        print(
+            f"{path:>6}: {calls / len(requests):.2f} LLM calls/request, "
+            f"{elapsed / len(requests) * 1000:.0f} ms/request"
+        )
+
+    plan_calls, plan_time = results["plan"]
+    simple_calls, simple_time = results["simple"]
+    print(
+        f"Single-tool path saves {(plan_calls - simple_calls) / len(requests):.2f} "
+        f"LLM calls and {(plan_time - simple_time) / len(requests) * 1000:.0f} ms per request"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,12 @@ logger = logging.getLogger("agent-sandbox")
 logger.setLevel(logging.INFO)
 
 current_file_dir = os.path.dirname(os.path.abspath(__file__))
-log_file_path = os.path.join(current_file_dir, "agent-sandbox.log")
+# AGENT_LOG_FILE moves the log elsewhere; benchmarks set it so runs don't grow this one
+log_file_path = os.getenv("AGENT_LOG_FILE") or os.path.join(
+    current_file_dir, "agent-sandbox.log"
+)
 
-file_handler = logging.FileHandler(log_file_path)
+file_handler = logging.FileHandler(log_file_path, delay=True)
 
 formatter = logging.Formatter("%(asctime)s — %(name)s — %(levelname)s — %(message)s")
 file_handler.setFormatter(formatter)
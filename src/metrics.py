@@ -0,0 +1,385 @@
+import bisect
+import math
+import os
+import threading
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterable
+from logger import logger
+
+# Upper bounds in seconds, from fast local paths up to slow LLM calls
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramChild:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class _Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._children: dict[tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """The time series for these label values, in the order of the label names."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(
+                    f"{self.name} expects labels {self.label_names}, got {values}"
+                )
+            with self._lock:
+                child = self._children.setdefault(
+                    tuple(str(value) for value in values), self._new_child()
+                )
+                self._children[values] = child
+        return child
+
+    def _series(self) -> list[tuple[tuple[str, ...], object]]:
+        # Label values are stored once as passed and once as strings; report each series once
+        seen, series = set(), []
+        for values, child in list(self._children.items()):
+            if id(child) not in seen:
+                seen.add(id(child))
+                series.append((tuple(str(value) for value in values), child))
+        return series
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}"]
+        for values, child in self._series():
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class Counter(_Metric):
+    TYPE = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        """Increments the counter of a metric without labels."""
+        self.labels().inc(amount)
+
+    def _render_child(self, values, child) -> list[str]:
+        labels = _format_labels(self.label_names, values)
+        return [f"{self.name}{labels} {_format_value(child.value)}"]
+
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        """Records a value of a metric without labels."""
+        self.labels().observe(value)
+
+    def _render_child(self, values, child) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), child.counts):
+            cumulative += count
+            labels = _format_labels(
+                self.label_names + ("le",), values + (_format_value(bound),)
+            )
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.label_names, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    In-process counters and histograms, rendered in the Prometheus text
+    format. Recording only updates a few numbers under a per-series lock;
+    everything else happens when the metrics are rendered.
+
+    Values that components already count themselves, such as cache hits, are
+    read at render time by collectors registered with add_collector(), which
+    return (name, type, help, {label tuple: value}) tuples. Bound methods are
+    held by weak reference, so a component that is dropped without being
+    closed stops reporting instead of adding stale series to the totals.
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        # Collectors, or weak references to bound-method collectors
+        self._collectors: list = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def add_collector(self, collector: Callable[[], list[tuple]]):
+        if hasattr(collector, "__self__"):
+            collector = weakref.WeakMethod(collector)
+        with self._lock:
+            self._collectors.append(collector)
+
+    def remove_collector(self, collector: Callable[[], list[tuple]]):
+        with self._lock:
+            self._collectors = [
+                entry
+                for entry in self._collectors
+                if self._resolve(entry) not in (None, collector)
+            ]
+
+    @staticmethod
+    def _resolve(entry) -> Callable[[], list[tuple]] | None:
+        """The collector of an entry, or None once its owner was garbage collected."""
+        return entry() if isinstance(entry, weakref.WeakMethod) else entry
+
+    def _live_collectors(self) -> list[Callable[[], list[tuple]]]:
+        with self._lock:
+            collectors = [self._resolve(entry) for entry in self._collectors]
+            self._collectors = [
+                entry
+                for entry, collector in zip(self._collectors, collectors)
+                if collector is not None
+            ]
+        return [collector for collector in collectors if collector is not None]
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+
+        collected: dict[str, tuple[str, str, dict]] = {}
+        for collector in self._live_collectors():
+            try:
+                samples = collector()
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {e}")
+                continue
+            # Several instances of a component may report the same metric; add them up
+            for name, metric_type, help, series in samples:
+                _, _, totals = collected.setdefault(name, (metric_type, help, {}))
+                for labels, value in series.items():
+                    totals[labels] = totals.get(labels, 0) + value
+        for name, (metric_type, help, totals) in collected.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in totals.items():
+                label_text = _format_labels(
+                    (key for key, _ in labels), (v for _, v in labels)
+                )
+                lines.append(f"{name}{label_text} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        """Atomically writes the metrics for node_exporter's textfile collector."""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as file:
+            file.write(self.render())
+        os.replace(temp_path, path)
+
+
+class MetricsServer:
+    """Serves the registry at http://host:port/metrics from a daemon thread."""
+
+    def __init__(self, registry: MetricsRegistry, port: int, host: str = "127.0.0.1"):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="metrics-server", daemon=True
+        )
+        self.thread.start()
+        logger.info(f"Serving metrics on http://{host}:{self.port}/metrics")
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TextfileWriter:
+    """Rewrites a metrics textfile every `interval` seconds and once more on close()."""
+
+    def __init__(self, registry: MetricsRegistry, path: str, interval: float = 15.0):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run, name="metrics-textfile", daemon=True
+        )
+        self.thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self._write()
+
+    def _write(self):
+        try:
+            self.registry.write_textfile(self.path)
+        except OSError as e:
+            logger.error(f"Could not write metrics to {self.path}: {e}")
+
+    def close(self):
+        self._stopped.set()
+        self.thread.join()
+        self._write()
+
+
+registry = MetricsRegistry()
+
+LLM_REQUEST_SECONDS = registry.histogram(
+    "agent_llm_request_duration_seconds",
+    "Duration of LLM request attempts.",
+    ("stage", "model"),
+)
+LLM_REQUESTS = registry.counter(
+    "agent_llm_requests_total",
+    "LLM request attempts by outcome.",
+    ("stage", "model", "outcome"),
+)
+LLM_TOKENS = registry.counter(
+    "agent_llm_tokens_total",
+    "Tokens reported by the LLM provider; cached tokens are part of the input.",
+    ("stage", "kind"),
+)
+TOOL_SECONDS = registry.histogram(
+    "agent_tool_duration_seconds", "Duration of tool executions.", ("tool",)
+)
+TOOL_EXECUTIONS = registry.counter(
+    "agent_tool_executions_total", "Tool executions by outcome.", ("tool", "outcome")
+)
+INTENT_CLASSIFICATIONS = registry.counter(
+    "agent_intent_classifications_total",
+    "Intent classifications by source: cache, local classifier, LLM or error fallback.",
+    ("source",),
+)
+SAVE_SECONDS = registry.histogram(
+    "agent_conversation_save_duration_seconds",
+    "Time save_conversation spends on the calling thread.",
+)
+WRITE_SECONDS = registry.histogram(
+    "agent_conversation_write_duration_seconds",
+    "Duration of conversation writes to the store.",
+)
+
+
+def start_exporters(port: int | None = None, textfile: str | None = None) -> list:
+    """
+    Serves the registry on localhost:`port` and/or keeps it written to
+    `textfile`; returns the exporters so they can be closed.
+    """
+    exporters = []
+    if port:
+        exporters.append(MetricsServer(registry, port))
+    if textfile:
+        exporters.append(TextfileWriter(registry, textfile))
+    return exporters
+
+
+def start_exporters_from_env() -> list:
+    """Starts the exporters configured by AGENT_METRICS_PORT and AGENT_METRICS_TEXTFILE."""
+    port = os.getenv("AGENT_METRICS_PORT")
+    return start_exporters(
+        int(port) if port else None, os.getenv("AGENT_METRICS_TEXTFILE")
+    )
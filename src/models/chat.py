@@ -1,5 +1,5 @@
 from datetime import datetime
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from models.plan import Plan
 from enum import Enum
 
@@ -16,6 +16,14 @@ class MessageType(str, Enum):
     TOOL = "tool"
 
 
+def get_cached_tokens(usage: dict) -> int:
+    """Reads the cached prompt tokens litellm reports in prompt_tokens_details"""
+    details = usage.get("prompt_tokens_details") or {}
+    if isinstance(details, dict):
+        return details.get("cached_tokens") or 0
+    return getattr(details, "cached_tokens", None) or 0
+
+
 class Message(BaseModel):
     id: int
     content: str | Plan
@@ -30,11 +38,66 @@ class Message(BaseModel):
     )
     input_tokens: int = 0  # Number of input tokens for this message
     output_tokens: int = 0  # Number of output tokens for this message
+    cached_tokens: int = 0  # Input tokens served from the provider's prompt cache
+    token_count: int | None = (
+        None  # Size of the content itself, counted once by services.context_builder
+    )
+    stage: str | None = None  # Router stage of the completion that produced it
+    model: str | None = None  # Model that served that completion
 
     def set_token_usage(self, usage: dict):
         """Set token usage from LLM response"""
         self.input_tokens = usage.get("prompt_tokens", 0)
         self.output_tokens = usage.get("completion_tokens", 0)
+        self.cached_tokens = get_cached_tokens(usage)
+        self.stage = usage.get("stage")
+        self.model = usage.get("model")
+
+
+class TokenUsage(BaseModel):
+    """Input, output and cached token counts"""
+
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def add(self, message: Message):
+        self.input_tokens += message.input_tokens
+        self.output_tokens += message.output_tokens
+        self.cached_tokens += message.cached_tokens
+
+
+class ConversationUsage(TokenUsage):
+    """Running token totals of a conversation, overall and per stage and model"""
+
+    message_count: int = 0  # Number of leading messages included in the totals
+    by_stage: dict[str, TokenUsage] = Field(default_factory=dict)
+    by_model: dict[str, TokenUsage] = Field(default_factory=dict)
+
+    def add(self, message: Message):
+        super().add(message)
+        if not (message.input_tokens or message.output_tokens):
+            return
+        if message.stage:
+            self.by_stage.setdefault(message.stage, TokenUsage()).add(message)
+        if message.model:
+            self.by_model.setdefault(message.model, TokenUsage()).add(message)
+
+    def copy_totals(self) -> "ConversationUsage":
+        return self.model_copy(
+            update={
+                "by_stage": {
+                    stage: usage.model_copy() for stage, usage in self.by_stage.items()
+                },
+                "by_model": {
+                    model: usage.model_copy() for model, usage in self.by_model.items()
+                },
+            }
+        )
 
 
 class Conversation(BaseModel):
@@ -43,13 +106,106 @@ class Conversation(BaseModel):
     messages: list[Message]
     created_at: datetime = datetime.now()
     updated_at: datetime = datetime.now()
+    usage: ConversationUsage = Field(default_factory=ConversationUsage)
+
+    def add_message(self, message: Message):
+        """Appends a message and adds its token usage to the running totals"""
+        self.messages.append(message)
+        self.update_usage()
+
+    def update_usage(self) -> ConversationUsage:
+        """
+        Adds messages appended since the last update to the running totals.
+        The totals are replaced rather than changed in place, because the
+        persistence thread may be reading a copy that shares them.
+        """
+        usage = self.usage
+        count = len(self.messages)
+        if usage.message_count == count:
+            return usage
+        # Fewer messages than counted means the history was rewritten
+        usage = (
+            usage.copy_totals() if usage.message_count < count else ConversationUsage()
+        )
+        for message in self.messages[usage.message_count : count]:
+            usage.add(message)
+        usage.message_count = count
+        self.usage = usage
+        return usage
 
     def get_total_tokens(self) -> dict[str, int]:
-        """Calculate total input and output tokens for the conversation"""
-        total_input = sum(message.input_tokens for message in self.messages)
-        total_output = sum(message.output_tokens for message in self.messages)
+        """Returns the running input, output and cached token totals"""
+        usage = self.update_usage()
         return {
-            "input_tokens": total_input,
-            "output_tokens": total_output,
-            "total_tokens": total_input + total_output,
+            "input_tokens": usage.input_tokens,
+            "output_tokens": usage.output_tokens,
+            "cached_tokens": usage.cached_tokens,
+            "total_tokens": usage.total_tokens,
         }
+
+
+class ConversationSummary(BaseModel):
+    """Conversation metadata, as listed on the selection screen"""
+
+    id: int
+    title: str
+    created_at: datetime
+    updated_at: datetime
+    message_count: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+
+class MessageView(BaseModel):
+    """Lightweight read-only view of a stored message; plan content is not parsed"""
+
+    id: int
+    role: ChatRole
+    type: MessageType | None = None
+    content: str | None = None  # None when the message holds a Plan
+    input_tokens: int = 0
+    output_tokens: int = 0
+    token_count: int | None = None
+
+    @classmethod
+    def from_message(cls, message: Message) -> "MessageView":
+        return cls(
+            id=message.id,
+            role=message.role,
+            type=message.type,
+            content=message.content if isinstance(message.content, str) else None,
+            input_tokens=message.input_tokens,
+            output_tokens=message.output_tokens,
+            token_count=message.token_count,
+        )
+
+    @classmethod
+    def from_record(cls, record: dict) -> "MessageView":
+        content = record.get("content")
+        return cls(
+            id=record["id"],
+            role=record["role"],
+            type=record.get("type"),
+            content=content if isinstance(content, str) else None,
+            input_tokens=record.get("input_tokens", 0),
+            output_tokens=record.get("output_tokens", 0),
+            token_count=record.get("token_count"),
+        )
+
+
+class SearchHit(BaseModel):
+    """A message matching a full-text search query"""
+
+    conversation_id: int
+    message_id: int
+    role: ChatRole
+    snippet: str
+    score: float
+
+
+class StreamChunk(BaseModel):
+    """A partial piece of an assistant message that is still being generated"""
+
+    conversation_id: int
+    message_id: int  # Id the final Message will get once the stream ends
+    delta: str
@@ -13,6 +13,11 @@ class StepMessage(BaseModel):
     message: str = Field(..., description="A message to be sent to the user about this step.")
     plan_complete: bool = Field(..., description="Indicates if the entire plan has been completed after this step.")
 
+class ToolCall(BaseModel):
+    tool_type: ToolType = Field(..., description="The tool to execute.")
+    tool_input: str = Field(..., description="The input for the tool as a JSON string matching the tool's input schema.")
+    message: str = Field(..., description="A short message to the user about what is being done.")
+
 class Plan(BaseModel):
     steps: list[Step]
 
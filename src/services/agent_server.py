@@ -0,0 +1,322 @@
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import signal
+import weakref
+from typing import Awaitable, Callable
+from models.chat import Message, StreamChunk
+from services.completion_backend import FakeBackend
+from services.llm_service import LLMService
+from logger import logger
+import metrics
+from tracing import tracer
+
+# The function that forwards ui_callback events to the client whose turn produced them
+_current_event_sink: contextvars.ContextVar[
+    Callable[[dict], Awaitable[None]] | None
+] = contextvars.ContextVar("current_event_sink", default=None)
+
+
+class JsonRpcError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class AgentServer:
+    """
+    Headless JSON-RPC 2.0 server around one shared LLMService, so that many
+    clients and conversations are served from one process.
+
+    Clients connect to a Unix socket and send one JSON request per line. Every
+    request runs in its own task, so one client can drive several
+    conversations at once. While a `send_message` turn runs, the ui_callback
+    events it produces are sent to the requesting client as "event"
+    notifications carrying the request id, followed by the response. Turns on
+    the same conversation are queued in arrival order and never interleave;
+    turns on different conversations run concurrently within the LLMService
+    request limits.
+
+    Methods:
+        create_conversation() -> {"conversation_id"}
+        list_conversations() -> [ConversationSummary]
+        get_messages({"conversation_id", "limit"}) -> [MessageView]
+        send_message({"conversation_id", "message"}) -> {"conversation_id"}
+        search({"query", "limit"}) -> [SearchHit]
+    """
+
+    def __init__(self, socket_path: str, llm_service: LLMService | None = None):
+        self.socket_path = socket_path
+        self.llm_service = llm_service or LLMService()
+        self.llm_service.ui_callback = self._dispatch_event
+        self.conversation_manager = self.llm_service.conversation_manager
+
+        self._conversation_locks: weakref.WeakValueDictionary[int, asyncio.Lock] = (
+            weakref.WeakValueDictionary()
+        )
+        self._server: asyncio.AbstractServer | None = None
+        self._client_tasks: set[asyncio.Task] = set()
+        self._request_tasks: set[asyncio.Task] = set()
+        self.methods: dict[str, Callable[[dict], Awaitable]] = {
+            "create_conversation": self.create_conversation,
+            "list_conversations": self.list_conversations,
+            "get_messages": self.get_messages,
+            "send_message": self.send_message,
+            "search": self.search,
+        }
+        self.active_turns = 0
+        self.completed_turns = 0
+
+    async def _dispatch_event(self, event: str | Message | StreamChunk):
+        sink = _current_event_sink.get()
+        if sink is None:
+            return
+        if isinstance(event, StreamChunk):
+            payload = {"type": "chunk", **event.model_dump(mode="json")}
+        elif isinstance(event, Message):
+            payload = {"type": "message", "message": event.model_dump(mode="json")}
+        else:
+            payload = {"type": "text", "text": str(event)}
+        await sink(payload)
+
+    def _get_conversation_lock(self, conversation_id: int) -> asyncio.Lock:
+        lock = self._conversation_locks.get(conversation_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._conversation_locks[conversation_id] = lock
+        return lock
+
+    @staticmethod
+    def _conversation_id(params: dict) -> int:
+        try:
+            return int(params["conversation_id"])
+        except (KeyError, TypeError, ValueError):
+            raise JsonRpcError(-32602, "'conversation_id' must be an integer")
+
+    async def create_conversation(self, params: dict) -> dict:
+        conversation = await self.conversation_manager.create_conversation_async()
+        return {"conversation_id": conversation.id}
+
+    # Listing and searching flush pending writes and read the store, and
+    # loads may miss the cache; all of them run off the event loop
+
+    async def list_conversations(self, params: dict) -> list:
+        summaries = await asyncio.to_thread(
+            self.conversation_manager.list_conversations
+        )
+        return [summary.model_dump(mode="json") for summary in summaries]
+
+    async def get_messages(self, params: dict) -> list:
+        conversation_id = self._conversation_id(params)
+        limit = int(params.get("limit", 50))
+        views = await asyncio.to_thread(
+            self.conversation_manager.load_recent_messages, conversation_id, limit
+        )
+        return [view.model_dump(mode="json") for view in views]
+
+    async def search(self, params: dict) -> list:
+        hits = await asyncio.to_thread(
+            self.conversation_manager.search_messages,
+            str(params.get("query", "")),
+            int(params.get("limit", 20)),
+        )
+        return [hit.model_dump(mode="json") for hit in hits]
+
+    async def send_message(self, params: dict) -> dict:
+        conversation_id = self._conversation_id(params)
+        message = params.get("message")
+        if not isinstance(message, str) or not message.strip():
+            raise JsonRpcError(-32602, "'message' must be a non-empty string")
+        if not await asyncio.to_thread(
+            self.conversation_manager.load_conversation, conversation_id
+        ):
+            raise JsonRpcError(-32602, f"Conversation {conversation_id} not found")
+
+        async with self._get_conversation_lock(conversation_id):
+            self.active_turns += 1
+            try:
+                await self.llm_service.process_user_request(conversation_id, message)
+            finally:
+                self.active_turns -= 1
+                self.completed_turns += 1
+        return {"conversation_id": conversation_id}
+
+    async def _handle_request(self, line: bytes, send: Callable[[dict], Awaitable]):
+        request_id = None
+        try:
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise JsonRpcError(-32700, f"Parse error: {e}")
+            if not isinstance(request, dict) or not isinstance(
+                request.get("method"), str
+            ):
+                raise JsonRpcError(-32600, "Invalid request")
+            request_id = request.get("id")
+            method = self.methods.get(request["method"])
+            if method is None:
+                raise JsonRpcError(-32601, f"Method not found: {request['method']}")
+
+            async def send_event(event: dict):
+                await send(
+                    {
+                        "jsonrpc": "2.0",
+                        "method": "event",
+                        "params": {"request_id": request_id, **event},
+                    }
+                )
+
+            # Tasks spawned by the turn inherit the sink through the context
+            _current_event_sink.set(send_event)
+            result = await method(request.get("params") or {})
+            response = {"jsonrpc": "2.0", "id": request_id, "result": result}
+        except JsonRpcError as e:
+            response = {
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "error": {"code": e.code, "message": e.message},
+            }
+        except Exception as e:
+            logger.error(f"Error handling request {request_id}: {e}")
+            response = {
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "error": {"code": -32000, "message": str(e)},
+            }
+        if request_id is not None:
+            await send(response)
+
+    async def _handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        requests: set[asyncio.Task] = set()
+        write_lock = asyncio.Lock()
+
+        async def send(payload: dict):
+            async with write_lock:
+                if writer.is_closing():
+                    return
+                writer.write(json.dumps(payload).encode() + b"\n")
+                await writer.drain()
+
+        try:
+            while line := await reader.readline():
+                if not line.strip():
+                    continue
+                # Each request gets a fresh context, so event sinks never leak between requests
+                task = asyncio.create_task(
+                    self._handle_request(line, send), context=contextvars.Context()
+                )
+                requests.add(task)
+                task.add_done_callback(requests.discard)
+                self._request_tasks.add(task)
+                task.add_done_callback(self._request_tasks.discard)
+            # Let running turns finish so the conversation stays consistent
+            if requests:
+                await asyncio.gather(*requests, return_exceptions=True)
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _track_client(self, reader, writer):
+        task = asyncio.create_task(self._handle_client(reader, writer))
+        self._client_tasks.add(task)
+        task.add_done_callback(self._client_tasks.discard)
+
+    async def start(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = await asyncio.start_unix_server(
+            self._track_client, path=self.socket_path, limit=16 * 1024 * 1024
+        )
+        logger.info(f"Agent server listening on {self.socket_path}")
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        # Stop reading from clients, but let turns in progress finish
+        for task in self._client_tasks:
+            task.cancel()
+        if self._request_tasks:
+            await asyncio.gather(*self._request_tasks, return_exceptions=True)
+        await self.llm_service.aclose()
+        self.conversation_manager.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    async def serve_forever(self):
+        await self.start()
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        try:
+            await stop.wait()
+        finally:
+            logger.info("Shutting down agent server")
+            await self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve LLMService over JSON-RPC on a Unix socket."
+    )
+    parser.add_argument("--socket", default=os.path.join(os.getcwd(), "agent.sock"))
+    parser.add_argument(
+        "--fake-backend",
+        action="store_true",
+        help="Answer with a local FakeBackend instead of the LLM provider",
+    )
+    parser.add_argument("--fake-latency-ms", type=float, default=0.0)
+    parser.add_argument(
+        "--trace",
+        default=os.getenv("AGENT_TRACE_FILE"),
+        help="Append tracing spans as OTLP/JSON lines to this file",
+    )
+    parser.add_argument(
+        "--trace-sample-rate",
+        type=float,
+        default=float(os.getenv("AGENT_TRACE_SAMPLE_RATE", "1.0")),
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=int(os.getenv("AGENT_METRICS_PORT", "0")),
+        help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics",
+    )
+    parser.add_argument(
+        "--metrics-textfile",
+        default=os.getenv("AGENT_METRICS_TEXTFILE"),
+        help="Keep Prometheus metrics written to this file",
+    )
+    args = parser.parse_args()
+
+    if args.trace:
+        tracer.configure(args.trace, args.trace_sample_rate)
+    exporters = metrics.start_exporters(args.metrics_port, args.metrics_textfile)
+
+    llm_service = None
+    if args.fake_backend:
+        llm_service = LLMService(
+            completion_backend=FakeBackend(
+                latency_ms=args.fake_latency_ms, latency_distribution="lognormal"
+            )
+        )
+
+    print(f"Starting AI Agent server on {args.socket}")
+    try:
+        asyncio.run(AgentServer(args.socket, llm_service).serve_forever())
+    finally:
+        for exporter in exporters:
+            exporter.close()
+        tracer.shutdown()
+
+
+if __name__ == "__main__":
+    main()
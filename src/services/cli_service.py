@@ -12,7 +12,9 @@ from prompt_toolkit.key_binding import KeyBindings
 from prompt_toolkit.document import Document
 
 from logger import logger
-from models.chat import ChatRole, Conversation, Message, MessageType
+import metrics
+from tracing import tracer
+from models.chat import ChatRole, Conversation, Message, MessageType, StreamChunk
 from services.llm_service import LLMService
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -29,23 +31,40 @@ class CLIService:
         self.conversation: Conversation = None
 
         self.is_processing = False
+        self.streaming_message_id = None
         self.mode = "selection"
         self.input_height = 2
 
         self.setup_ui()
 
-    async def _ui_update_callback(self, message: str | Message):
+    async def _ui_update_callback(self, message: str | Message | StreamChunk):
         await self.ui_update_queue.put(message)
 
     async def _process_ui_updates(self):
         while True:
             message = await self.ui_update_queue.get()
-            if isinstance(message, Message):
-                message = self.get_formatted_message(message)
-            else:
-                message = f"[Assistant]: {message}"
-
-            self.append_to_view(f"{message}\n")
+            if isinstance(message, StreamChunk):
+                if self.streaming_message_id != message.message_id:
+                    self.streaming_message_id = message.message_id
+                    self.append_to_view("[Assistant]: ")
+                self.append_to_view(message.delta)
+                self.ui_update_queue.task_done()
+                continue
+
+            with tracer.span("ui.render") as span:
+                if isinstance(message, Message):
+                    span.set_attribute("message.id", message.id)
+                    if message.id == self.streaming_message_id:
+                        # Already shown token by token; just terminate the line
+                        self.streaming_message_id = None
+                        message = "\n"
+                    else:
+                        message = self.get_formatted_message(message)
+                else:
+                    message = f"[Assistant]: {message}"
+
+                self.append_to_view(f"{message}\n")
+                span.set_attribute("ui.view_bytes", len(self.view_buffer.text))
             self.ui_update_queue.task_done()
 
     def switch_mode(self, mode: str):
@@ -64,11 +83,27 @@ class CLIService:
             if hasattr(self, "input_buffer"):
                 self.app.layout.focus(self.input_buffer)
 
+    @staticmethod
+    def format_token_breakdown(totals: dict) -> str:
+        """Formats per-stage or per-model TokenUsage totals, largest first."""
+        ordered = sorted(totals.items(), key=lambda item: -item[1].total_tokens)
+        return ", ".join(f"{name} {usage.total_tokens}" for name, usage in ordered)
+
     def get_header_text(self):
         if self.mode == "conversation" and self.conversation:
             try:
                 token_info = self.conversation.get_total_tokens()
-                return f"AI Agent CLI - CWD: {self.working_dir} | Tokens: {token_info['total_tokens']} (In: {token_info['input_tokens']}, Out: {token_info['output_tokens']})"
+                header = f"AI Agent CLI - CWD: {self.working_dir} | Tokens: {token_info['total_tokens']} (In: {token_info['input_tokens']}, Out: {token_info['output_tokens']})"
+                usage = self.conversation.usage
+                if usage.by_stage:
+                    header += (
+                        f" | By stage: {self.format_token_breakdown(usage.by_stage)}"
+                    )
+                if usage.by_model:
+                    header += (
+                        f" | By model: {self.format_token_breakdown(usage.by_model)}"
+                    )
+                return header
             except Exception as e:
                 logger.error(f"Could not get token info: {e}")
         return f"AI Agent CLI - CWD: {self.working_dir}"
@@ -198,11 +233,11 @@ class CLIService:
         self.app.invalidate()
 
     def update_selection_display(self):
-        self.conversations = self.conversation_manager.load_conversations()
+        self.conversations = self.conversation_manager.list_conversations()
         formatted_text = "Conversations:\n"
-        for idx, conv in self.conversations.items():
+        for conv in self.conversations:
             created_date = conv.created_at.strftime("%Y-%m-%d-%H:%M:%S")
-            formatted_text += f"{idx:2}. {conv.title:<30} {created_date:>10}\n"
+            formatted_text += f"{conv.id:2}. {conv.title:<30} {created_date:>10}\n"
         formatted_text += " +. Create New Conversation"
         self.view_buffer.set_document(Document(formatted_text), bypass_readonly=True)
         self.app.invalidate()
@@ -231,9 +266,31 @@ class CLIService:
         new_conversation = self.conversation_manager.create_conversation()
         self.open_conversation(new_conversation.id)
 
+    def show_search_results(self, query: str):
+        hits = self.conversation_manager.search_messages(query)
+        if not hits:
+            self.append_to_view(f"[Search]: No messages found for '{query}'\n")
+            return
+        formatted_text = f"[Search]: {len(hits)} result(s) for '{query}'\n"
+        for hit in hits:
+            formatted_text += f"  {hit.conversation_id:>4}. #{hit.message_id:<4} [{hit.role.value}] {hit.snippet}\n"
+        self.append_to_view(formatted_text)
+
     async def send_message_async(self):
         message = self.input_buffer.text.strip()
-        if message:
+        if message.startswith("/search "):
+            self.input_buffer.text = ""
+            self.show_search_results(message[len("/search ") :].strip())
+        elif message in ("/plancache on", "/plancache off"):
+            self.input_buffer.text = ""
+            enabled = message.endswith("on")
+            if self.llm_service.set_plan_cache_enabled(self.conversation.id, enabled):
+                self.append_to_view(
+                    f"[System]: Plan reuse {'enabled' if enabled else 'disabled'} for this conversation.\n"
+                )
+            else:
+                self.append_to_view("[System]: The plan cache is disabled.\n")
+        elif message:
             self.is_processing = True
             self.input_buffer.text = ""
             self.append_to_view(f"[User]: {message}\n")
@@ -266,6 +323,8 @@ class CLIService:
                 await ui_task
             except asyncio.CancelledError:
                 pass
+            await self.llm_service.aclose()
+            self.conversation_manager.close()
 
     def run(self):
         print(
@@ -281,6 +340,8 @@ def main():
         sys.exit(1)
 
     print(f"Starting AI Agent CLI in directory: {working_dir}")
+    tracer.configure_from_env()
+    exporters = metrics.start_exporters_from_env()
     try:
         chat_app = CLIService(working_dir)
         if len(sys.argv) > 1:
@@ -294,6 +355,10 @@ def main():
     except Exception as e:
         logger.error(f"An error occurred: {e}")
         sys.exit(1)
+    finally:
+        for exporter in exporters:
+            exporter.close()
+        tracer.shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,378 @@
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import types
+import typing
+from abc import ABC, abstractmethod
+from enum import Enum
+from types import SimpleNamespace
+from typing import Callable
+import litellm
+from litellm import acompletion
+from pydantic import BaseModel
+from models.intent import IntentClassification, IntentType
+from models.plan import Plan, Step, StepMessage, ToolCall
+from models.tools import ToolType
+
+# Matches the steps of a plan as rendered by Plan.__str__
+_PLAN_STEP_PATTERN = re.compile(
+    r"^Step (?P<step_id>\d+):\n  Thought: (?P<thought>.*)\n"
+    r"(?:  Tool: (?:ToolType\.)?(?P<tool>\w+)\n)?(?:  Tool Input: (?P<tool_input>.*)\n)?",
+    re.MULTILINE,
+)
+_FOLLOWUP_PATTERN = re.compile(r"previous step \(Step (\d+)\)")
+_FAILED_STEP_PATTERN = re.compile(r"^Step (\d+) failed\.", re.MULTILINE)
+_WORDS = (
+    "the result of this step is ready and the next part of the task uses it".split()
+)
+
+
+class CompletionBackend(ABC):
+    """
+    Performs the chat completions of the ModelRouter. Implementations accept
+    the keyword arguments of litellm.acompletion and return objects shaped like
+    its responses: `choices[0].message.content` and `usage`, or for
+    `stream=True` an async iterator of chunks with `choices[0].delta.content`
+    and, on the last chunk, `usage`.
+    """
+
+    @abstractmethod
+    async def complete(self, **kwargs):
+        pass
+
+    async def close(self):
+        """Override this method to release resources held by the backend"""
+        pass
+
+
+class LiteLLMBackend(CompletionBackend):
+    """Sends completions to the provider of the model through litellm."""
+
+    async def complete(self, **kwargs):
+        return await acompletion(**kwargs)
+
+
+def generate_payload(schema: type[BaseModel], rng: random.Random) -> BaseModel:
+    """Builds a valid instance of a pydantic model by filling every field from its type."""
+    return schema(
+        **{
+            name: _generate_value(field.annotation, name, rng)
+            for name, field in schema.model_fields.items()
+        }
+    )
+
+
+def _generate_value(annotation, name: str, rng: random.Random):
+    origin = typing.get_origin(annotation)
+    if origin in (typing.Union, types.UnionType):
+        options = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        return _generate_value(options[0], name, rng) if options else None
+    if origin is list:
+        (item,) = typing.get_args(annotation) or (str,)
+        return [_generate_value(item, name, rng) for _ in range(rng.randint(1, 3))]
+    if origin is dict:
+        return {}
+    if isinstance(annotation, type):
+        if issubclass(annotation, BaseModel):
+            return generate_payload(annotation, rng)
+        if issubclass(annotation, Enum):
+            return rng.choice(list(annotation))
+        if issubclass(annotation, bool):
+            return rng.random() < 0.5
+        if issubclass(annotation, int):
+            return rng.randint(1, 9)
+        if issubclass(annotation, float):
+            return round(rng.random(), 3)
+    return f"{name} {rng.randint(0, 9999)}"
+
+
+class FakeBackend(CompletionBackend):
+    """
+    Deterministic local stand-in for an LLM provider, for benchmarks and load
+    tests that should measure our own overhead without network calls or cost.
+
+    Responses follow the requested `response_format`:
+        IntentClassification picks an intent per user request, weighted by
+        `intent_weights`; simple tool requests suggest the calculator.
+        Plan chains `plan_steps` calculator steps through `$step_N_output`
+        placeholders.
+        StepMessage walks through the plan in the prompt, one step per call,
+        and completes it after the last step.
+        ToolCall and Step return calculator calls.
+        Any other pydantic model is filled in from its field types, and plain
+        text requests get a short reply.
+    `responses` maps a response_format name ("text" for plain completions) to a
+    function of the prompt messages that returns a model or a string, to script
+    specific answers.
+
+    The same prompt always gets the same answer. Latency, usage and failures
+    are drawn from a random generator seeded with `seed`:
+        Every request waits a latency from `latency_distribution` ("fixed",
+        "exponential" or "lognormal" with `latency_sigma`) around a median of
+        `latency_ms`, plus `ms_per_token` for every completion token, which
+        streaming responses spread over their chunks.
+        Usage estimates four characters per token; a system prompt that was
+        sent before is reported as cached, like a provider prompt cache.
+        Requests fail with a ServiceUnavailableError with probability
+        `failure_rate`, or the rate of their model in `model_failure_rates`.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        latency_distribution: str = "fixed",
+        latency_sigma: float = 0.5,
+        ms_per_token: float = 0.0,
+        failure_rate: float = 0.0,
+        model_failure_rates: dict[str, float] | None = None,
+        intent_weights: dict[IntentType, float] | None = None,
+        plan_steps: int = 3,
+        reply_words: int = 40,
+        responses: dict[str, Callable[[list[dict]], BaseModel | str]] | None = None,
+        seed: int = 0,
+    ):
+        if latency_distribution not in ("fixed", "exponential", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {latency_distribution}")
+        self.latency_ms = latency_ms
+        self.latency_distribution = latency_distribution
+        self.latency_sigma = latency_sigma
+        self.ms_per_token = ms_per_token
+        self.failure_rate = failure_rate
+        self.model_failure_rates = model_failure_rates or {}
+        self.intent_weights = intent_weights or {
+            IntentType.CONVERSATIONAL: 0.4,
+            IntentType.SIMPLE_TOOL: 0.3,
+            IntentType.COMPLEX_TASK: 0.3,
+        }
+        self.plan_steps = plan_steps
+        self.reply_words = reply_words
+        self.responses = responses or {}
+        self.rng = random.Random(seed)
+
+        self.calls = 0
+        self.failures = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._seen_prefixes: set[str] = set()
+
+    @staticmethod
+    def _stable_fraction(text: str) -> float:
+        """A number in [0, 1) that only depends on the text."""
+        digest = hashlib.blake2b(text.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big") / 2**64
+
+    @staticmethod
+    def _text_of(content) -> str:
+        if isinstance(content, list):
+            return "".join(block.get("text", "") for block in content)
+        return content or ""
+
+    def _latency(self) -> float:
+        """Draws the latency of one request in seconds."""
+        if self.latency_ms <= 0:
+            return 0.0
+        if self.latency_distribution == "exponential":
+            latency_ms = self.rng.expovariate(math.log(2) / self.latency_ms)
+        elif self.latency_distribution == "lognormal":
+            latency_ms = self.rng.lognormvariate(
+                math.log(self.latency_ms), self.latency_sigma
+            )
+        else:
+            latency_ms = self.latency_ms
+        return latency_ms / 1000
+
+    def _usage(self, messages: list[dict], content: str) -> dict:
+        texts = [self._text_of(message.get("content")) for message in messages]
+        prompt_tokens = sum(len(text) for text in texts) // 4 + 1
+        completion_tokens = len(content) // 4 + 1
+
+        # Leading system messages form the cacheable prefix of a prompt
+        prefix = []
+        for message, text in zip(messages, texts):
+            if message.get("role") != "system":
+                break
+            prefix.append(text)
+        prefix_key = "\0".join(prefix)
+        cached_tokens = 0
+        if prefix_key in self._seen_prefixes:
+            cached_tokens = len(prefix_key) // 4
+        elif prefix:
+            self._seen_prefixes.add(prefix_key)
+
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+
+    def _reply(self, prompt: str) -> str:
+        rng = random.Random(prompt)
+        return " ".join(
+            rng.choice(_WORDS) for _ in range(self.reply_words)
+        ).capitalize()
+
+    def _intent(self, prompt: str) -> IntentClassification:
+        point = self._stable_fraction(prompt) * sum(self.intent_weights.values())
+        for intent_type, weight in self.intent_weights.items():
+            point -= weight
+            if point < 0:
+                break
+        return IntentClassification(
+            intent_type=intent_type,
+            reasoning=f"Fake classification as {intent_type.value}.",
+            suggested_tool=(
+                ToolType.CALCULATOR.value
+                if intent_type == IntentType.SIMPLE_TOOL
+                else None
+            ),
+        )
+
+    def _plan(self, prompt: str) -> Plan:
+        start = int(self._stable_fraction(prompt) * 100)
+        steps = [
+            Step(
+                step_id=1,
+                thought="Start with the first value.",
+                tool_type=ToolType.CALCULATOR,
+                tool_input=json.dumps({"expression": f"{start} + 1"}),
+            )
+        ]
+        for step_id in range(2, self.plan_steps + 1):
+            steps.append(
+                Step(
+                    step_id=step_id,
+                    thought=f"Build on the result of step {step_id - 1}.",
+                    tool_type=ToolType.CALCULATOR,
+                    tool_input=json.dumps(
+                        {"expression": f"$step_{step_id - 1}_output * 2"}
+                    ),
+                )
+            )
+        return Plan(steps=steps)
+
+    def _step_message(self, prompt: str) -> StepMessage:
+        steps = [
+            Step(
+                step_id=int(match["step_id"]),
+                thought=match["thought"],
+                tool_type=ToolType.__members__.get((match["tool"] or "").upper()),
+                tool_input=match["tool_input"],
+            )
+            for match in _PLAN_STEP_PATTERN.finditer(prompt)
+        ] or self._plan(prompt).steps
+
+        followup = _FOLLOWUP_PATTERN.search(prompt)
+        if followup is None:
+            return StepMessage(
+                step=steps[0], message=steps[0].thought, plan_complete=False
+            )
+        finished = int(followup.group(1))
+        remaining = [step for step in steps if step.step_id > finished]
+        if not remaining:
+            return StepMessage(
+                step=steps[-1], message=self._reply(prompt), plan_complete=True
+            )
+        return StepMessage(
+            step=remaining[0], message=remaining[0].thought, plan_complete=False
+        )
+
+    def _repaired_step(self, prompt: str) -> Step:
+        failed = _FAILED_STEP_PATTERN.search(prompt)
+        return Step(
+            step_id=int(failed.group(1)) if failed else 1,
+            thought="Retry with a fixed input.",
+            tool_type=ToolType.CALCULATOR,
+            tool_input=json.dumps({"expression": "1 + 1"}),
+        )
+
+    def _content(self, response_format, messages: list[dict]) -> str:
+        name = response_format.__name__ if response_format else "text"
+        prompt = self._text_of(messages[-1].get("content")) if messages else ""
+
+        if name in self.responses:
+            payload = self.responses[name](messages)
+        elif response_format is None:
+            payload = self._reply(prompt)
+        elif response_format is IntentClassification:
+            payload = self._intent(prompt)
+        elif response_format is Plan:
+            payload = self._plan(prompt)
+        elif response_format is StepMessage:
+            payload = self._step_message(prompt)
+        elif response_format is ToolCall:
+            payload = ToolCall(
+                tool_type=ToolType.CALCULATOR,
+                tool_input=json.dumps({"expression": "6 * 7"}),
+                message="Calculating that for you.",
+            )
+        elif response_format is Step:
+            payload = self._repaired_step(prompt)
+        else:
+            payload = generate_payload(response_format, random.Random(prompt))
+
+        if isinstance(payload, BaseModel):
+            return payload.model_dump_json()
+        return payload
+
+    async def complete(
+        self,
+        model: str = "fake",
+        messages: list[dict] | None = None,
+        response_format=None,
+        stream: bool = False,
+        **kwargs,
+    ):
+        self.calls += 1
+        messages = messages or []
+        latency = self._latency()
+        failure_rate = self.model_failure_rates.get(model, self.failure_rate)
+        if failure_rate and self.rng.random() < failure_rate:
+            if latency:
+                await asyncio.sleep(latency)
+            self.failures += 1
+            raise litellm.ServiceUnavailableError(
+                message="Injected failure", llm_provider="fake", model=model
+            )
+
+        content = self._content(response_format, messages)
+        usage = self._usage(messages, content)
+        if stream:
+            return self._stream(model, content, usage, latency)
+
+        latency += usage["completion_tokens"] * self.ms_per_token / 1000
+        if latency:
+            await asyncio.sleep(latency)
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=usage,
+        )
+
+    async def _stream(self, model: str, content: str, usage: dict, latency: float):
+        if latency:
+            await asyncio.sleep(latency)
+        chunk_size = 16
+        for start in range(0, len(content), chunk_size):
+            piece = content[start : start + chunk_size]
+            if self.ms_per_token:
+                await asyncio.sleep(len(piece) / 4 * self.ms_per_token / 1000)
+            yield SimpleNamespace(
+                model=model,
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))],
+                usage=None,
+            )
+        yield SimpleNamespace(model=model, choices=[], usage=usage)
+
+    def get_stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
@@ -0,0 +1,148 @@
+import litellm
+from models.chat import Message, MessageType, MessageView, get_cached_tokens
+from logger import logger
+
+
+def count_tokens(text: str) -> int:
+    """Counts tokens with litellm's bundled tokenizer, which works offline."""
+    if not text:
+        return 0
+    try:
+        return litellm.token_counter(text=text)
+    except Exception as e:
+        logger.warning(f"Token counting failed, estimating instead: {e}")
+        return len(text) // 4
+
+
+def message_text(message: Message | MessageView) -> str:
+    """The text of a message as it is sent to the LLM; plans are rendered as text."""
+    if message.content is None:
+        return "[Plan]"
+    return str(message.content)
+
+
+class ContextBuilder:
+    """
+    Assembles LLM context within per-stage token budgets instead of fixed
+    message counts. Every message is tokenized once; the count is cached in
+    its `token_count` field, which is persisted with the message. Recent
+    messages are added newest-first until the budget of the stage is used up,
+    and tool outputs larger than `max_tool_output_tokens` are cut down to their
+    head and tail.
+    """
+
+    DEFAULT_BUDGETS = {
+        "classify": 1000,
+        "chat": 4000,
+        "step": 4000,
+    }
+
+    def __init__(
+        self,
+        stage_budgets: dict[str, int] | None = None,
+        max_tool_output_tokens: int = 1000,
+    ):
+        self.stage_budgets = {**self.DEFAULT_BUDGETS, **(stage_budgets or {})}
+        self.max_tool_output_tokens = max_tool_output_tokens
+        self._stats: dict[str, dict] = {}
+
+    def _stage_stats(self, stage: str) -> dict:
+        if stage not in self._stats:
+            self._stats[stage] = {
+                "calls": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "cached_tokens": 0,
+                "context_tokens": 0,
+                "messages_dropped": 0,
+                "outputs_truncated": 0,
+            }
+        return self._stats[stage]
+
+    def message_tokens(self, message: Message | MessageView) -> int:
+        """Returns the token count of a message, counting it only the first time."""
+        if message.token_count is None:
+            message.token_count = count_tokens(message_text(message))
+        return message.token_count
+
+    def _context_tokens(self, message: Message | MessageView) -> int:
+        tokens = self.message_tokens(message)
+        if message.type == MessageType.TOOL:
+            return min(tokens, self.max_tool_output_tokens)
+        return tokens
+
+    def select_messages(
+        self, stage: str, messages: list[Message | MessageView]
+    ) -> list[Message | MessageView]:
+        """
+        Returns the most recent messages that fit into the budget of `stage`,
+        oldest first. Tool messages count with their truncated size, see
+        render_content.
+        """
+        budget = self.stage_budgets[stage]
+        selected = []
+        used = 0
+        for message in reversed(messages):
+            tokens = self._context_tokens(message)
+            if used + tokens > budget:
+                break
+            selected.append(message)
+            used += tokens
+
+        stats = self._stage_stats(stage)
+        stats["context_tokens"] += used
+        stats["messages_dropped"] += len(messages) - len(selected)
+        return selected[::-1]
+
+    def render_content(self, stage: str, message: Message | MessageView) -> str:
+        """The content of a message for the context, with tool outputs truncated."""
+        text = message_text(message)
+        if (
+            message.type == MessageType.TOOL
+            and self.message_tokens(message) > self.max_tool_output_tokens
+        ):
+            return self.truncate(text, stage=stage)
+        return text
+
+    def truncate(
+        self, text: str, max_tokens: int | None = None, stage: str = "step"
+    ) -> str:
+        """
+        Shortens text to about `max_tokens` by keeping its head and tail, which
+        for command and code output hold the command echo and the final result
+        or error. Text within the limit is returned unchanged.
+        """
+        max_tokens = max_tokens or self.max_tool_output_tokens
+        tokens = litellm.encode(model="", text=text)
+        if len(tokens) <= max_tokens:
+            return text
+
+        head = max_tokens * 2 // 3
+        tail = max_tokens - head
+        self._stage_stats(stage)["outputs_truncated"] += 1
+        return (
+            litellm.decode(model="", tokens=tokens[:head])
+            + f"\n... [{len(tokens) - max_tokens} tokens truncated] ...\n"
+            + litellm.decode(model="", tokens=tokens[-tail:])
+        )
+
+    def record_usage(self, stage: str, usage: dict | None):
+        """Adds the token usage reported for one completion of `stage`."""
+        stats = self._stage_stats(stage)
+        stats["calls"] += 1
+        if usage:
+            stats["prompt_tokens"] += usage.get("prompt_tokens", 0) or 0
+            stats["completion_tokens"] += usage.get("completion_tokens", 0) or 0
+            stats["cached_tokens"] += get_cached_tokens(usage)
+
+    def get_stats(self) -> dict:
+        """Returns per-stage token usage, including averages per call."""
+        return {
+            stage: {
+                **stats,
+                "avg_prompt_tokens": (
+                    stats["prompt_tokens"] / stats["calls"] if stats["calls"] else 0.0
+                ),
+            }
+            for stage, stats in self._stats.items()
+        }
@@ -1,17 +1,79 @@
 import os
-import json
+import threading
+import time
+from collections import OrderedDict
 from typing import Optional
-from models.chat import Conversation, Message, MessageType, ChatRole
+from models.chat import (
+    Conversation,
+    ConversationSummary,
+    Message,
+    MessageView,
+    MessageType,
+    ChatRole,
+    SearchHit,
+)
+from storage.base_store import BaseConversationStore
+from storage.json_store import JsonConversationStore
+from storage.sqlite_store import SqliteConversationStore
+from storage.search_index import SearchIndex
+from services.persistence_scheduler import Durability, PersistenceScheduler
+from services.context_builder import count_tokens, message_text
 from logger import logger
+from metrics import SAVE_SECONDS
+from tracing import tracer
 
 
 class ConversationManager:
-    def __init__(self):
+    STORAGE_MODES = ["snapshot", "append", "sqlite"]
+
+    def __init__(
+        self,
+        storage_mode: str = "append",
+        compact_threshold: int = 200,
+        cache_size: int = 32,
+        cache_max_bytes: int = 64 * 1024 * 1024,
+        durability: Durability = Durability.INTERVAL,
+        flush_interval_ms: int = 250,
+        store: BaseConversationStore | None = None,
+        enable_search: bool = True,
+        conversation_dir: str | None = None,
+        archive_after_days: float | None = None,
+    ):
+        """
+        storage_mode selects the built-in store when no `store` is given:
+            "snapshot" rewrites conversation_N.json on every save.
+            "append" appends new messages to a per-conversation log which is
+            compacted into the snapshot after `compact_threshold` messages.
+            "sqlite" keeps everything in conversations/conversations.db.
+
+        Loaded conversations are kept in an LRU cache of at most `cache_size`
+        conversations and roughly `cache_max_bytes` of message content, so all
+        callers share the same live object. save_conversation never writes on
+        the calling thread: it hands the conversation to a PersistenceScheduler,
+        which coalesces saves and writes them from a background thread according
+        to `durability` (every message, every `flush_interval_ms`, or at the end
+        of the turn) and always on close().
+
+        With `enable_search`, every write also updates a full-text index in
+        conversations/search.db.
+
+        Archiving is opt-in: with `archive_after_days`, conversations that were
+        not written for that many days are moved to the store's compressed cold
+        tier by a background pass at startup.
+        """
+        if storage_mode not in self.STORAGE_MODES:
+            raise ValueError(
+                f"Invalid storage mode. Use one of: {', '.join(self.STORAGE_MODES)}."
+            )
+        self.storage_mode = storage_mode
+
         current_file_dir = os.path.dirname(os.path.abspath(__file__))
         project_root = os.path.dirname(current_file_dir)
 
         try:
-            self.CONVERSATION_DIR = os.path.join(project_root, "conversations")
+            self.CONVERSATION_DIR = conversation_dir or os.path.join(
+                project_root, "conversations"
+            )
         except Exception as e:
             logger.error(f"Failed to set conversation directory: {e}")
             self.CONVERSATION_DIR = "conversations"
@@ -28,6 +90,50 @@ class ConversationManager:
 
         self.system_message = None
 
+        if store is None:
+            if storage_mode == "sqlite":
+                store = SqliteConversationStore(
+                    os.path.join(self.CONVERSATION_DIR, "conversations.db")
+                )
+            else:
+                store = JsonConversationStore(
+                    self.CONVERSATION_DIR,
+                    append_log=storage_mode == "append",
+                    compact_threshold=compact_threshold,
+                )
+        self.store = store
+
+        self.cache_size = cache_size
+        self.cache_max_bytes = cache_max_bytes
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache: OrderedDict[int, Conversation] = OrderedDict()
+        # Estimated content size and number of measured messages per cached conversation
+        self._cache_sizes: dict[int, tuple[int, int]] = {}
+        self._cache_bytes = 0
+        self._cache_lock = threading.RLock()
+
+        self.scheduler = PersistenceScheduler(
+            self.store, durability=durability, flush_interval_ms=flush_interval_ms
+        )
+
+        self.search_index = None
+        if enable_search:
+            self.search_index = SearchIndex(
+                os.path.join(self.CONVERSATION_DIR, "search.db")
+            )
+            self.scheduler.add_write_listener(self.search_index.index_conversation)
+
+        self._archive_thread = None
+        if archive_after_days is not None:
+            self._archive_thread = threading.Thread(
+                target=self.archive_cold_conversations,
+                args=(archive_after_days,),
+                name="conversation-archiver",
+                daemon=True,
+            )
+            self._archive_thread.start()
+
     def _load_system_message(self):
         if not os.path.exists(self.system_message_path):
             raise ValueError(
@@ -47,51 +153,121 @@ class ConversationManager:
     def _create_conversation_dir(self):
         os.makedirs(self.CONVERSATION_DIR, exist_ok=True)
 
-    def _get_conversation_file_path(self, conversation_id: int) -> str:
-        return os.path.join(
-            self.CONVERSATION_DIR, f"conversation_{conversation_id}.json"
-        )
+    def list_conversations(self) -> list[ConversationSummary]:
+        """Lists conversation metadata without loading any messages."""
+        self.flush()
+        summaries = self.store.list_conversations()
+        logger.info(f"Listed {len(summaries)} conversations.")
+        return summaries
 
     def load_conversations(self) -> dict[int, Conversation]:
         conversations: dict[Conversation] = {}
-        for filename in os.listdir(self.CONVERSATION_DIR):
-            if filename.startswith("conversation_") and filename.endswith(".json"):
-                try:
-                    conversation_id_str = filename.replace("conversation_", "").replace(
-                        ".json", ""
-                    )
-                    conversation_id = int(conversation_id_str)
-
-                    file_path = self._get_conversation_file_path(conversation_id)
-                    with open(file_path, "r") as file:
-                        conversation_data = json.load(file)
-                        conversation = Conversation.model_validate(conversation_data)
-                        conversations[conversation_id] = conversation
-
-                except (ValueError, json.JSONDecodeError) as e:
-                    logger.error(f"Error loading conversation from {filename}: {e}")
-
-        conversations = dict(sorted(conversations.items(), key=lambda item: item[0]))
+        for summary in self.list_conversations():
+            conversation = self.load_conversation(summary.id)
+            if conversation:
+                conversations[summary.id] = conversation
+
         logger.info(f"Loaded {len(conversations)} conversations.")
 
         return conversations
 
     def load_conversation(self, conversation_id: int) -> Optional[Conversation]:
-        file_path = self._get_conversation_file_path(conversation_id)
-        if not os.path.exists(file_path):
-            logger.info(f"Conversation file {file_path} does not exist.")
-            return None
-        try:
-            with open(file_path, "r") as file:
-                conversation_data = json.load(file)
-                conversation = Conversation.model_validate(conversation_data)
-
+        with self._cache_lock:
+            conversation = self._cache.get(conversation_id)
+            if conversation is not None:
+                self.cache_hits += 1
+                self._cache.move_to_end(conversation_id)
                 return conversation
-        except (ValueError, json.JSONDecodeError) as e:
-            logger.error(f"Error loading conversation from {file_path}: {e}")
+            self.cache_misses += 1
+
+        # An evicted conversation may still be waiting to be written
+        conversation = self.scheduler.get_pending(
+            conversation_id
+        ) or self.store.read_conversation(conversation_id)
+        if conversation is None:
             return None
 
-    def create_conversation(self) -> Conversation:
+        with self._cache_lock:
+            # Another thread may have loaded it meanwhile; keep the shared object
+            if conversation_id in self._cache:
+                return self._cache[conversation_id]
+            self._cache_put(conversation)
+        return conversation
+
+    def load_recent_messages(self, conversation_id: int, n: int) -> list[MessageView]:
+        """
+        Returns views of the last n messages. Served from the cache when the
+        conversation is loaded, otherwise only the tail is read from the store.
+        """
+        if n <= 0:
+            return []
+        with self._cache_lock:
+            conversation = self._cache.get(conversation_id)
+            if conversation is not None:
+                self.cache_hits += 1
+                return [
+                    MessageView.from_message(message)
+                    for message in conversation.messages[-n:]
+                ]
+        conversation = self.scheduler.get_pending(conversation_id)
+        if conversation is not None:
+            return [
+                MessageView.from_message(message)
+                for message in conversation.messages[-n:]
+            ]
+        return self.store.read_recent_messages(conversation_id, n)
+
+    def _estimate_message_size(self, message: Message) -> int:
+        content = message.content
+        return len(content) if isinstance(content, str) else len(str(content))
+
+    def _cache_put(self, conversation: Conversation):
+        """Inserts or refreshes a conversation in the cache and enforces its limits."""
+        size, measured = self._cache_sizes.get(conversation.id, (0, 0))
+        if measured > len(conversation.messages):
+            size, measured = 0, 0
+        size += sum(
+            self._estimate_message_size(message)
+            for message in conversation.messages[measured:]
+        )
+        self._cache_bytes += size - self._cache_sizes.get(conversation.id, (0, 0))[0]
+        self._cache_sizes[conversation.id] = (size, len(conversation.messages))
+        self._cache[conversation.id] = conversation
+        self._cache.move_to_end(conversation.id)
+
+        while len(self._cache) > 1 and (
+            len(self._cache) > self.cache_size
+            or self._cache_bytes > self.cache_max_bytes
+        ):
+            evicted_id, _ = self._cache.popitem(last=False)
+            self._cache_bytes -= self._cache_sizes.pop(evicted_id, (0, 0))[0]
+            logger.info(f"Evicted conversation {evicted_id} from cache.")
+
+    def _cache_remove(self, conversation_id: int):
+        with self._cache_lock:
+            self._cache.pop(conversation_id, None)
+            self._cache_bytes -= self._cache_sizes.pop(conversation_id, (0, 0))[0]
+
+    def get_cache_stats(self) -> dict[str, int]:
+        """Returns hit/miss counters and current cache occupancy"""
+        with self._cache_lock:
+            return {
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "conversations": len(self._cache),
+                "bytes": self._cache_bytes,
+            }
+
+    def get_persistence_stats(self) -> dict[str, int]:
+        """Returns save request, write and coalescing counters"""
+        return self.scheduler.get_stats()
+
+    def _start_conversation(self) -> Conversation:
+        """
+        Builds a conversation with the next free id and queues it for writing.
+        The id is claimed right away through the cache, which
+        get_next_conversation_id consults.
+        """
         if not self.system_message:
             self._load_system_message()
 
@@ -113,45 +289,90 @@ class ConversationManager:
         self.save_conversation(conversation)
         return conversation
 
+    def create_conversation(self) -> Conversation:
+        conversation = self._start_conversation()
+        # Write through so the new id is claimed in the store right away
+        self.flush(conversation.id)
+        return conversation
+
+    async def create_conversation_async(self) -> Conversation:
+        """create_conversation() for the event loop; the write runs in the executor."""
+        conversation = self._start_conversation()
+        await self.scheduler.flush_async(conversation.id)
+        return conversation
+
     def save_conversation(self, conversation: Conversation):
         if not conversation or not conversation.id:
             logger.info("Conversation ID is missing.")
             return
 
-        file_path = self._get_conversation_file_path(conversation.id)
-        try:
-            with open(file_path, "w") as file:
-                conversation_json = conversation.model_dump()
-                conversation_json["created_at"] = conversation.created_at.isoformat()
-                conversation_json["updated_at"] = conversation.updated_at.isoformat()
-                for message in conversation_json["messages"]:
-                    message["created_at"] = message["created_at"].isoformat()
-                json.dump(conversation_json, file, indent=4)
-                logger.info(f"Conversation {conversation.id} saved to {file_path}.")
-        except IOError as e:
-            logger.error(f"Error saving conversation to {file_path}: {e}")
+        start = time.perf_counter()
+        with tracer.span(
+            "conversation.save",
+            **{
+                "conversation.id": conversation.id,
+                "conversation.messages": len(conversation.messages),
+            },
+        ):
+            # New messages are tokenized once here so their size is stored with them
+            for message in reversed(conversation.messages):
+                if message.token_count is not None:
+                    break
+                message.token_count = count_tokens(message_text(message))
+
+            with self._cache_lock:
+                self._cache_put(conversation)
+            self.scheduler.request_save(conversation)
+        SAVE_SECONDS.observe(time.perf_counter() - start)
+
+    def flush(self, conversation_id: int | None = None):
+        """Synchronously writes pending conversations, either one or all of them."""
+        self.scheduler.flush(conversation_id)
+
+    def end_turn(self, conversation_id: int):
+        """Marks the end of a turn; its pending write is issued off the calling thread."""
+        self.scheduler.end_turn(conversation_id)
+
+    def archive_cold_conversations(self, max_age_days: float) -> int:
+        """Moves conversations untouched for max_age_days into the cold tier."""
+        return self.store.archive_conversations(max_age_days * 24 * 60 * 60)
+
+    def search_messages(self, query: str, limit: int = 20) -> list[SearchHit]:
+        """Full-text search over all written messages, best matches first."""
+        if not self.search_index:
+            return []
+        self.flush()
+        return self.search_index.search(query, limit=limit)
+
+    def rebuild_search_index(self) -> int:
+        self.flush()
+        return self.search_index.rebuild(self.store) if self.search_index else 0
+
+    def close(self):
+        """Writes pending conversations, stops the writer thread and closes the store."""
+        if self._archive_thread:
+            self._archive_thread.join()
+            self._archive_thread = None
+        self.scheduler.close()
+        self.store.close()
+        if self.search_index:
+            self.search_index.close()
 
     def delete_conversation(self, conversation_id: int) -> bool:
-        file_path = self._get_conversation_file_path(conversation_id)
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        self._cache_remove(conversation_id)
+        self.scheduler.discard(conversation_id)
+        if self.search_index:
+            self.search_index.remove_conversation(conversation_id)
+        if self.store.delete_conversation(conversation_id):
             logger.info(f"Conversation {conversation_id} deleted.")
             return True
         else:
-            logger.info(f"Conversation file {file_path} does not exist.")
+            logger.info(f"Conversation {conversation_id} does not exist.")
             return False
 
     def get_next_conversation_id(self) -> int:
-        existing_files = [
-            f
-            for f in os.listdir(self.CONVERSATION_DIR)
-            if f.startswith("conversation_") and f.endswith(".json")
-        ]
-        if not existing_files:
-            return 1
-        else:
-            existing_ids = [
-                int(f.replace("conversation_", "").replace(".json", ""))
-                for f in existing_files
-            ]
-            return max(existing_ids) + 1
+        next_id = self.store.get_next_conversation_id()
+        with self._cache_lock:
+            if self._cache:
+                next_id = max(next_id, max(self._cache.keys()) + 1)
+        return next_id
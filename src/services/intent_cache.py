@@ -0,0 +1,177 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from models.intent import IntentClassification
+from logger import logger
+
+
+class IntentCache:
+    """
+    Two-tier cache of IntentClassification results: an in-memory LRU in front
+    of an on-disk SQLite table. Entries are content-addressed by the normalized
+    user message, the recent conversation context, the tool descriptions and
+    the model name, and expire after `ttl_seconds`.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS intent_cache (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_intent_cache_last_used
+            ON intent_cache (last_used);
+    """
+    # How many disk inserts happen between size checks
+    EVICTION_CHECK_INTERVAL = 100
+
+    def __init__(
+        self,
+        db_path: str | None = None,
+        max_memory_entries: int = 1024,
+        max_disk_entries: int = 50_000,
+        ttl_seconds: float = 7 * 24 * 60 * 60,
+    ):
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        # key -> (created_at, IntentClassification)
+        self._memory: OrderedDict[str, tuple[float, IntentClassification]] = (
+            OrderedDict()
+        )
+        self._inserts_since_eviction = 0
+        self._lock = threading.Lock()
+
+        self.connection = None
+        if db_path:
+            self.connection = sqlite3.connect(db_path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(self.SCHEMA)
+            self.connection.commit()
+
+    @staticmethod
+    def normalize_message(user_message: str) -> str:
+        """Lowercases, collapses whitespace and strips surrounding punctuation."""
+        normalized = re.sub(r"\s+", " ", user_message.lower()).strip()
+        return normalized.strip(" .!?")
+
+    def make_key(
+        self, user_message: str, context: str, tool_catalog_hash: str, model: str
+    ) -> str:
+        digest = hashlib.sha256()
+        for part in (
+            self.normalize_message(user_message),
+            hashlib.sha256(context.encode()).hexdigest(),
+            tool_catalog_hash,
+            model,
+        ):
+            digest.update(part.encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> IntentClassification | None:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, intent = entry
+                if now - created_at < self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return intent.model_copy()
+                del self._memory[key]
+
+            if self.connection is not None:
+                row = self.connection.execute(
+                    "SELECT value, created_at FROM intent_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] < self.ttl_seconds:
+                    with self.connection:
+                        self.connection.execute(
+                            "UPDATE intent_cache SET last_used = ? WHERE key = ?",
+                            (now, key),
+                        )
+                    intent = IntentClassification.model_validate_json(row[0])
+                    self._memory_put(key, row[1], intent)
+                    self.disk_hits += 1
+                    return intent.model_copy()
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, intent: IntentClassification):
+        now = time.time()
+        with self._lock:
+            self._memory_put(key, now, intent.model_copy())
+            if self.connection is None:
+                return
+            with self.connection:
+                self.connection.execute(
+                    """
+                    INSERT OR REPLACE INTO intent_cache (key, value, created_at, last_used)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    (key, intent.model_dump_json(), now, now),
+                )
+            self._inserts_since_eviction += 1
+            if self._inserts_since_eviction >= self.EVICTION_CHECK_INTERVAL:
+                self._inserts_since_eviction = 0
+                self._evict_disk(now)
+
+    def _memory_put(self, key: str, created_at: float, intent: IntentClassification):
+        self._memory[key] = (created_at, intent)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, now: float):
+        """Drops expired entries, then the least recently used ones above the size limit."""
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM intent_cache WHERE created_at < ?",
+                (now - self.ttl_seconds,),
+            )
+            (count,) = self.connection.execute(
+                "SELECT COUNT(*) FROM intent_cache"
+            ).fetchone()
+            if count > self.max_disk_entries:
+                self.connection.execute(
+                    """
+                    DELETE FROM intent_cache WHERE key IN (
+                        SELECT key FROM intent_cache ORDER BY last_used LIMIT ?
+                    )
+                    """,
+                    (count - self.max_disk_entries,),
+                )
+                logger.info(
+                    f"Evicted {count - self.max_disk_entries} intent cache entries."
+                )
+
+    def get_stats(self) -> dict[str, float]:
+        """Returns hit/miss counters and the overall hit rate"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (
+                    (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+                ),
+            }
+
+    def close(self):
+        with self._lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
@@ -0,0 +1,227 @@
+import argparse
+import json
+import math
+import os
+import re
+from collections import Counter
+from models.intent import IntentClassification, IntentType
+from models.tools import ToolType
+from logger import logger
+
+
+class LocalIntentClassifier:
+    """
+    Fast local pre-classifier that runs before the LLM. Unambiguous requests
+    (greetings, capability questions, bare arithmetic) are matched by rules;
+    everything else goes through a multinomial naive Bayes model trained on
+    logged LLM classifications. classify() returns None whenever it is not
+    confident enough, so the caller falls through to the LLM.
+    """
+
+    # The whole message must be greetings, so "hey run ls" still reaches the classifier
+    GREETING_PATTERN = re.compile(
+        r"^(?:(?:hi|hello|hey|yo|good (?:morning|afternoon|evening)|thanks|thank you|bye|goodbye)"
+        r"(?: (?:there|again|so much|a lot|all))?\W*)+$",
+        re.IGNORECASE,
+    )
+    CAPABILITY_PATTERN = re.compile(
+        r"^(what can you do|what are your (capabilities|features)|who are you|help)\W*$",
+        re.IGNORECASE,
+    )
+    ARITHMETIC_PATTERN = re.compile(
+        r"^(?:(?:please )?(?:calculate|compute|evaluate|what is|what's)\s+)?"
+        r"(?P<expression>[\d\s.+\-*/%()]*\d[\d\s.]*[+\-*/%][\d\s.+\-*/%()]*\d[\d\s.)]*)\s*[?=]?$",
+        re.IGNORECASE,
+    )
+    # Three numbers joined by one repeated separator, like 2024-01-05, 10/12/2024
+    # or 5.1.2024, are dates rather than arithmetic; "5-3" and "10/2" still count
+    DATE_LIKE_PATTERN = re.compile(
+        r"^\d{1,4}(?P<separator>[-/.])\d{1,2}(?P=separator)\d{1,4}$"
+    )
+    TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[^\sa-z0-9]")
+
+    def __init__(
+        self,
+        model_path: str | None = None,
+        threshold: float = 0.9,
+        min_examples: int = 50,
+    ):
+        self.model_path = model_path
+        self.threshold = threshold
+        self.min_examples = min_examples
+
+        self.label_counts: Counter = Counter()
+        self.token_counts: dict[str, Counter] = {}
+        self.label_token_totals: Counter = Counter()
+        self.vocabulary: set[str] = set()
+
+        if model_path and os.path.exists(model_path):
+            self.load(model_path)
+
+    def _tokenize(self, text: str) -> list[str]:
+        tokens = self.TOKEN_PATTERN.findall(text.lower())
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    @staticmethod
+    def _make_label(intent_type: str, suggested_tool: str | None) -> str:
+        return f"{intent_type}|{suggested_tool or ''}"
+
+    def _match_rules(self, user_message: str) -> IntentClassification | None:
+        message = user_message.strip()
+        if self.extract_expression(message):
+            return IntentClassification(
+                intent_type=IntentType.SIMPLE_TOOL,
+                reasoning="Local rule: bare arithmetic expression",
+                suggested_tool=ToolType.CALCULATOR.value,
+            )
+        if self.CAPABILITY_PATTERN.match(message) or self.GREETING_PATTERN.match(
+            message
+        ):
+            return IntentClassification(
+                intent_type=IntentType.CONVERSATIONAL,
+                reasoning="Local rule: greeting or capability question",
+            )
+        return None
+
+    def extract_expression(self, user_message: str) -> str | None:
+        """Returns the arithmetic expression of a bare calculation request."""
+        match = self.ARITHMETIC_PATTERN.match(user_message.strip())
+        if not match:
+            return None
+        expression = match.group("expression").strip()
+        if self.DATE_LIKE_PATTERN.match(expression):
+            return None
+        return expression
+
+    def predict_proba(self, user_message: str) -> dict[str, float]:
+        """Returns the posterior probability of every known label."""
+        total_documents = sum(self.label_counts.values())
+        if not total_documents:
+            return {}
+        tokens = self._tokenize(user_message)
+        vocabulary_size = len(self.vocabulary) + 1
+
+        log_scores = {}
+        for label, document_count in self.label_counts.items():
+            counts = self.token_counts[label]
+            denominator = self.label_token_totals[label] + vocabulary_size
+            log_scores[label] = math.log(document_count / total_documents) + sum(
+                math.log((counts.get(token, 0) + 1) / denominator) for token in tokens
+            )
+
+        max_score = max(log_scores.values())
+        exp_scores = {
+            label: math.exp(score - max_score) for label, score in log_scores.items()
+        }
+        normalizer = sum(exp_scores.values())
+        return {label: score / normalizer for label, score in exp_scores.items()}
+
+    def classify(self, user_message: str) -> IntentClassification | None:
+        intent = self._match_rules(user_message)
+        if intent:
+            return intent
+
+        if sum(self.label_counts.values()) < self.min_examples:
+            return None
+        probabilities = self.predict_proba(user_message)
+        label, probability = max(probabilities.items(), key=lambda item: item[1])
+        if probability < self.threshold:
+            return None
+
+        intent_type, suggested_tool = label.split("|", 1)
+        return IntentClassification(
+            intent_type=intent_type,
+            reasoning=f"Local model: {probability:.2f} confidence",
+            suggested_tool=suggested_tool or None,
+        )
+
+    def train(self, examples: list[tuple[str, IntentClassification]]):
+        """Fits the model from scratch on (user message, LLM classification) pairs."""
+        self.label_counts = Counter()
+        self.token_counts = {}
+        self.label_token_totals = Counter()
+        self.vocabulary = set()
+        for user_message, intent in examples:
+            label = self._make_label(intent.intent_type.value, intent.suggested_tool)
+            tokens = self._tokenize(user_message)
+            self.label_counts[label] += 1
+            self.token_counts.setdefault(label, Counter()).update(tokens)
+            self.label_token_totals[label] += len(tokens)
+            self.vocabulary.update(tokens)
+        logger.info(
+            f"Trained local intent classifier on {len(examples)} examples, "
+            f"{len(self.label_counts)} labels."
+        )
+
+    def save(self, model_path: str):
+        with open(model_path, "w") as file:
+            json.dump(
+                {
+                    "label_counts": self.label_counts,
+                    "token_counts": self.token_counts,
+                },
+                file,
+            )
+
+    def load(self, model_path: str):
+        with open(model_path, "r") as file:
+            data = json.load(file)
+        self.label_counts = Counter(data["label_counts"])
+        self.token_counts = {
+            label: Counter(counts) for label, counts in data["token_counts"].items()
+        }
+        self.label_token_totals = Counter(
+            {label: sum(counts.values()) for label, counts in self.token_counts.items()}
+        )
+        self.vocabulary = {
+            token for counts in self.token_counts.values() for token in counts
+        }
+
+
+def read_intent_log(log_path: str) -> list[dict]:
+    """Reads the JSONL log of LLM classifications written by LLMService."""
+    records = []
+    if not os.path.exists(log_path):
+        return records
+    with open(log_path, "r") as file:
+        for line in file:
+            if line.strip():
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return records
+
+
+def main():
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    conversation_dir = os.path.join(project_root, "conversations")
+
+    parser = argparse.ArgumentParser(
+        description="Train the local intent classifier from logged LLM classifications."
+    )
+    parser.add_argument(
+        "--log", default=os.path.join(conversation_dir, "intent_log.jsonl")
+    )
+    parser.add_argument(
+        "--model", default=os.path.join(conversation_dir, "intent_model.json")
+    )
+    args = parser.parse_args()
+
+    records = read_intent_log(args.log)
+    classifier = LocalIntentClassifier()
+    classifier.train(
+        [
+            (
+                record["user_message"],
+                IntentClassification.model_validate(record["intent"]),
+            )
+            for record in records
+        ]
+    )
+    classifier.save(args.model)
+    print(f"Trained on {len(records)} examples, saved to {args.model}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import json
+
+
+class JsonFieldStreamer:
+    """
+    Incrementally extracts the value of a top-level string field from JSON text
+    that arrives in pieces, e.g. the `message` field of a streamed StepMessage.
+    feed() returns the newly decoded characters of the field as soon as they
+    are complete; everything else in the document is skipped.
+    """
+
+    def __init__(self, field: str):
+        self.field = field
+        self.value = ""
+        self.done = False
+
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._string_start = 0
+        self._last_string: str | None = None  # Candidate key at depth 1
+        self._awaiting_value = False
+        self._capturing = False
+
+    def feed(self, text: str) -> str:
+        self._buffer += text
+        buffer = self._buffer
+        emitted = []
+
+        while self._pos < len(buffer) and not self.done:
+            char = buffer[self._pos]
+
+            if self._capturing:
+                if char == "\\":
+                    escape_length = self._get_escape_length(buffer, self._pos)
+                    if escape_length is None:
+                        break  # Wait for the rest of the escape sequence
+                    emitted.append(
+                        json.loads(f'"{buffer[self._pos : self._pos + escape_length]}"')
+                    )
+                    self._pos += escape_length
+                    continue
+                if char == '"':
+                    self._capturing = False
+                    self.done = True
+                else:
+                    emitted.append(char)
+                self._pos += 1
+                continue
+
+            if self._in_string:
+                if char == "\\":
+                    if self._pos + 1 >= len(buffer):
+                        break
+                    self._pos += 2
+                    continue
+                if char == '"':
+                    self._in_string = False
+                    self._last_string = buffer[self._string_start : self._pos]
+                self._pos += 1
+                continue
+
+            if char == '"':
+                if self._awaiting_value:
+                    self._awaiting_value = False
+                    self._capturing = True
+                else:
+                    self._in_string = True
+                    self._string_start = self._pos + 1
+            elif char == ":" and self._depth == 1 and self._last_string == self.field:
+                self._awaiting_value = True
+            elif not char.isspace():
+                if char in "{[":
+                    self._depth += 1
+                elif char in "}]":
+                    self._depth -= 1
+                self._awaiting_value = False
+            if char != '"' and char != ":" and not char.isspace():
+                self._last_string = None
+            self._pos += 1
+
+        delta = "".join(emitted)
+        self.value += delta
+        return delta
+
+    def _get_escape_length(self, buffer: str, pos: int) -> int | None:
+        """Length of the escape sequence at pos, or None if it is still incomplete."""
+        if pos + 1 >= len(buffer):
+            return None
+        if buffer[pos + 1] != "u":
+            return 2
+        if pos + 6 > len(buffer):
+            return None
+        # A high surrogate must be decoded together with the low surrogate that follows
+        if 0xD800 <= int(buffer[pos + 2 : pos + 6], 16) <= 0xDBFF:
+            return 12 if pos + 12 <= len(buffer) else None
+        return 6
@@ -1,43 +1,478 @@
 from typing import Callable, Awaitable
-import litellm, os, re
+from contextlib import asynccontextmanager
+import litellm, json, os, re, time, weakref
+import httpx
 from logger import logger
-from litellm import completion
+from metrics import registry, LLM_TOKENS, INTENT_CLASSIFICATIONS
+from tracing import tracer
+from litellm.llms.custom_httpx.http_handler import AsyncHTTPHandler
+from litellm.utils import supports_prompt_caching
 from dotenv import load_dotenv
-from models.plan import Plan, StepMessage
+from models.plan import Plan, Step, StepMessage, ToolCall
+from models.tools import ToolType
 from models.intent import IntentClassification, IntentType
 from services.conversation_manager import ConversationManager
 from services.tool_manager import ToolManager
+from services.json_stream import JsonFieldStreamer
+from services.intent_cache import IntentCache
+from services.intent_classifier import LocalIntentClassifier
+from services.plan_scheduler import READ, WRITE, PlanScheduler
+from services.context_builder import ContextBuilder
+from services.plan_cache import PlanCache
+from services.usage_ledger import UsageLedger
+from services.model_router import ModelRouter
+from services.completion_backend import CompletionBackend, LiteLLMBackend
 from models.chat import (
     ChatRole,
     Message,
     MessageType,
+    StreamChunk,
+    get_cached_tokens,
 )
 from datetime import datetime
 import asyncio
 
 
 class LLMService:
+    # Upper bound on the history loaded for context; the token budgets decide how much is used
+    MAX_CONTEXT_MESSAGES = 50
+
+    # Fixed per-stage instructions; they follow the shared static prefix, see _prompt_messages
+    CLASSIFY_INSTRUCTIONS = (
+        "You are an expert intent classifier. Be conservative with tool usage - prefer CONVERSATIONAL for questions about capabilities.\n"
+        "Analyze the user's request and classify it into one of three categories:\n\n"
+        "1. CONVERSATIONAL: Questions about your capabilities, greetings, chitchat, requests for explanation, or clarifications about previous responses.\n"
+        "   Examples: 'What can you do?', 'Hello!', 'How does that work?', 'Can you explain that?'\n\n"
+        "2. SIMPLE_TOOL: Requests that can be accomplished with a single tool execution.\n"
+        "   Examples: 'Calculate 5 + 3', 'Search for Python tutorials', 'Run ls command'\n\n"
+        "3. COMPLEX_TASK: Requests that require multiple steps, planning, or coordination of multiple tools.\n"
+        "   Examples: 'Find all Python files and count their lines', 'Create a new project structure', 'Debug this error'\n\n"
+        "Classify the request and provide reasoning. If it's a SIMPLE_TOOL request, suggest which tool to use. "
+        "If the request is ambiguous or needs clarification, set requires_clarification to True and provide a clarification question."
+    )
+    TOOL_CALL_INSTRUCTIONS = (
+        "Determine the appropriate tool to use for the user's simple action and the input for that tool. "
+        "The 'tool_input' must be a JSON string matching the tool's input schema. "
+        "Also provide a short 'message' telling the user what you are doing."
+    )
+    PLAN_INSTRUCTIONS = (
+        "You are an expert AI agent. Your task is to create a detailed, step-by-step plan to achieve the objective given below.\n"
+        "For each step, you must provide a 'thought' explaining your reasoning for the action. This thought will be shown to the user.\n"
+        "The plan should be a sequence of steps. Each step must include a unique 'step_id' (starting from 1), a 'thought', a 'tool_type', and the 'tool_input'.\n"
+        "If a step does not require a tool, set 'tool_type' and 'tool_input' to None.\n"
+        "If the input for a tool depends on the output of a previous step, use a placeholder like '$step_1_output' to reference it.\n"
+        "{ordering}"
+        "If a step relies on another step in any other way, reference that step's output in its input.\n\n"
+        "Format the entire plan as a single JSON object that adheres to the provided schema. "
+        "For each tool type, ensure the 'tool_input' is a JSON string matching the tool's input schema."
+    )
+
     def __init__(
         self,
         model: str = "gemini/gemini-2.5-flash-lite",
-        ui_callback: Callable[[str | Message], Awaitable[None]] = None,
+        ui_callback: Callable[[str | Message | StreamChunk], Awaitable[None]] = None,
+        max_concurrent_requests: int = 16,
+        max_requests_per_conversation: int = 2,
+        request_timeout: float = 600.0,
+        stream_responses: bool = True,
+        enable_intent_cache: bool = True,
+        enable_local_classifier: bool = True,
+        local_classifier_threshold: float = 0.9,
+        conversation_manager: ConversationManager | None = None,
+        plan_execution: str = "auto",
+        max_parallel_steps: int = 4,
+        context_budgets: dict[str, int] | None = None,
+        max_tool_output_tokens: int = 1000,
+        prompt_caching: bool = True,
+        enable_plan_cache: bool = True,
+        stage_models: dict[str, list[str]] | None = None,
+        max_retries: int = 2,
+        hedge_requests: bool = False,
+        stage_timeouts: dict[str, float] | None = None,
+        completion_backend: CompletionBackend | None = None,
+        enable_usage_ledger: bool = True,
     ):
+        """
+        LLM calls are made by the completion backend on the event loop. At most
+        `max_concurrent_requests` are in flight overall and at most
+        `max_requests_per_conversation` per conversation; all of them share one
+        pooled HTTP client.
+
+        With `stream_responses`, conversational replies and step narration are
+        sent to `ui_callback` as StreamChunks while they are generated, followed
+        by the complete Message.
+
+        With `enable_intent_cache`, intent classifications are cached in memory
+        and in conversations/intent_cache.db so repeated requests skip the LLM.
+
+        With `enable_local_classifier`, obvious requests are classified locally
+        by rules and by a model trained from conversations/intent_log.jsonl
+        (see services.intent_classifier) when its confidence reaches
+        `local_classifier_threshold`.
+
+        `plan_execution` selects how plans are executed:
+            "interactive" asks the LLM for the next StepMessage after every
+            tool call.
+            "deterministic" runs the plan as a dependency graph built from its
+            `$step_N_output` placeholders, with up to `max_parallel_steps`
+            independent steps at a time while steps that may change state or
+            whose tool is not thread safe keep their order (see
+            services.plan_scheduler and benchmarks.plan_scheduling), and only
+            calls the LLM for failed or tool-less steps and a final summary.
+            "auto" picks one of the two per plan, deterministic only for plans
+            whose steps change nothing, like calculations and read-only shell
+            commands (see choose_plan_execution).
+
+        Conversation history is added to prompts newest-first within the token
+        budget of each stage (`context_budgets` overrides
+        ContextBuilder.DEFAULT_BUDGETS), and tool outputs in prompts are
+        truncated to `max_tool_output_tokens` (see services.context_builder).
+
+        Classification, tool call and planning prompts start with the same
+        static prefix (system message and tool catalog) followed by the fixed
+        instructions of the stage, so providers can serve it from their prompt
+        cache. With `prompt_caching`, models for which litellm supports explicit
+        prompt caching get cache_control markers on that prefix; others, like
+        Gemini 2.5 and OpenAI models, cache matching prefixes implicitly.
+        Cached tokens are recorded in Message.cached_tokens.
+
+        With `enable_plan_cache`, plans are stored in conversations/plan_cache.db
+        and reused for the same objective, or for one that only differs in
+        words the plan uses as tool arguments, which are then replaced in its
+        tool inputs, unless the conversation opted out (see services.plan_cache).
+
+        Completions go through a ModelRouter (see services.model_router).
+        `stage_models` maps the stages "classify", "chat", "tool_call", "plan",
+        "step" and "summary" to models in order of preference; stages without
+        an entry use `model`. Failed requests are retried up to `max_retries`
+        times on the next model with jittered backoff, failing models are cut
+        off by a circuit breaker, and with `hedge_requests` slow requests are
+        duplicated to the next model after its p95 latency. Each attempt is
+        cut off after the timeout of its stage, ModelRouter.DEFAULT_TIMEOUTS
+        updated with `stage_timeouts`.
+
+        Requests are sent by `completion_backend`, a LiteLLMBackend by default.
+        Benchmarks and load tests pass a FakeBackend to run the whole pipeline
+        offline (see services.completion_backend); no API key is needed then.
+
+        Messages record the stage and model of the completion they came from,
+        and conversations keep running token totals per stage and model. With
+        `enable_usage_ledger`, the usage of every completion is also added to
+        conversations/usage_ledger.db per day, model and stage
+        (see services.usage_ledger).
+
+        A preconfigured `conversation_manager` can be passed in, e.g. to keep
+        conversations of a benchmark in a temporary directory.
+        """
         load_dotenv()
 
         self.API_KEY = os.getenv("GEMINI_API_KEY")
-        if not self.API_KEY:
-            raise ValueError(
-                "API key not found. Please set the GEMINI_API_KEY environment variable."
-            )
-        os.environ["GEMINI_API_KEY"] = self.API_KEY
+        if completion_backend is None:
+            if not self.API_KEY:
+                raise ValueError(
+                    "API key not found. Please set the GEMINI_API_KEY environment variable."
+                )
+            os.environ["GEMINI_API_KEY"] = self.API_KEY
+        self.completion_backend = completion_backend or LiteLLMBackend()
 
         self.model = model
+        self.explicit_prompt_caching = prompt_caching and supports_prompt_caching(model)
         self.ui_callback = ui_callback
+        self.stream_responses = stream_responses
+        if plan_execution not in ("interactive", "deterministic", "auto"):
+            raise ValueError(f"Unknown plan execution mode: {plan_execution}")
+        self.plan_execution = plan_execution
+        self.plan_scheduler = PlanScheduler(
+            max_parallel_steps, state_access=self._step_state_access
+        )
+        self.context_builder = ContextBuilder(context_budgets, max_tool_output_tokens)
+        self.plan_execution_stats = {
+            mode: {"plans": 0, "llm_calls": 0, "duration_ms": 0.0}
+            for mode in ("interactive", "deterministic")
+        }
 
         litellm.enable_json_schema_validation = True
 
-        self.conversation_manager = ConversationManager()
+        self.max_requests_per_conversation = max_requests_per_conversation
+        self._request_semaphore = asyncio.Semaphore(max_concurrent_requests)
+        # Entries disappear once no request of that conversation holds them
+        self._conversation_semaphores: weakref.WeakValueDictionary[
+            int, asyncio.Semaphore
+        ] = weakref.WeakValueDictionary()
+        self.http_client = AsyncHTTPHandler(
+            timeout=httpx.Timeout(timeout=request_timeout, connect=5.0),
+            concurrent_limit=max_concurrent_requests,
+        )
+
+        self.router = ModelRouter(
+            [model],
+            stage_models,
+            completion=self.completion_backend.complete,
+            max_retries=max_retries,
+            hedge_requests=hedge_requests,
+            stage_timeouts=stage_timeouts,
+        )
+
+        self.conversation_manager = conversation_manager or ConversationManager()
         self.tool_manager = ToolManager()
+        self.plan_instructions = self.PLAN_INSTRUCTIONS.format(
+            ordering=self._describe_step_ordering()
+        )
+
+        self.intent_cache = None
+        if enable_intent_cache:
+            self.intent_cache = IntentCache(
+                os.path.join(
+                    self.conversation_manager.CONVERSATION_DIR, "intent_cache.db"
+                )
+            )
+
+        self.plan_cache = None
+        if enable_plan_cache:
+            self.plan_cache = PlanCache(
+                os.path.join(
+                    self.conversation_manager.CONVERSATION_DIR, "plan_cache.db"
+                )
+            )
+
+        self.intent_log_path = os.path.join(
+            self.conversation_manager.CONVERSATION_DIR, "intent_log.jsonl"
+        )
+        self.local_classifier = None
+        if enable_local_classifier:
+            self.local_classifier = LocalIntentClassifier(
+                os.path.join(
+                    self.conversation_manager.CONVERSATION_DIR, "intent_model.json"
+                ),
+                threshold=local_classifier_threshold,
+            )
+
+        self.usage_ledger = None
+        if enable_usage_ledger:
+            self.usage_ledger = UsageLedger(
+                os.path.join(
+                    self.conversation_manager.CONVERSATION_DIR, "usage_ledger.db"
+                )
+            )
+
+        # Held weakly, so services that are never closed stop reporting once dropped
+        registry.add_collector(self._collect_metrics)
+
+    def _get_conversation_semaphore(self, conversation_id: int) -> asyncio.Semaphore:
+        semaphore = self._conversation_semaphores.get(conversation_id)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_requests_per_conversation)
+            self._conversation_semaphores[conversation_id] = semaphore
+        return semaphore
+
+    @asynccontextmanager
+    async def _request_slot(self, conversation_id: int):
+        """Waits for a free slot within the per-conversation and global limits."""
+        async with self._get_conversation_semaphore(conversation_id):
+            async with self._request_semaphore:
+                yield
+
+    def _prompt_messages(self, instructions: str, request: str) -> list[dict]:
+        """
+        Orders a prompt for provider-side prompt caching: the system message and
+        tool catalog, identical for every stage, come first, followed by the
+        fixed instructions of the stage and only then the per-request content.
+        """
+        if not self.conversation_manager.system_message:
+            self.conversation_manager._load_system_message()
+        static_parts = [
+            f"{self.conversation_manager.system_message}\n\n"
+            f"Available tools:\n{self.tool_manager.get_tool_descriptions()}",
+            instructions,
+        ]
+        messages = []
+        for text in static_parts:
+            if self.explicit_prompt_caching:
+                content = [
+                    {
+                        "type": "text",
+                        "text": text,
+                        "cache_control": {"type": "ephemeral"},
+                    }
+                ]
+            else:
+                content = text
+            messages.append({"role": ChatRole.SYSTEM.value, "content": content})
+        messages.append({"role": ChatRole.USER.value, "content": request})
+        return messages
+
+    async def _complete(self, conversation_id: int, stage: str, **kwargs):
+        """
+        Runs one completion within the global and per-conversation limits and
+        records its token usage for `stage`.
+        """
+        with tracer.span(
+            "llm.completion", **{"conversation.id": conversation_id, "llm.stage": stage}
+        ) as span:
+            async with self._request_slot(conversation_id):
+                response = await self.router.complete(
+                    stage, client=self.http_client, **kwargs
+                )
+            response.usage = self._record_usage(
+                span, stage, getattr(response, "model", None), response.usage
+            )
+        return response
+
+    def _record_usage(
+        self, span, stage: str, model: str | None, usage: dict | None
+    ) -> dict | None:
+        """
+        Records the token usage of one completion and returns it as a plain
+        dict tagged with the stage and model, for Message.set_token_usage.
+        """
+        self.context_builder.record_usage(stage, usage)
+        if not usage:
+            return usage
+        model = model or self.router.models_for(stage)[0]
+        input_tokens = usage.get("prompt_tokens") or 0
+        output_tokens = usage.get("completion_tokens") or 0
+        cached_tokens = get_cached_tokens(usage)
+        LLM_TOKENS.labels(stage, "input").inc(input_tokens)
+        LLM_TOKENS.labels(stage, "output").inc(output_tokens)
+        LLM_TOKENS.labels(stage, "cached").inc(cached_tokens)
+        if self.usage_ledger:
+            self.usage_ledger.record(
+                model, stage, input_tokens, output_tokens, cached_tokens
+            )
+        span.set_attributes(
+            {
+                "gen_ai.response.model": model,
+                "gen_ai.usage.input_tokens": input_tokens,
+                "gen_ai.usage.output_tokens": output_tokens,
+                "llm.cached_tokens": cached_tokens,
+            }
+        )
+        return {
+            "prompt_tokens": input_tokens,
+            "completion_tokens": output_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            "stage": stage,
+            "model": model,
+        }
+
+    def _collect_metrics(self) -> list[tuple]:
+        """Cache counters for the metrics registry, read when metrics are rendered."""
+        lookups = {}
+        conversation_cache = self.conversation_manager.get_cache_stats()
+        lookups[("conversation", "hit")] = conversation_cache["hits"]
+        lookups[("conversation", "miss")] = conversation_cache["misses"]
+        if self.intent_cache:
+            intent_cache = self.intent_cache.get_stats()
+            lookups[("intent", "memory_hit")] = intent_cache["memory_hits"]
+            lookups[("intent", "disk_hit")] = intent_cache["disk_hits"]
+            lookups[("intent", "miss")] = intent_cache["misses"]
+        if self.plan_cache:
+            plan_cache = self.plan_cache.get_stats()
+            lookups[("plan", "exact_hit")] = plan_cache["exact_hits"]
+            lookups[("plan", "adapted_hit")] = plan_cache["adapted_hits"]
+            lookups[("plan", "miss")] = plan_cache["misses"]
+        return [
+            (
+                "agent_cache_lookups_total",
+                "counter",
+                "Cache lookups by cache and result.",
+                {
+                    (("cache", cache), ("result", result)): count
+                    for (cache, result), count in lookups.items()
+                },
+            )
+        ]
+
+    async def _complete_text(
+        self,
+        conversation_id: int,
+        message_id: int,
+        stage: str,
+        stream_field: str | None = None,
+        **kwargs,
+    ) -> tuple[str, dict]:
+        """
+        Runs a completion and returns its text and token usage. When streaming is
+        enabled the text is forwarded to the UI as StreamChunks for `message_id`;
+        for JSON responses only the string field `stream_field` is forwarded.
+        """
+        if not self.stream_responses:
+            response = await self._complete(conversation_id, stage, **kwargs)
+            return response.choices[0].message.content, response.usage
+
+        streamer = JsonFieldStreamer(stream_field) if stream_field else None
+        parts = []
+        usage = {}
+        model = None
+        start_time = time.perf_counter()
+        first_token_time = None
+
+        with tracer.span(
+            "llm.completion",
+            **{
+                "conversation.id": conversation_id,
+                "llm.stage": stage,
+                "llm.stream": True,
+            },
+        ) as span:
+            async with self._request_slot(conversation_id):
+                response = await self.router.complete(
+                    stage,
+                    client=self.http_client,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **kwargs,
+                )
+                async for chunk in response:
+                    if getattr(chunk, "usage", None):
+                        usage = chunk.usage
+                    model = getattr(chunk, "model", None) or model
+                    if not chunk.choices or not chunk.choices[0].delta.content:
+                        continue
+
+                    delta = chunk.choices[0].delta.content
+                    if first_token_time is None:
+                        first_token_time = time.perf_counter()
+                        logger.info(
+                            f"Time to first token for conversation {conversation_id}: "
+                            f"{(first_token_time - start_time) * 1000:.0f} ms"
+                        )
+                    parts.append(delta)
+
+                    visible_delta = streamer.feed(delta) if streamer else delta
+                    if visible_delta and self.ui_callback:
+                        await self.ui_callback(
+                            StreamChunk(
+                                conversation_id=conversation_id,
+                                message_id=message_id,
+                                delta=visible_delta,
+                            )
+                        )
+
+            logger.info(
+                f"Streamed completion for conversation {conversation_id} in "
+                f"{(time.perf_counter() - start_time) * 1000:.0f} ms"
+            )
+            usage = self._record_usage(span, stage, model, usage)
+        return "".join(parts), usage
+
+    async def aclose(self):
+        """Closes the pooled HTTP client, the completion backend, the intent and plan caches and the usage ledger."""
+        await self.http_client.close()
+        await self.completion_backend.close()
+        tracer.flush()
+        registry.remove_collector(self._collect_metrics)
+        if self.usage_ledger:
+            self.usage_ledger.close()
+        logger.info(f"Plan execution stats: {self.get_plan_execution_stats()}")
+        logger.info(f"Token usage by stage: {self.context_builder.get_stats()}")
+        logger.info(f"Model router stats: {self.router.get_stats()}")
+        if self.intent_cache:
+            logger.info(f"Intent cache stats: {self.intent_cache.get_stats()}")
+            self.intent_cache.close()
+        if self.plan_cache:
+            logger.info(f"Plan cache stats: {self.plan_cache.get_stats()}")
+            self.plan_cache.close()
 
     async def classify_intent(
         self, conversation_id: int, user_message: str
@@ -46,63 +481,69 @@ class LLMService:
         Classifies the user's intent to determine how to process the request.
         This is a lightweight operation to avoid unnecessary planning.
         """
-        conversation = self.conversation_manager.load_conversation(conversation_id)
-
-        # Get available tools for context
-        tools = self.tool_manager.get_tool_descriptions()
-
-        # Build context from recent conversation history (last 5 messages)
-        recent_messages = (
-            conversation.messages[-5:]
-            if len(conversation.messages) > 5
-            else conversation.messages
+        # Build context from recent conversation history within the classify budget
+        recent_messages = self.conversation_manager.load_recent_messages(
+            conversation_id, self.MAX_CONTEXT_MESSAGES
         )
         conversation_context = "\n".join(
             [
-                f"{msg.role.value}: {msg.content if isinstance(msg.content, str) else '[Plan]'}"
-                for msg in recent_messages[:-1]  # Exclude the current user message
+                f"{msg.role.value}: {self.context_builder.render_content('classify', msg)}"
+                for msg in self.context_builder.select_messages(
+                    "classify", recent_messages[:-1]  # Exclude the current user message
+                )
             ]
         )
 
-        prompt = (
-            f"You are an AI assistant classifier. Analyze the user's request and classify it into one of three categories:\n\n"
-            f"1. CONVERSATIONAL: Questions about your capabilities, greetings, chitchat, requests for explanation, or clarifications about previous responses.\n"
-            f"   Examples: 'What can you do?', 'Hello!', 'How does that work?', 'Can you explain that?'\n\n"
-            f"2. SIMPLE_TOOL: Requests that can be accomplished with a single tool execution.\n"
-            f"   Examples: 'Calculate 5 + 3', 'Search for Python tutorials', 'Run ls command'\n\n"
-            f"3. COMPLEX_TASK: Requests that require multiple steps, planning, or coordination of multiple tools.\n"
-            f"   Examples: 'Find all Python files and count their lines', 'Create a new project structure', 'Debug this error'\n\n"
-            f"Available tools:\n{tools}\n\n"
+        cache_key = None
+        if self.intent_cache:
+            cache_key = self.intent_cache.make_key(
+                user_message,
+                conversation_context,
+                self.tool_manager.tool_catalog_hash,
+                self.model,
+            )
+            cached_intent = self.intent_cache.get(cache_key)
+            if cached_intent:
+                logger.info(f"Intent served from cache: {cached_intent}")
+                INTENT_CLASSIFICATIONS.labels("cache").inc()
+                return cached_intent
+
+        if self.local_classifier:
+            local_intent = self.local_classifier.classify(user_message)
+            if local_intent:
+                logger.info(f"Intent classified locally: {local_intent}")
+                INTENT_CLASSIFICATIONS.labels("local").inc()
+                return local_intent
+
+        request = (
             f"Recent conversation context:\n{conversation_context}\n\n"
-            f"User's current request: '{user_message}'\n\n"
-            f"Classify this request and provide reasoning. If it's a SIMPLE_TOOL request, suggest which tool to use. "
-            f"If the request is ambiguous or needs clarification, set requires_clarification to True and provide a clarification question."
+            f"User's current request: '{user_message}'"
         )
 
         try:
-            response = await asyncio.get_event_loop().run_in_executor(
-                None,
-                lambda: completion(
-                    model=self.model,
-                    messages=[
-                        {
-                            "role": ChatRole.SYSTEM.value,
-                            "content": "You are an expert intent classifier. Be conservative with tool usage - prefer CONVERSATIONAL for questions about capabilities.",
-                        },
-                        {"role": ChatRole.USER.value, "content": prompt},
-                    ],
-                    temperature=0.1,  # Low temperature for consistent classification
-                    response_format=IntentClassification,
-                ),
+            start_time = time.perf_counter()
+            response = await self._complete(
+                conversation_id,
+                stage="classify",
+                messages=self._prompt_messages(self.CLASSIFY_INSTRUCTIONS, request),
+                temperature=0.1,  # Low temperature for consistent classification
+                response_format=IntentClassification,
             )
 
             model_response = response.choices[0].message.content
             intent = IntentClassification.model_validate_json(model_response)
 
             logger.info(f"Intent classified: {intent}")
+            INTENT_CLASSIFICATIONS.labels("llm").inc()
+            if cache_key:
+                self.intent_cache.put(cache_key, intent)
+            self._log_intent(
+                user_message, intent, (time.perf_counter() - start_time) * 1000
+            )
             return intent
         except Exception as e:
             logger.error(f"Error classifying intent: {e}")
+            INTENT_CLASSIFICATIONS.labels("fallback").inc()
             # Default to conversational on error to be safe
             return IntentClassification(
                 intent_type=IntentType.CONVERSATIONAL,
@@ -110,6 +551,26 @@ class LLMService:
                 requires_clarification=False,
             )
 
+    def _log_intent(
+        self, user_message: str, intent: IntentClassification, latency_ms: float
+    ):
+        """Appends an LLM classification to the training log of the local classifier."""
+        try:
+            with open(self.intent_log_path, "a") as file:
+                file.write(
+                    json.dumps(
+                        {
+                            "user_message": user_message,
+                            "intent": intent.model_dump(mode="json"),
+                            "model": self.model,
+                            "latency_ms": round(latency_ms, 1),
+                        }
+                    )
+                    + "\n"
+                )
+        except IOError as e:
+            logger.error(f"Could not write intent log: {e}")
+
     async def handle_conversational(self, conversation_id: int, user_message: str):
         """Handles conversational requests with direct LLM response."""
         conversation = self.conversation_manager.load_conversation(conversation_id)
@@ -122,25 +583,28 @@ class LLMService:
             }
         ]
 
-        # Add recent conversation context (last 10 messages)
-        for msg in conversation.messages[-10:]:
-            if isinstance(msg.content, str):
+        # Add recent conversation context within the chat budget
+        recent_messages = self.conversation_manager.load_recent_messages(
+            conversation_id, self.MAX_CONTEXT_MESSAGES
+        )
+        for msg in self.context_builder.select_messages("chat", recent_messages):
+            if msg.content is not None:
                 messages_for_llm.append(
-                    {"role": msg.role.value, "content": msg.content}
+                    {
+                        "role": msg.role.value,
+                        "content": self.context_builder.render_content("chat", msg),
+                    }
                 )
 
         try:
-            response = await asyncio.get_event_loop().run_in_executor(
-                None,
-                lambda: completion(
-                    model=self.model,
-                    messages=messages_for_llm,
-                    temperature=0.7,
-                ),
+            response_content, usage = await self._complete_text(
+                conversation_id,
+                len(conversation.messages),
+                stage="chat",
+                messages=messages_for_llm,
+                temperature=0.7,
             )
 
-            response_content = response.choices[0].message.content
-
             response_message = Message(
                 id=len(conversation.messages),
                 content=response_content,
@@ -148,9 +612,9 @@ class LLMService:
                 type=MessageType.TEXT,
                 created_at=datetime.now(),
             )
-            response_message.set_token_usage(response.usage)
+            response_message.set_token_usage(usage)
 
-            conversation.messages.append(response_message)
+            conversation.add_message(response_message)
             self.conversation_manager.save_conversation(conversation)
 
             if self.ui_callback:
@@ -159,125 +623,289 @@ class LLMService:
         except Exception as e:
             logger.error(f"Error in conversational handler: {e}")
 
+    def _resolve_tool_type(self, tool_name: str | None) -> ToolType | None:
+        """Maps a suggested tool name like 'calculator' or 'CALCULATOR' to a ToolType."""
+        if not tool_name:
+            return None
+        normalized = tool_name.strip().lower()
+        for tool_type in ToolType:
+            if normalized in (tool_type.value, tool_type.name.lower()):
+                return tool_type
+        return None
+
+    async def _request_tool_call(
+        self,
+        conversation_id: int,
+        user_message: str,
+        suggested_tool: ToolType | None,
+    ) -> tuple[ToolCall, dict] | None:
+        """Asks the LLM for the tool and its input in a single structured call."""
+        request = f"The user wants to perform a simple action: '{user_message}'" + (
+            f"\nThe suggested tool is '{suggested_tool.value}'."
+            if suggested_tool
+            else ""
+        )
+        try:
+            response = await self._complete(
+                conversation_id,
+                stage="tool_call",
+                messages=self._prompt_messages(self.TOOL_CALL_INSTRUCTIONS, request),
+                temperature=0.1,
+                response_format=ToolCall,
+            )
+            model_response = response.choices[0].message.content
+            return ToolCall.model_validate_json(model_response), response.usage
+        except Exception as e:
+            logger.error(f"Error determining tool call: {e}")
+            return None
+
     async def handle_simple_tool(
         self, conversation_id: int, user_message: str, suggested_tool: str = None
     ):
-        """Handles simple single-tool requests."""
+        """
+        Handles simple single-tool requests: determines the tool and its input
+        (locally for bare arithmetic, otherwise with one LLM call), runs it and
+        answers with the tool output. Falls back to planning if no valid tool
+        call can be determined.
+        """
         conversation = self.conversation_manager.load_conversation(conversation_id)
+        tool_type = self._resolve_tool_type(suggested_tool)
 
-        # Get tool info
-        tools = self.tool_manager.get_tool_descriptions()
+        tool_call, usage = None, {}
+        if tool_type == ToolType.CALCULATOR and self.local_classifier:
+            expression = self.local_classifier.extract_expression(user_message)
+            if expression:
+                tool_call = ToolCall(
+                    tool_type=ToolType.CALCULATOR,
+                    tool_input=json.dumps({"expression": expression}),
+                    message="",
+                )
 
-        # Ask LLM to determine the exact tool and input
-        prompt = (
-            f"The user wants to perform a simple action: '{user_message}'\n\n"
-            f"Available tools:\n{tools}\n\n"
-            f"Determine the appropriate tool to use and the input for that tool. "
-            f"Respond with a JSON object containing 'tool_type' and 'tool_input' (as a JSON string)."
+        if tool_call is None:
+            result = await self._request_tool_call(
+                conversation_id, user_message, tool_type
+            )
+            if result:
+                tool_call, usage = result
+
+        if tool_call is None or not self.tool_manager.validate_tool_input(
+            tool_call.tool_type, tool_call.tool_input
+        ):
+            logger.warning("No valid single tool call, falling back to planning.")
+            await self.handle_complex_task(conversation_id, user_message)
+            return
+
+        if tool_call.message:
+            narration_message = Message(
+                id=len(conversation.messages),
+                content=tool_call.message,
+                role=ChatRole.ASSISTANT,
+                type=MessageType.TEXT,
+                created_at=datetime.now(),
+            )
+            narration_message.set_token_usage(usage)
+            conversation.add_message(narration_message)
+            self.conversation_manager.save_conversation(conversation)
+            if self.ui_callback:
+                await self.ui_callback(narration_message)
+
+        # Tools block (shell commands, python), so they run off the event loop
+        tool_output = await asyncio.to_thread(
+            self._run_tool, tool_call.tool_type, tool_call.tool_input
         )
 
-        # For now, fall back to complex task handling
-        # This will be implemented more robustly in the next iteration
-        await self.handle_complex_task(conversation_id, user_message)
+        tool_message = Message(
+            id=len(conversation.messages),
+            content=tool_output,
+            role=ChatRole.ASSISTANT,
+            type=MessageType.TOOL,
+            created_at=datetime.now(),
+        )
+        conversation.add_message(tool_message)
+        self.conversation_manager.save_conversation(conversation)
+        if self.ui_callback:
+            await self.ui_callback(tool_message)
 
     async def handle_complex_task(self, conversation_id: int, user_message: str):
         """Handles complex tasks that require planning and multiple steps."""
-        # This is the existing plan-based execution
-        plan = await self.create_plan(conversation_id, user_message)
-        if not plan or not plan.steps:
-            logger.error("Failed to create a valid plan.")
-            return
+        plan = await self._get_cached_plan(conversation_id, user_message)
+        if plan is None:
+            with tracer.span("agent.plan") as plan_span:
+                plan = await self.create_plan(conversation_id, user_message)
+                plan_span.set_attribute("plan.steps", len(plan.steps) if plan else 0)
+            if not plan or not plan.steps:
+                logger.error("Failed to create a valid plan.")
+                return
+            if self.plan_cache and self._is_reusable_plan(plan):
+                self.plan_cache.put(
+                    user_message, plan, self.tool_manager.tool_catalog_hash, self.model
+                )
 
-        await self.execute_plan(conversation_id, plan)
+        mode = self.plan_execution
+        if mode == "auto":
+            mode = self.choose_plan_execution(plan)
+        logger.info(f"Executing plan in {mode} mode")
 
-    async def process_user_request(self, conversation_id: int, user_message: str):
+        start_time = time.perf_counter()
+        with tracer.span("agent.execute_plan", **{"plan.mode": mode}) as span:
+            if mode == "deterministic":
+                llm_calls = await self.execute_plan_deterministic(
+                    conversation_id, plan, user_message
+                )
+            else:
+                llm_calls = await self.execute_plan(conversation_id, plan)
+            span.set_attribute("plan.llm_calls", llm_calls)
+
+        stats = self.plan_execution_stats[mode]
+        stats["plans"] += 1
+        stats["llm_calls"] += llm_calls
+        stats["duration_ms"] += (time.perf_counter() - start_time) * 1000
+
+    def set_plan_cache_enabled(self, conversation_id: int, enabled: bool) -> bool:
+        """Opts a conversation in or out of plan reuse; False if there is no plan cache."""
+        if not self.plan_cache:
+            return False
+        self.plan_cache.set_enabled(conversation_id, enabled)
+        return True
+
+    def _is_reusable_plan(self, plan: Plan) -> bool:
+        """Only plans whose tools exist and whose fixed inputs are valid are cached."""
+        for step in plan.steps:
+            if not step.tool_type:
+                continue
+            if step.tool_type not in self.tool_manager.tool_registry:
+                return False
+            if "$step_" not in (
+                step.tool_input or ""
+            ) and not self.tool_manager.validate_tool_input(
+                step.tool_type, step.tool_input or ""
+            ):
+                return False
+        return True
+
+    async def _get_cached_plan(
+        self, conversation_id: int, objective: str
+    ) -> Plan | None:
         """
-        Main entry point for processing a user's request.
-        Classifies intent, then routes to appropriate handler.
+        Looks up a plan made for the same objective, or for one that only
+        differed in tool arguments, with the arguments of this objective. A hit
+        is offered to the user and added to the conversation like a new plan.
         """
-        conversation = self.conversation_manager.load_conversation(conversation_id)
-        if not conversation:
-            raise ValueError(f"Conversation with ID {conversation_id} not found.")
+        if not self.plan_cache or not self.plan_cache.is_enabled(conversation_id):
+            return None
+        cached = self.plan_cache.get(
+            objective, self.tool_manager.tool_catalog_hash, self.model
+        )
+        if cached is None:
+            return None
 
-        # 1. Add user message to conversation
-        user_message_obj = Message(
+        plan, cached_objective, substitutions = cached
+        if substitutions and not self._is_reusable_plan(plan):
+            logger.info(
+                f"Cached plan for '{cached_objective}' is invalid with {substitutions}"
+            )
+            return None
+        replaced = ", ".join(f"{new} for {old}" for old, new in substitutions.items())
+        logger.info(
+            f"Reusing cached plan for '{cached_objective}'"
+            + (f" with {replaced}" if replaced else "")
+        )
+        conversation = self.conversation_manager.load_conversation(conversation_id)
+        await self._post_message(
+            conversation,
+            f"Reusing the plan from an earlier request: '{cached_objective}'"
+            + (f", with {replaced}" if replaced else ""),
+            MessageType.TEXT,
+        )
+        plan_message = Message(
             id=len(conversation.messages),
-            content=user_message,
-            role=ChatRole.USER,
-            created_at=datetime.now(),
+            content=plan,
+            role=ChatRole.ASSISTANT,
+            type=MessageType.PLAN,
         )
-        conversation.messages.append(user_message_obj)
+        conversation.add_message(plan_message)
         self.conversation_manager.save_conversation(conversation)
+        return plan
 
-        try:
-            # 2. Classify the intent
-            intent = await self.classify_intent(conversation_id, user_message)
-            if not intent:
-                logger.error("Failed to classify intent.")
-                return
+    async def process_user_request(self, conversation_id: int, user_message: str):
+        """
+        Main entry point for processing a user's request.
+        Classifies intent, then routes to appropriate handler.
+        """
+        with tracer.span("agent.turn", **{"conversation.id": conversation_id}):
+            conversation = self.conversation_manager.load_conversation(conversation_id)
+            if not conversation:
+                raise ValueError(f"Conversation with ID {conversation_id} not found.")
 
-            logger.info(
-                f"Classified intent as: {intent.intent_type} - {intent.reasoning}"
+            # 1. Add user message to conversation
+            user_message_obj = Message(
+                id=len(conversation.messages),
+                content=user_message,
+                role=ChatRole.USER,
+                created_at=datetime.now(),
             )
+            conversation.add_message(user_message_obj)
+            self.conversation_manager.save_conversation(conversation)
 
-            # 3. Handle clarification if needed
-            if intent.requires_clarification and intent.clarification_question:
-                clarification_message = Message(
-                    id=len(conversation.messages),
-                    content=intent.clarification_question,
-                    role=ChatRole.ASSISTANT,
-                    type=MessageType.TEXT,
-                    created_at=datetime.now(),
-                )
-                conversation.messages.append(clarification_message)
-                self.conversation_manager.save_conversation(conversation)
-                if self.ui_callback:
-                    await self.ui_callback(clarification_message)
-                return
+            try:
+                # 2. Classify the intent
+                with tracer.span("agent.classify") as classify_span:
+                    intent = await self.classify_intent(conversation_id, user_message)
+                    if intent:
+                        classify_span.set_attribute(
+                            "agent.intent", intent.intent_type.value
+                        )
+                if not intent:
+                    logger.error("Failed to classify intent.")
+                    return
 
-            # 4. Route based on intent type
-            if intent.intent_type == IntentType.CONVERSATIONAL:
-                await self.handle_conversational(conversation_id, user_message)
-            elif intent.intent_type == IntentType.SIMPLE_TOOL:
-                await self.handle_simple_tool(
-                    conversation_id, user_message, intent.suggested_tool
+                logger.info(
+                    f"Classified intent as: {intent.intent_type} - {intent.reasoning}"
                 )
-            elif intent.intent_type == IntentType.COMPLEX_TASK:
-                await self.handle_complex_task(conversation_id, user_message)
-        except Exception as e:
-            logger.error(f"Error processing user request: {e}")
+
+                # 3. Handle clarification if needed
+                if intent.requires_clarification and intent.clarification_question:
+                    clarification_message = Message(
+                        id=len(conversation.messages),
+                        content=intent.clarification_question,
+                        role=ChatRole.ASSISTANT,
+                        type=MessageType.TEXT,
+                        created_at=datetime.now(),
+                    )
+                    conversation.add_message(clarification_message)
+                    self.conversation_manager.save_conversation(conversation)
+                    if self.ui_callback:
+                        await self.ui_callback(clarification_message)
+                    return
+
+                # 4. Route based on intent type
+                if intent.intent_type == IntentType.CONVERSATIONAL:
+                    await self.handle_conversational(conversation_id, user_message)
+                elif intent.intent_type == IntentType.SIMPLE_TOOL:
+                    await self.handle_simple_tool(
+                        conversation_id, user_message, intent.suggested_tool
+                    )
+                elif intent.intent_type == IntentType.COMPLEX_TASK:
+                    await self.handle_complex_task(conversation_id, user_message)
+            except Exception as e:
+                logger.error(f"Error processing user request: {e}")
+            finally:
+                # End of turn: let the writer thread persist this turn's messages
+                self.conversation_manager.end_turn(conversation_id)
 
     async def create_plan(self, conversation_id: int, objective: str) -> Plan:
         """Generates a plan to achieve the given objective."""
         conversation = self.conversation_manager.load_conversation(conversation_id)
 
-        tools = self.tool_manager.get_tool_descriptions()
-        prompt = (
-            f"You are an expert AI agent. Your task is to create a detailed, step-by-step plan to achieve the following objective: '{objective}'.\n\n"
-            f"You have access to the following tools:\n{tools}\n\n"
-            "For each step, you must provide a 'thought' explaining your reasoning for the action. This thought will be shown to the user.\n"
-            "The plan should be a sequence of steps. Each step must include a unique 'step_id' (starting from 1), a 'thought', a 'tool_type', and the 'tool_input'.\n"
-            "If a step does not require a tool, set 'tool_type' and 'tool_input' to None.\n"
-            "If the input for a tool depends on the output of a previous step, use a placeholder like '$step_1_output' to reference it.\n\n"
-            "Format the entire plan as a single JSON object that adheres to the provided schema."
-            "For each tool type, ensure the 'tool_input' is a JSON string matching the tool's input schema.\n"
-        )
+        request = f"The objective is: '{objective}'"
 
         try:
-            response = await asyncio.get_event_loop().run_in_executor(
-                None,
-                lambda: completion(
-                    model=self.model,
-                    messages=[
-                        {
-                            "role": ChatRole.SYSTEM.value,
-                            "content": self.conversation_manager.system_message,
-                        },
-                        {"role": ChatRole.USER.value, "content": prompt},
-                    ],
-                    temperature=0.2,
-                    response_format=Plan,
-                ),
+            response = await self._complete(
+                conversation_id,
+                stage="plan",
+                messages=self._prompt_messages(self.plan_instructions, request),
+                temperature=0.2,
+                response_format=Plan,
             )
             logger.info(f"Received response: {response}")
 
@@ -292,7 +920,7 @@ class LLMService:
             )
             plan_message.set_token_usage(response.usage)
 
-            conversation.messages.append(plan_message)
+            conversation.add_message(plan_message)
             self.conversation_manager.save_conversation(conversation)
 
             logger.info(f"Generated plan: {plan}")
@@ -301,8 +929,11 @@ class LLMService:
             logger.error(f"Error creating plan: {e}")
             return None
 
-    async def execute_plan(self, conversation_id: int, plan: Plan):
-        """Executes a plan step-by-step, with narration."""
+    async def execute_plan(self, conversation_id: int, plan: Plan) -> int:
+        """
+        Executes a plan step-by-step, with narration.
+        Returns the number of LLM calls made.
+        """
         step_outputs = {}
         conversation = self.conversation_manager.load_conversation(conversation_id)
 
@@ -315,7 +946,7 @@ class LLMService:
             "Begin with Step 1."
         )
 
-        conversation.messages.append(
+        conversation.add_message(
             Message(
                 id=len(conversation.messages),
                 content=plan_prompt,
@@ -325,18 +956,18 @@ class LLMService:
         )
         self.conversation_manager.save_conversation(conversation)
 
-        llm_initial_response = await asyncio.get_event_loop().run_in_executor(
-            None,
-            lambda: completion(
-                model=self.model,
-                messages=[{"role": ChatRole.USER.value, "content": plan_prompt}],
-                temperature=0.2,
-                response_format=StepMessage,
-            ),
+        model_response, usage = await self._complete_text(
+            conversation_id,
+            len(conversation.messages),
+            stage="step",
+            stream_field="message",
+            messages=[{"role": ChatRole.USER.value, "content": plan_prompt}],
+            temperature=0.2,
+            response_format=StepMessage,
         )
 
-        logger.info(f"Received initial response: {llm_initial_response}")
-        model_response = llm_initial_response.choices[0].message.content
+        llm_calls = 1
+        logger.info(f"Received initial response: {model_response}")
         current_step = StepMessage.model_validate_json(model_response)
 
         current_message = Message(
@@ -345,8 +976,8 @@ class LLMService:
             role=ChatRole.ASSISTANT,
             type=MessageType.TEXT,
         )
-        current_message.set_token_usage(llm_initial_response.usage)
-        conversation.messages.append(current_message)
+        current_message.set_token_usage(usage)
+        conversation.add_message(current_message)
         self.conversation_manager.save_conversation(conversation)
 
         logger.info(f"Starting plan execution with initial message: {current_step}")
@@ -361,18 +992,17 @@ class LLMService:
                 current_step.tool_input, step_outputs
             )
 
-            tool_output, needs_confirmation = self.tool_manager.execute_tool(
-                current_step.tool_type, tool_input
-            )
-
-            if needs_confirmation:
-                # For now, we'll auto-confirm. The confirmation flow needs to be integrated with the async UI.
-                # This is a simplification to keep moving forward.
-                logger.warning(
-                    f"Tool {current_step.tool_type} requires confirmation. Auto-confirming for now."
-                )
-                tool_output, _ = self.tool_manager.execute_tool(
-                    current_step.tool_type, tool_input, confirmed=True
+            with tracer.span(
+                "plan.step",
+                **{
+                    "plan.step_id": current_step.step_id,
+                    "tool.type": (
+                        current_step.tool_type.value if current_step.tool_type else None
+                    ),
+                },
+            ):
+                tool_output = await asyncio.to_thread(
+                    self._run_tool, current_step.tool_type, tool_input
                 )
 
             step_outputs[f"step_{current_step.step_id}_output"] = tool_output
@@ -385,7 +1015,7 @@ class LLMService:
                 created_at=datetime.now(),
             )
 
-            conversation.messages.append(tool_message)
+            conversation.add_message(tool_message)
             self.conversation_manager.save_conversation(conversation)
             if self.ui_callback:
                 await self.ui_callback(tool_message)
@@ -393,20 +1023,21 @@ class LLMService:
             # Now, inform the LLM of the tool output and ask for the next step
             followup_msg = (
                 f"The full plan is:\n{plan}\n\n"
-                f"The output of the previous step (Step {current_step.step_id}) is as follows:\n{tool_output}\n\n"
+                f"The output of the previous step (Step {current_step.step_id}) is as follows:\n"
+                f"{self.context_builder.truncate(tool_output)}\n\n"
                 "Based on this result, please provide the next step in the plan. If the plan is complete, set `plan_complete` to True.\n"
                 "Format your response as a JSON object adhering to the StepMessage schema."
             )
-            llm_followup_response = await asyncio.get_event_loop().run_in_executor(
-                None,
-                lambda: completion(
-                    model=self.model,
-                    messages=[{"role": ChatRole.USER.value, "content": followup_msg}],
-                    temperature=0.2,
-                    response_format=StepMessage,
-                ),
+            model_response, usage = await self._complete_text(
+                conversation_id,
+                len(conversation.messages),
+                stage="step",
+                stream_field="message",
+                messages=[{"role": ChatRole.USER.value, "content": followup_msg}],
+                temperature=0.2,
+                response_format=StepMessage,
             )
-            model_response = llm_followup_response.choices[0].message.content
+            llm_calls += 1
             current_step = StepMessage.model_validate_json(model_response)
             current_step_message = Message(
                 id=len(conversation.messages),
@@ -414,8 +1045,8 @@ class LLMService:
                 role=ChatRole.ASSISTANT,
                 type=MessageType.TEXT,
             )
-            current_step_message.set_token_usage(llm_followup_response.usage)
-            conversation.messages.append(current_step_message)
+            current_step_message.set_token_usage(usage)
+            conversation.add_message(current_step_message)
             self.conversation_manager.save_conversation(conversation)
 
             logger.info(f"Proceeding to next step with message: {current_step}")
@@ -423,6 +1054,305 @@ class LLMService:
             if self.ui_callback:
                 await self.ui_callback(current_step_message)
 
+        return llm_calls
+
+    async def execute_plan_deterministic(
+        self, conversation_id: int, plan: Plan, objective: str
+    ) -> int:
+        """
+        Executes the plan returned by create_plan directly as a dependency graph:
+        independent steps run concurrently and each step starts as soon as the
+        outputs it references are available. The LLM is only called to repair a
+        step whose tool input is invalid or whose tool reports an error, to carry
+        out steps without a tool, and once for the final summary.
+        Falls back to execute_plan if the steps cannot be scheduled.
+        Returns the number of LLM calls made.
+        """
+        try:
+            self.plan_scheduler.build_dependencies(plan)
+        except ValueError as e:
+            logger.warning(f"Plan cannot be scheduled ({e}), executing step by step.")
+            return await self.execute_plan(conversation_id, plan)
+
+        conversation = self.conversation_manager.load_conversation(conversation_id)
+        llm_calls = 0
+
+        async def run_step(step: Step, step_outputs: dict[str, str]) -> str:
+            nonlocal llm_calls
+            with tracer.span(
+                "plan.step",
+                **{
+                    "plan.step_id": step.step_id,
+                    "tool.type": step.tool_type.value if step.tool_type else None,
+                },
+            ):
+                await self._post_message(
+                    conversation,
+                    f"Step {step.step_id}: {step.thought}",
+                    MessageType.TEXT,
+                )
+
+                if not step.tool_type:
+                    llm_calls += 1
+                    output, usage = await self._complete_reasoning_step(
+                        conversation_id, plan, step, step_outputs
+                    )
+                    await self._post_message(
+                        conversation, output, MessageType.TEXT, usage
+                    )
+                    return output
+
+                tool_input = self.substitute_placeholders(step.tool_input, step_outputs)
+                if self.tool_manager.validate_tool_input(step.tool_type, tool_input):
+                    # Tools block, so they run in worker threads to overlap with each other
+                    tool_output = await asyncio.to_thread(
+                        self._run_tool, step.tool_type, tool_input
+                    )
+                else:
+                    tool_output = (
+                        f"Error: Invalid input for {step.tool_type.value}: {tool_input}"
+                    )
+
+                if self.tool_manager.is_error_output(tool_output):
+                    llm_calls += 1
+                    repaired_step = await self._repair_step(
+                        conversation_id,
+                        plan,
+                        step,
+                        tool_input,
+                        tool_output,
+                        step_outputs,
+                    )
+                    if repaired_step and self.tool_manager.validate_tool_input(
+                        repaired_step.tool_type, repaired_step.tool_input
+                    ):
+                        logger.info(f"Retrying step {step.step_id} as {repaired_step}")
+                        tool_output = await asyncio.to_thread(
+                            self._run_tool,
+                            repaired_step.tool_type,
+                            repaired_step.tool_input,
+                        )
+
+                await self._post_message(conversation, tool_output, MessageType.TOOL)
+                return tool_output
+
+        start_time = time.perf_counter()
+        step_outputs = await self.plan_scheduler.run(plan, run_step)
+        logger.info(
+            f"Executed {len(plan.steps)} steps (critical path "
+            f"{self.plan_scheduler.critical_path_length(plan)}) in "
+            f"{(time.perf_counter() - start_time) * 1000:.0f} ms"
+        )
+
+        summary_prompt = (
+            f"The user's objective was: '{objective}'\n\n"
+            f"You executed the following plan:\n{plan}\n\n"
+            f"The outputs of the steps are:\n{self._format_step_outputs(plan, step_outputs)}\n\n"
+            "Give the user a concise final answer based on these results."
+        )
+        llm_calls += 1
+        summary, usage = await self._complete_text(
+            conversation_id,
+            len(conversation.messages),
+            stage="summary",
+            messages=[
+                {
+                    "role": ChatRole.SYSTEM.value,
+                    "content": self.conversation_manager.system_message,
+                },
+                {"role": ChatRole.USER.value, "content": summary_prompt},
+            ],
+            temperature=0.2,
+        )
+        await self._post_message(conversation, summary, MessageType.TEXT, usage)
+        return llm_calls
+
+    def _format_step_outputs(
+        self, plan: Plan, step_outputs: dict[str, str], finished_only: bool = False
+    ) -> str:
+        lines = []
+        for step in plan.steps:
+            output = step_outputs.get(f"step_{step.step_id}_output")
+            if output is None and finished_only:
+                continue
+            lines.append(
+                f"Step {step.step_id}: "
+                + (
+                    self.context_builder.truncate(output)
+                    if output
+                    else "(not completed)"
+                )
+            )
+        return "\n".join(lines)
+
+    async def _complete_reasoning_step(
+        self, conversation_id: int, plan: Plan, step: Step, step_outputs: dict[str, str]
+    ) -> tuple[str, dict]:
+        """Asks the LLM to carry out a plan step that does not use a tool."""
+        prompt = (
+            f"The full plan is:\n{plan}\n\n"
+            f"The outputs of the finished steps are:\n"
+            f"{self._format_step_outputs(plan, step_outputs, finished_only=True)}\n\n"
+            f"Carry out Step {step.step_id}: {step.thought}\n"
+            "Respond with the result of this step only."
+        )
+        try:
+            response = await self._complete(
+                conversation_id,
+                stage="step",
+                messages=[{"role": ChatRole.USER.value, "content": prompt}],
+                temperature=0.2,
+            )
+            return response.choices[0].message.content, response.usage
+        except Exception as e:
+            logger.error(f"Error carrying out step {step.step_id}: {e}")
+            return f"Error: {e}", {}
+
+    async def _repair_step(
+        self,
+        conversation_id: int,
+        plan: Plan,
+        step: Step,
+        tool_input: str,
+        error: str,
+        step_outputs: dict[str, str],
+    ) -> Step | None:
+        """Asks the LLM for a corrected version of a failed plan step."""
+        prompt = (
+            f"The full plan is:\n{plan}\n\n"
+            f"The outputs of the finished steps are:\n"
+            f"{self._format_step_outputs(plan, step_outputs, finished_only=True)}\n\n"
+            f"Step {step.step_id} failed.\nTool: {step.tool_type.value}\n"
+            f"Tool input: {tool_input}\nResult: {error}\n\n"
+            "Provide a corrected version of this step. Use the actual outputs of "
+            "the finished steps instead of placeholders, and make sure 'tool_input' "
+            "is a JSON string matching the tool's input schema."
+        )
+        try:
+            response = await self._complete(
+                conversation_id,
+                stage="step",
+                messages=[
+                    {
+                        "role": ChatRole.SYSTEM.value,
+                        "content": self.conversation_manager.system_message,
+                    },
+                    {"role": ChatRole.USER.value, "content": prompt},
+                ],
+                temperature=0.2,
+                response_format=Step,
+            )
+            repaired_step = Step.model_validate_json(
+                response.choices[0].message.content
+            )
+            return repaired_step if repaired_step.tool_type else None
+        except Exception as e:
+            logger.error(f"Error repairing step {step.step_id}: {e}")
+            return None
+
+    async def _post_message(
+        self,
+        conversation,
+        content: str,
+        message_type: MessageType,
+        usage: dict | None = None,
+    ) -> Message:
+        """Appends an assistant message to the conversation, saves it and shows it."""
+        message = Message(
+            id=len(conversation.messages),
+            content=content,
+            role=ChatRole.ASSISTANT,
+            type=message_type,
+            created_at=datetime.now(),
+        )
+        if usage:
+            message.set_token_usage(usage)
+        conversation.add_message(message)
+        self.conversation_manager.save_conversation(conversation)
+        if self.ui_callback:
+            await self.ui_callback(message)
+        return message
+
+    def _describe_step_ordering(self) -> str:
+        """Tells the planner which steps the PlanScheduler runs in parallel and which in order."""
+        ordered = [
+            tool.name
+            for tool_type, tool in self.tool_manager.tool_registry.items()
+            if self.tool_manager.runs_in_order(tool_type)
+        ]
+        if not ordered:
+            return "Steps that do not reference each other may run at the same time. "
+        return (
+            "Steps that do not reference each other may run at the same time, "
+            f"except {' and '.join(ordered)} steps that can change state, which run "
+            "one at a time in step order; read-only commands only wait for earlier steps that change state. "
+        )
+
+    def _step_state_access(self, step: Step) -> str | None:
+        """Steps that may change state write, read-only runs of such tools read."""
+        if not step.tool_type:
+            return None
+        if self.tool_manager.runs_in_order(step.tool_type, step.tool_input):
+            return WRITE
+        if self.tool_manager.has_side_effects(step.tool_type):
+            return READ
+        return None
+
+    def choose_plan_execution(self, plan: Plan) -> str:
+        """
+        Picks "deterministic" for plans that are fully specified and free of side
+        effects: their steps can be scheduled and every tool step names a
+        registered tool and an input with which it changes nothing, such as a
+        calculation or a read-only shell command. Plans that run python or
+        commands that can change state are left to the interactive loop, which
+        runs one step at a time in order and lets the LLM adapt each step to
+        the previous results, instead of repairing a failed command with an
+        unrelated one.
+        """
+        try:
+            self.plan_scheduler.build_dependencies(plan)
+        except ValueError:
+            return "interactive"
+        for step in plan.steps:
+            if step.tool_type and (
+                step.tool_type not in self.tool_manager.tool_registry
+                or not step.tool_input
+                or self.tool_manager.has_side_effects(step.tool_type, step.tool_input)
+            ):
+                return "interactive"
+        return "deterministic"
+
+    def get_plan_execution_stats(self) -> dict:
+        """Returns per-mode plan counts, LLM calls and execution time."""
+        return {
+            mode: {
+                **stats,
+                "llm_calls_per_plan": (
+                    stats["llm_calls"] / stats["plans"] if stats["plans"] else 0.0
+                ),
+                "avg_duration_ms": (
+                    stats["duration_ms"] / stats["plans"] if stats["plans"] else 0.0
+                ),
+            }
+            for mode, stats in self.plan_execution_stats.items()
+        }
+
+    def _run_tool(self, tool_type: ToolType, tool_input: str) -> str:
+        """Executes a tool and returns its output, auto-confirming if required."""
+        tool_output, needs_confirmation = self.tool_manager.execute_tool(
+            tool_type, tool_input
+        )
+        if needs_confirmation:
+            # For now, we'll auto-confirm. The confirmation flow needs to be integrated with the async UI.
+            # This is a simplification to keep moving forward.
+            logger.warning(
+                f"Tool {tool_type} requires confirmation. Auto-confirming for now."
+            )
+            tool_output, _ = self.tool_manager.execute_tool(
+                tool_type, tool_input, confirmed=True
+            )
+        return tool_output
+
     def substitute_placeholders(self, text: str, outputs: dict) -> str:
         """Substitutes placeholders like $step_1_output with actual values."""
         if not text:
@@ -0,0 +1,290 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable
+import litellm
+from logger import logger
+from metrics import LLM_REQUEST_SECONDS, LLM_REQUESTS
+from tracing import tracer
+
+
+class ModelStats:
+    """Rolling latency and error statistics and circuit breaker state of one model."""
+
+    def __init__(self, window: int):
+        self.latencies_ms: deque[float] = deque(maxlen=window)
+        # Streaming requests return once the stream is open: time to first byte
+        self.stream_latencies_ms: deque[float] = deque(maxlen=window)
+        self.outcomes: deque[bool] = deque(maxlen=window)  # True for errors
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0  # Circuit is open while time.monotonic() is before this
+        self.circuit_opened = 0
+
+    def percentile(self, fraction: float, stream: bool = False) -> float | None:
+        latencies = self.stream_latencies_ms if stream else self.latencies_ms
+        if not latencies:
+            return None
+        ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def error_rate(self) -> float:
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+
+class ModelRouter:
+    """
+    Sends completions of each stage to the models configured for it, in order
+    of preference, and keeps rolling latency and error statistics per model.
+
+    Failed attempts are retried with jittered exponential backoff, moving on to
+    the next model of the stage. After `failure_threshold` consecutive failures
+    a model's circuit opens and it gets no traffic for `circuit_cooldown`
+    seconds; then a single trial request decides whether it closes again.
+    With `hedge_requests`, a non-streaming request that takes longer than the
+    model's p95 latency gets a second request on the next model, and the first
+    answer wins. Latencies of streaming requests measure the time to the first
+    byte and are kept apart from complete responses, so they do not lower the
+    hedge delay.
+
+    Every attempt is bounded by the timeout of its stage: DEFAULT_TIMEOUTS
+    updated with `stage_timeouts`, or `attempt_timeout` for other stages. For
+    streaming requests it bounds the wait for the stream to open.
+
+    `completion` is the function that performs a request, litellm.acompletion
+    by default; tests and benchmarks pass a local fake.
+    """
+
+    # Seconds per attempt; classification prompts are short, plans are long
+    DEFAULT_TIMEOUTS = {
+        "classify": 15.0,
+        "tool_call": 30.0,
+        "chat": 60.0,
+        "step": 60.0,
+        "summary": 60.0,
+        "plan": 90.0,
+    }
+
+    def __init__(
+        self,
+        default_models: list[str],
+        stage_models: dict[str, list[str]] | None = None,
+        completion: Callable[..., Awaitable] | None = None,
+        max_retries: int = 2,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        attempt_timeout: float | None = 60.0,
+        stage_timeouts: dict[str, float] | None = None,
+        hedge_requests: bool = False,
+        hedge_percentile: float = 0.95,
+        hedge_min_samples: int = 20,
+        failure_threshold: int = 5,
+        circuit_cooldown: float = 30.0,
+        window: int = 100,
+    ):
+        self.default_models = default_models
+        self.stage_models = stage_models or {}
+        self.completion = completion or litellm.acompletion
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.attempt_timeout = attempt_timeout
+        self.stage_timeouts = {**self.DEFAULT_TIMEOUTS, **(stage_timeouts or {})}
+        self.hedge_requests = hedge_requests
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.failure_threshold = failure_threshold
+        self.circuit_cooldown = circuit_cooldown
+        self.window = window
+
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._stats: dict[str, ModelStats] = {}
+
+    def _model_stats(self, model: str) -> ModelStats:
+        if model not in self._stats:
+            self._stats[model] = ModelStats(self.window)
+        return self._stats[model]
+
+    def models_for(self, stage: str) -> list[str]:
+        """The models of a stage in order of preference."""
+        return self.stage_models.get(stage) or self.default_models
+
+    def timeout_for(self, stage: str) -> float | None:
+        """Seconds an attempt of the stage may take, or None for no limit."""
+        return self.stage_timeouts.get(stage, self.attempt_timeout)
+
+    def _pick_model(self, models: list[str], exclude: set[str]) -> str:
+        """
+        The first model whose circuit is closed, skipping models that already
+        failed this request where possible. A model whose cooldown has passed
+        gets one trial request. If every circuit is open, the one that reopens
+        soonest is used anyway rather than failing without a request.
+        """
+        now = time.monotonic()
+        candidates = [model for model in models if model not in exclude] or models
+        for model in candidates:
+            stats = self._model_stats(model)
+            if stats.open_until <= now:
+                if stats.consecutive_failures >= self.failure_threshold:
+                    # Half-open: keep others out until this trial returns
+                    stats.open_until = now + self.circuit_cooldown
+                return model
+        return min(candidates, key=lambda model: self._model_stats(model).open_until)
+
+    def _record(
+        self,
+        model: str,
+        latency_ms: float,
+        error: Exception | None,
+        stream: bool = False,
+    ):
+        stats = self._model_stats(model)
+        stats.requests += 1
+        stats.outcomes.append(error is not None)
+        if error is None:
+            if stream:
+                stats.stream_latencies_ms.append(latency_ms)
+            else:
+                stats.latencies_ms.append(latency_ms)
+            stats.consecutive_failures = 0
+            stats.open_until = 0.0
+            return
+
+        stats.errors += 1
+        stats.consecutive_failures += 1
+        if stats.consecutive_failures >= self.failure_threshold:
+            if stats.open_until <= time.monotonic():
+                stats.circuit_opened += 1
+                logger.warning(
+                    f"Opening circuit for {model} after "
+                    f"{stats.consecutive_failures} consecutive failures"
+                )
+            stats.open_until = time.monotonic() + self.circuit_cooldown
+
+    async def _attempt(self, stage: str, model: str, kwargs: dict):
+        stream = bool(kwargs.get("stream"))
+        timeout = self.timeout_for(stage)
+        start = time.perf_counter()
+        try:
+            with tracer.span("llm.attempt", **{"gen_ai.request.model": model}):
+                request = self.completion(model=model, **kwargs)
+                if timeout:
+                    response = await asyncio.wait_for(request, timeout)
+                else:
+                    response = await request
+        except asyncio.CancelledError:
+            # A losing hedge; neither a success nor a failure of the model
+            LLM_REQUESTS.labels(stage, model, "cancelled").inc()
+            raise
+        except Exception as e:
+            elapsed = time.perf_counter() - start
+            self._record(model, elapsed * 1000, e, stream)
+            LLM_REQUEST_SECONDS.labels(stage, model).observe(elapsed)
+            LLM_REQUESTS.labels(stage, model, "error").inc()
+            raise
+        elapsed = time.perf_counter() - start
+        self._record(model, elapsed * 1000, None, stream)
+        LLM_REQUEST_SECONDS.labels(stage, model).observe(elapsed)
+        LLM_REQUESTS.labels(stage, model, "ok").inc()
+        return response
+
+    def _hedge_delay(self, model: str) -> float | None:
+        stats = self._model_stats(model)
+        if len(stats.latencies_ms) < self.hedge_min_samples:
+            return None
+        return stats.percentile(self.hedge_percentile) / 1000
+
+    async def _attempt_hedged(
+        self, stage: str, model: str, hedge_model: str, kwargs: dict
+    ):
+        """Runs an attempt and, if it outlasts the p95 delay, a second one in parallel."""
+        first = asyncio.create_task(self._attempt(stage, model, kwargs))
+        delay = self._hedge_delay(model)
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+
+        self.hedges += 1
+        logger.info(f"Hedging slow request to {model} with {hedge_model}")
+        second = asyncio.create_task(self._attempt(stage, hedge_model, kwargs))
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @staticmethod
+    def is_retryable(error: Exception) -> bool:
+        """Malformed requests fail the same way on every attempt."""
+        return not isinstance(error, litellm.BadRequestError)
+
+    async def complete(self, stage: str, **kwargs):
+        """
+        Runs a completion for `stage` with retries, fallback to the next model of
+        the stage and, for non-streaming requests, hedging. Raises the last error
+        once all attempts failed.
+        """
+        models = self.models_for(stage)
+        failed: set[str] = set()
+        for attempt in range(self.max_retries + 1):
+            model = self._pick_model(models, failed)
+            try:
+                if (
+                    self.hedge_requests
+                    and not kwargs.get("stream")
+                    and self._hedge_delay(model) is not None
+                ):
+                    hedge_model = self._pick_model(models, failed | {model})
+                    return await self._attempt_hedged(stage, model, hedge_model, kwargs)
+                return await self._attempt(stage, model, kwargs)
+            except Exception as e:
+                if attempt == self.max_retries or not self.is_retryable(e):
+                    raise
+                failed.add(model)
+                self.retries += 1
+                backoff = random.uniform(
+                    0, min(self.backoff_max, self.backoff_base * 2**attempt)
+                )
+                logger.warning(
+                    f"{stage} completion with {model} failed ({e!r}), "
+                    f"retrying in {backoff:.2f} s"
+                )
+                await asyncio.sleep(backoff)
+
+    def get_stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "models": {
+                model: {
+                    "requests": stats.requests,
+                    "errors": stats.errors,
+                    "error_rate": stats.error_rate(),
+                    "p50_ms": stats.percentile(0.5),
+                    "p95_ms": stats.percentile(0.95),
+                    "stream_ttfb_p50_ms": stats.percentile(0.5, stream=True),
+                    "stream_ttfb_p95_ms": stats.percentile(0.95, stream=True),
+                    "circuit": "open" if stats.open_until > now else "closed",
+                    "circuit_opened": stats.circuit_opened,
+                }
+                for model, stats in self._stats.items()
+            },
+        }
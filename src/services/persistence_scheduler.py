@@ -0,0 +1,184 @@
+import asyncio
+import threading
+import time
+from enum import Enum
+from typing import Callable, Optional
+from models.chat import Conversation
+from storage.base_store import BaseConversationStore
+from logger import logger
+from metrics import WRITE_SECONDS
+from tracing import tracer
+
+
+class Durability(str, Enum):
+    EVERY_MESSAGE = "every_message"  # Write as soon as the writer thread is free
+    INTERVAL = "interval"  # Write at most every flush_interval_ms
+    END_OF_TURN = "end_of_turn"  # Write when the turn ends
+
+
+class PersistenceScheduler:
+    """
+    Coalesces save requests and writes them to the store from a background
+    thread, so the event loop never blocks on disk I/O. All save requests for a
+    conversation that arrive before its next write are folded into that write.
+    """
+
+    def __init__(
+        self,
+        store: BaseConversationStore,
+        durability: Durability = Durability.INTERVAL,
+        flush_interval_ms: int = 250,
+    ):
+        self.store = store
+        self.durability = Durability(durability)
+        self.flush_interval_ms = flush_interval_ms
+
+        self.save_requests = 0
+        self.writes = 0
+        self.coalesced = 0
+        self.failed_writes = 0
+
+        self._write_listeners: list[Callable[[Conversation], None]] = []
+        self._pending: dict[int, Conversation] = {}
+        # Conversations whose turn ended since the writer thread last woke up
+        self._ended_turns: set[int] = set()
+        self._lock = threading.Lock()
+        # Serializes writes so an older copy can never overwrite a newer one
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(
+            target=self._run, name="conversation-writer", daemon=True
+        )
+        self._thread.start()
+
+    def add_write_listener(self, listener: Callable[[Conversation], None]):
+        """Registers a callback that receives each conversation after it was written."""
+        self._write_listeners.append(listener)
+
+    def request_save(self, conversation: Conversation):
+        """Marks a conversation for writing. Returns immediately."""
+        with self._lock:
+            self.save_requests += 1
+            if conversation.id in self._pending:
+                self.coalesced += 1
+            self._pending[conversation.id] = conversation
+        if self.durability == Durability.EVERY_MESSAGE:
+            self._wakeup.set()
+
+    def end_turn(self, conversation_id: int):
+        """Asks the writer thread to write the conversation whose turn ended."""
+        with self._lock:
+            self._ended_turns.add(conversation_id)
+        self._wakeup.set()
+
+    def get_pending(self, conversation_id: int) -> Optional[Conversation]:
+        with self._lock:
+            return self._pending.get(conversation_id)
+
+    def discard(self, conversation_id: int):
+        """Drops a pending conversation, waiting for any write in progress."""
+        with self._write_lock, self._lock:
+            self._pending.pop(conversation_id, None)
+
+    def has_pending(self) -> bool:
+        with self._lock:
+            return bool(self._pending)
+
+    def flush(self, conversation_id: int | None = None):
+        """Writes pending conversations in the calling thread, either one or all of them."""
+        with self._write_lock:
+            with self._lock:
+                if conversation_id is None:
+                    batch = list(self._pending.values())
+                    self._pending.clear()
+                elif conversation_id in self._pending:
+                    batch = [self._pending.pop(conversation_id)]
+                else:
+                    return
+                # Take a consistent cut; the live objects keep changing on the event loop
+                copies = [
+                    (
+                        conversation,
+                        conversation.model_copy(
+                            update={"messages": list(conversation.messages)}
+                        ),
+                    )
+                    for conversation in batch
+                ]
+
+            for conversation, copy in copies:
+                try:
+                    start = time.perf_counter()
+                    with tracer.span(
+                        "conversation.write",
+                        **{
+                            "conversation.id": conversation.id,
+                            "conversation.messages": len(copy.messages),
+                        },
+                    ):
+                        self.store.write_conversation(copy)
+                    WRITE_SECONDS.observe(time.perf_counter() - start)
+                    self.writes += 1
+                except Exception as e:
+                    logger.error(f"Error saving conversation {conversation.id}: {e}")
+                    self.failed_writes += 1
+                    with self._lock:
+                        self._pending.setdefault(conversation.id, conversation)
+                    continue
+
+                for listener in self._write_listeners:
+                    try:
+                        listener(copy)
+                    except Exception as e:
+                        logger.error(
+                            f"Write listener failed for conversation {conversation.id}: {e}"
+                        )
+
+    async def flush_async(self, conversation_id: int | None = None):
+        """Runs flush() in the default executor."""
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.flush, conversation_id
+        )
+
+    def _run(self):
+        timeout = (
+            self.flush_interval_ms / 1000
+            if self.durability == Durability.INTERVAL
+            else None
+        )
+        while not self._stopped:
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+            with self._lock:
+                ended_turns = self._ended_turns
+                self._ended_turns = set()
+            if self.durability == Durability.END_OF_TURN:
+                # Conversations still in the middle of a turn keep waiting
+                for conversation_id in ended_turns:
+                    self.flush(conversation_id)
+            elif self.has_pending():
+                self.flush()
+
+    def get_stats(self) -> dict[str, int]:
+        """Returns save request, write and coalescing counters"""
+        with self._lock:
+            return {
+                "save_requests": self.save_requests,
+                "writes": self.writes,
+                "coalesced": self.coalesced,
+                "failed_writes": self.failed_writes,
+                "pending": len(self._pending),
+            }
+
+    def close(self):
+        """Stops the writer thread and writes everything that is still pending."""
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+        stats = self.get_stats()
+        logger.info(
+            f"Persistence scheduler closed: {stats['save_requests']} save requests, "
+            f"{stats['writes']} writes, {stats['coalesced']} coalesced."
+        )
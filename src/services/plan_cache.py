@@ -0,0 +1,438 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from models.plan import Plan
+from services.intent_cache import IntentCache
+from logger import logger
+
+# Filler words that do not change what a plan has to do
+_STOP_WORDS = frozenset(
+    "a an the in on of for to and all my me please can you could would i".split()
+)
+# Words that may be put into a tool input in place of another: no quotes,
+# whitespace or shell syntax
+_SLOT_PATTERN = re.compile(r"[\w.,:/~@%+*=-]+")
+_BOUNDARY = r"\w.*/~-"
+
+
+@dataclass
+class PlanCacheEntry:
+    key: str
+    objective: str
+    tool_catalog_hash: str
+    model: str
+    plan: Plan
+    # Objective words without filler; words at `slots` are tool arguments
+    words: tuple[str, ...]
+    slots: tuple[int, ...]
+    created_at: float
+    last_used: float
+    hits: int = 0
+
+    @property
+    def template(self) -> tuple[str | None, ...]:
+        return PlanCache.make_template(self.words, self.slots)
+
+
+class PlanCache:
+    """
+    Cache of validated Plans for recurring objectives, reused for the same
+    objective and for objectives that only differ in the arguments of the
+    plan's tools.
+
+    When a plan is stored, each objective word that occurs exactly once in the
+    plan's tool inputs becomes a slot, like "src" in "list the files in src"
+    for `ls src`. The other words, lowercased and without filler words, form
+    the objective's template. A lookup that misses the exact objective looks
+    for an entry with the same template, i.e. the same words apart from the
+    slots, and fills its slots from the new objective: "list the files in
+    docs" reuses the plan as `ls docs`. Objectives that differ in any other
+    word, or in a word the plan does not use exactly once, are planned anew,
+    so a reused plan never runs with the arguments of another objective.
+    Only plans made with the same tool catalog and model are returned.
+
+    Entries are kept in memory and in an SQLite table, expire after
+    `ttl_seconds`, and the least recently used ones are evicted beyond
+    `max_entries`. Conversations can opt out, which is persisted as well.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS plan_cache (
+            key TEXT PRIMARY KEY,
+            objective TEXT NOT NULL,
+            tool_catalog_hash TEXT NOT NULL,
+            model TEXT NOT NULL,
+            plan TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS plan_cache_opt_out (
+            conversation_id INTEGER PRIMARY KEY
+        );
+    """
+
+    def __init__(
+        self,
+        db_path: str | None = None,
+        max_entries: int = 1000,
+        ttl_seconds: float = 30 * 24 * 60 * 60,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self.exact_hits = 0
+        self.adapted_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries: dict[str, PlanCacheEntry] = {}
+        # Keys of the entries per template, and how many entries have each
+        # (word count, slot positions) layout, which lookups have to try
+        self._templates: dict[tuple, set[str]] = defaultdict(set)
+        self._layouts: dict[tuple[int, tuple[int, ...]], int] = defaultdict(int)
+        self._opted_out: set[int] = set()
+        self._lock = threading.Lock()
+
+        self.connection = None
+        if db_path:
+            self.connection = sqlite3.connect(db_path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(self.SCHEMA)
+            self.connection.commit()
+            self._load()
+
+    def _load(self):
+        cutoff = time.time() - self.ttl_seconds
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM plan_cache WHERE last_used < ?", (cutoff,)
+            )
+        rows = self.connection.execute(
+            """
+            SELECT key, objective, tool_catalog_hash, model, plan, created_at, last_used, hits
+            FROM plan_cache ORDER BY last_used DESC LIMIT ?
+            """,
+            (self.max_entries,),
+        ).fetchall()
+        for key, objective, catalog_hash, model, plan_json, created, used, hits in rows:
+            try:
+                plan = Plan.model_validate_json(plan_json)
+            except ValueError as e:
+                logger.warning(f"Dropping unreadable cached plan {key}: {e}")
+                continue
+            self._add_entry(
+                self._make_entry(
+                    key, objective, catalog_hash, model, plan, created, used, hits
+                )
+            )
+        self._opted_out = {
+            conversation_id
+            for (conversation_id,) in self.connection.execute(
+                "SELECT conversation_id FROM plan_cache_opt_out"
+            )
+        }
+        logger.info(f"Loaded {len(self._entries)} cached plans")
+
+    @staticmethod
+    def make_words(objective: str) -> tuple[str, ...]:
+        """Whitespace-separated words of the objective without filler words or trailing punctuation."""
+        words = (word.strip("\"'").rstrip(".,!?;:") for word in objective.split())
+        return tuple(word for word in words if word and word.lower() not in _STOP_WORDS)
+
+    @staticmethod
+    def make_template(
+        words: tuple[str, ...], slots: tuple[int, ...]
+    ) -> tuple[str | None, ...]:
+        return tuple(
+            None if position in slots else word.lower()
+            for position, word in enumerate(words)
+        )
+
+    @staticmethod
+    def _tool_arguments(plan: Plan) -> list[dict] | None:
+        """The parsed tool inputs of the plan, or None if one is not a JSON object."""
+        arguments = []
+        for step in plan.steps:
+            if not step.tool_type or not step.tool_input:
+                continue
+            try:
+                parsed = json.loads(step.tool_input)
+            except ValueError:
+                return None
+            if not isinstance(parsed, dict):
+                return None
+            arguments.append(parsed)
+        return arguments
+
+    @staticmethod
+    def _word_pattern(*words: str) -> re.Pattern:
+        """Matches any of the words where it is not part of a longer word or path."""
+        alternatives = "|".join(
+            re.escape(word) for word in sorted(words, key=len, reverse=True)
+        )
+        return re.compile(rf"(?<![{_BOUNDARY}])(?:{alternatives})(?![{_BOUNDARY}])")
+
+    @classmethod
+    def find_slots(cls, words: tuple[str, ...], plan: Plan) -> tuple[int, ...]:
+        """Positions of the words that occur exactly once in the plan's tool inputs."""
+        arguments = cls._tool_arguments(plan)
+        if not arguments:
+            return ()
+        values = [
+            value
+            for parsed in arguments
+            for value in parsed.values()
+            if isinstance(value, str)
+        ]
+        slots = []
+        for position, word in enumerate(words):
+            if words.count(word) != 1 or not _SLOT_PATTERN.fullmatch(word):
+                continue
+            pattern = cls._word_pattern(word)
+            if sum(len(pattern.findall(value)) for value in values) == 1:
+                slots.append(position)
+        return tuple(slots)
+
+    @classmethod
+    def fill_slots(cls, plan: Plan, substitutions: dict[str, str]) -> Plan:
+        """A copy of the plan with each slot word in its tool inputs replaced."""
+        plan = plan.model_copy(deep=True)
+        if not substitutions:
+            return plan
+        # All words are replaced in one pass, so swapped arguments stay swapped
+        pattern = cls._word_pattern(*substitutions)
+        for step in plan.steps:
+            if not step.tool_type or not step.tool_input:
+                continue
+            arguments = json.loads(step.tool_input)
+            for name, value in arguments.items():
+                if isinstance(value, str):
+                    arguments[name] = pattern.sub(
+                        lambda match: substitutions[match.group()], value
+                    )
+            step.tool_input = json.dumps(arguments)
+        return plan
+
+    def _make_entry(
+        self,
+        key: str,
+        objective: str,
+        tool_catalog_hash: str,
+        model: str,
+        plan: Plan,
+        created_at: float,
+        last_used: float,
+        hits: int = 0,
+    ) -> PlanCacheEntry:
+        words = self.make_words(objective)
+        return PlanCacheEntry(
+            key=key,
+            objective=objective,
+            tool_catalog_hash=tool_catalog_hash,
+            model=model,
+            plan=plan,
+            words=words,
+            slots=self.find_slots(words, plan),
+            created_at=created_at,
+            last_used=last_used,
+            hits=hits,
+        )
+
+    def _add_entry(self, entry: PlanCacheEntry):
+        self._remove_entry(entry.key)
+        self._entries[entry.key] = entry
+        self._templates[entry.template].add(entry.key)
+        self._layouts[(len(entry.words), entry.slots)] += 1
+
+    def _remove_entry(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        template = entry.template
+        self._templates[template].discard(key)
+        if not self._templates[template]:
+            del self._templates[template]
+        layout = (len(entry.words), entry.slots)
+        self._layouts[layout] -= 1
+        if not self._layouts[layout]:
+            del self._layouts[layout]
+
+    @staticmethod
+    def make_key(objective: str, tool_catalog_hash: str, model: str) -> str:
+        digest = hashlib.sha256()
+        for part in (
+            IntentCache.normalize_message(objective),
+            tool_catalog_hash,
+            model,
+        ):
+            digest.update(part.encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _find_adaptable(
+        self, words: tuple[str, ...], tool_catalog_hash: str, model: str
+    ) -> tuple[PlanCacheEntry, dict[str, str]] | None:
+        """The most recently used entry with the template of `words`, and its slot fillings."""
+        best = None
+        for length, slots in list(self._layouts):
+            if length != len(words) or not all(
+                _SLOT_PATTERN.fullmatch(words[position]) for position in slots
+            ):
+                continue
+            for key in self._templates.get(self.make_template(words, slots), ()):
+                entry = self._entries[key]
+                if (
+                    entry.tool_catalog_hash == tool_catalog_hash
+                    and entry.model == model
+                    and (best is None or entry.last_used > best.last_used)
+                ):
+                    best = entry
+        if best is None:
+            return None
+        return best, {
+            best.words[position]: words[position]
+            for position in best.slots
+            if best.words[position] != words[position]
+        }
+
+    def get(
+        self, objective: str, tool_catalog_hash: str, model: str
+    ) -> tuple[Plan, str, dict[str, str]] | None:
+        """
+        Returns (plan, cached objective, substitutions) for the same objective
+        or one that only differs in slot words, whose replacements in the
+        plan's tool inputs are listed in `substitutions`, or None.
+        """
+        now = time.time()
+        key = self.make_key(objective, tool_catalog_hash, model)
+        with self._lock:
+            best, substitutions = self._entries.get(key), {}
+            if best is None:
+                found = self._find_adaptable(
+                    self.make_words(objective), tool_catalog_hash, model
+                )
+                if found:
+                    best, substitutions = found
+
+            if best is not None and now - best.last_used > self.ttl_seconds:
+                self._remove_entry(best.key)
+                self._delete_rows([best.key])
+                best = None
+            if best is None:
+                self.misses += 1
+                return None
+
+            if best.key == key:
+                self.exact_hits += 1
+            else:
+                self.adapted_hits += 1
+            best.last_used = now
+            best.hits += 1
+            if self.connection:
+                with self.connection:
+                    self.connection.execute(
+                        "UPDATE plan_cache SET last_used = ?, hits = hits + 1 WHERE key = ?",
+                        (now, best.key),
+                    )
+            plan = self.fill_slots(best.plan, substitutions)
+            return plan, best.objective, substitutions
+
+    def put(self, objective: str, plan: Plan, tool_catalog_hash: str, model: str):
+        now = time.time()
+        key = self.make_key(objective, tool_catalog_hash, model)
+        entry = self._make_entry(
+            key,
+            objective,
+            tool_catalog_hash,
+            model,
+            plan.model_copy(deep=True),
+            now,
+            now,
+        )
+        with self._lock:
+            self._add_entry(entry)
+            evicted = []
+            if len(self._entries) > self.max_entries:
+                by_last_use = sorted(
+                    self._entries.values(), key=lambda cached: cached.last_used
+                )
+                for cached in by_last_use[: len(self._entries) - self.max_entries]:
+                    self._remove_entry(cached.key)
+                    evicted.append(cached.key)
+                self.evictions += len(evicted)
+
+            if self.connection:
+                with self.connection:
+                    self.connection.execute(
+                        """
+                        INSERT OR REPLACE INTO plan_cache
+                            (key, objective, tool_catalog_hash, model, plan, created_at, last_used, hits)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+                        """,
+                        (
+                            key,
+                            objective,
+                            tool_catalog_hash,
+                            model,
+                            plan.model_dump_json(),
+                            now,
+                            now,
+                        ),
+                    )
+                self._delete_rows(evicted)
+
+    def _delete_rows(self, keys: list[str]):
+        if not self.connection or not keys:
+            return
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM plan_cache WHERE key = ?", [(key,) for key in keys]
+            )
+
+    def is_enabled(self, conversation_id: int) -> bool:
+        return conversation_id not in self._opted_out
+
+    def set_enabled(self, conversation_id: int, enabled: bool):
+        """Opts a conversation in or out of plan reuse."""
+        with self._lock:
+            if enabled:
+                self._opted_out.discard(conversation_id)
+            else:
+                self._opted_out.add(conversation_id)
+            if self.connection:
+                with self.connection:
+                    if enabled:
+                        self.connection.execute(
+                            "DELETE FROM plan_cache_opt_out WHERE conversation_id = ?",
+                            (conversation_id,),
+                        )
+                    else:
+                        self.connection.execute(
+                            "INSERT OR IGNORE INTO plan_cache_opt_out VALUES (?)",
+                            (conversation_id,),
+                        )
+
+    def get_stats(self) -> dict:
+        lookups = self.exact_hits + self.adapted_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "adapted_hits": self.adapted_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (
+                (self.exact_hits + self.adapted_hits) / lookups if lookups else 0.0
+            ),
+        }
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
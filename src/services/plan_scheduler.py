@@ -0,0 +1,137 @@
+import asyncio
+import re
+from typing import Awaitable, Callable
+from models.plan import Plan, Step
+from logger import logger
+
+PLACEHOLDER_PATTERN = re.compile(r"\$step_(\d+)_output")
+# How a step accesses state shared between steps, such as the file system
+READ = "read"
+WRITE = "write"
+
+
+class PlanScheduler:
+    """
+    Runs the steps of a Plan as a dependency graph instead of one after another.
+    A step depends on every step whose output its tool_input references through
+    a `$step_N_output` placeholder. Steps may also rely on each other through
+    shared state without referencing any output, like a shell command reading
+    a file an earlier one wrote. `state_access(step)` tells whether a step
+    WRITEs that state (or cannot run concurrently with other such steps),
+    only READs it, or neither (None). In step_id order, a writing step depends
+    on the previous writing step and every reading step since, and a reading
+    step on the previous writing step; reading steps may overlap each other.
+    Steps run as soon as all of their
+    dependencies have finished, at most `max_workers` at a time, so the plan
+    takes as long as its critical path rather than the sum of its steps.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 4,
+        state_access: Callable[[Step], str | None] | None = None,
+    ):
+        self.max_workers = max_workers
+        self.state_access = state_access
+
+    def build_dependencies(self, plan: Plan) -> dict[int, set[int]]:
+        """
+        Returns the ids of the steps each step depends on. Raises ValueError if
+        step ids are not unique or the dependencies contain a cycle.
+        """
+        step_ids = [step.step_id for step in plan.steps]
+        if len(set(step_ids)) != len(step_ids):
+            raise ValueError(f"Duplicate step ids in plan: {step_ids}")
+
+        dependencies = {}
+        for step in plan.steps:
+            referenced = {
+                int(step_id)
+                for step_id in PLACEHOLDER_PATTERN.findall(step.tool_input or "")
+            }
+            unknown = referenced - set(step_ids)
+            if unknown:
+                logger.warning(
+                    f"Step {step.step_id} references unknown steps {sorted(unknown)}"
+                )
+            dependencies[step.step_id] = (referenced & set(step_ids)) - {step.step_id}
+
+        if self.state_access:
+            last_write, reads_since_write = None, []
+            for step in sorted(plan.steps, key=lambda step: step.step_id):
+                access = self.state_access(step)
+                if access is None:
+                    continue
+                if last_write is not None:
+                    dependencies[step.step_id].add(last_write)
+                if access == WRITE:
+                    dependencies[step.step_id].update(reads_since_write)
+                    last_write, reads_since_write = step.step_id, []
+                else:
+                    reads_since_write.append(step.step_id)
+
+        # Kahn's algorithm: every step must become ready at some point
+        remaining = {step_id: set(deps) for step_id, deps in dependencies.items()}
+        ready = [step_id for step_id, deps in remaining.items() if not deps]
+        resolved = 0
+        while ready:
+            finished = ready.pop()
+            resolved += 1
+            for step_id, deps in remaining.items():
+                if finished in deps:
+                    deps.discard(finished)
+                    if not deps:
+                        ready.append(step_id)
+        if resolved != len(step_ids):
+            raise ValueError("Plan steps have cyclic dependencies")
+
+        return dependencies
+
+    def critical_path_length(self, plan: Plan) -> int:
+        """Returns the number of steps on the longest dependency chain."""
+        dependencies = self.build_dependencies(plan)
+        depths: dict[int, int] = {}
+
+        def depth(step_id: int) -> int:
+            if step_id not in depths:
+                depths[step_id] = 1 + max(
+                    (depth(dep) for dep in dependencies[step_id]), default=0
+                )
+            return depths[step_id]
+
+        return max((depth(step_id) for step_id in dependencies), default=0)
+
+    async def run(
+        self,
+        plan: Plan,
+        run_step: Callable[[Step, dict[str, str]], Awaitable[str]],
+    ) -> dict[str, str]:
+        """
+        Runs every step with `run_step(step, outputs)`, where `outputs` maps
+        `step_N_output` keys to the outputs of the finished steps, and returns
+        those outputs. A step that raises is logged and every step depending on
+        it is skipped. Raises ValueError if the plan cannot be scheduled.
+        """
+        dependencies = self.build_dependencies(plan)
+        semaphore = asyncio.Semaphore(self.max_workers)
+        outputs: dict[str, str] = {}
+        tasks: dict[int, asyncio.Task] = {}
+
+        async def run_when_ready(step: Step) -> str:
+            for dependency in dependencies[step.step_id]:
+                # Re-raises the failure of a dependency, which skips this step
+                await tasks[dependency]
+            async with semaphore:
+                output = await run_step(step, outputs)
+            outputs[f"step_{step.step_id}_output"] = output
+            return output
+
+        for step in plan.steps:
+            tasks[step.step_id] = asyncio.create_task(run_when_ready(step))
+
+        results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+        for step_id, result in zip(tasks, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Step {step_id} did not complete: {result!r}")
+
+        return outputs
@@ -1,4 +1,7 @@
+import hashlib
 import json
+import threading
+import time
 from models.tools import ToolType
 from tools.base_tool import BaseTool
 from tools.calculator_tool import CalculatorTool
@@ -7,6 +10,8 @@ from tools.command_tool import CommandTool
 from tools.search_tool import SearchTool
 from typing import Optional, Tuple
 from logger import logger
+from metrics import TOOL_SECONDS, TOOL_EXECUTIONS
+from tracing import tracer
 
 
 class ToolManager:
@@ -18,12 +23,22 @@ class ToolManager:
             # ToolType.GOOGLE_SEARCH: SearchTool(),
         }
         self.pending_confirmations: dict[str, Tuple[ToolType, str]] = {}
+        # Tools that are not thread safe run one at a time when plan steps execute in parallel
+        self._tool_locks: dict[ToolType, threading.Lock] = {
+            tool_type: threading.Lock() for tool_type in self.tool_registry
+        }
+        self.build_tool_catalog()
         logger.info(
             "ToolManager initialized with tools: %s", list(self.tool_registry.keys())
         )
 
-    def get_tool_descriptions(self) -> str:
-        """Returns a JSON string describing all available tools."""
+    def build_tool_catalog(self):
+        """
+        Serializes the descriptions of all registered tools once. The catalog is
+        part of the static prompt prefix, so it must stay byte-identical between
+        requests; `tool_catalog_hash` versions it for caches that depend on it.
+        Call this again after changing the registry.
+        """
         descriptions = []
         for tool in self.tool_registry.values():
             descriptions.append(
@@ -33,7 +48,60 @@ class ToolManager:
                     "schema": tool.schema.model_json_schema(),
                 }
             )
-        return json.dumps(descriptions, indent=2)
+        self.tool_catalog = json.dumps(descriptions, indent=2)
+        self.tool_catalog_hash = hashlib.sha256(self.tool_catalog.encode()).hexdigest()[
+            :16
+        ]
+
+    def get_tool_descriptions(self) -> str:
+        """Returns a JSON string describing all available tools."""
+        return self.tool_catalog
+
+    def validate_tool_input(self, tool_type: ToolType, tool_input: str) -> bool:
+        """Checks that tool_input is a JSON string matching the tool's input schema."""
+        tool = self.tool_registry.get(tool_type)
+        if not tool:
+            return False
+        try:
+            tool.schema.model_validate_json(tool_input)
+            return True
+        except ValueError as e:
+            logger.warning(f"Invalid input for {tool_type}: {e}")
+            return False
+
+    def has_side_effects(
+        self, tool_type: ToolType, tool_input: str | None = None
+    ) -> bool:
+        """
+        Whether the tool can change state, such as files, that later steps may
+        rely on; given its `tool_input`, whether that run of it can.
+        """
+        tool = self.tool_registry.get(tool_type)
+        if tool is None:
+            return True
+        if tool_input is None:
+            return tool.has_side_effects()
+        try:
+            arguments = tool.schema.model_validate_json(tool_input).model_dump()
+        except ValueError:
+            return True
+        return tool.has_side_effects(**arguments)
+
+    def runs_in_order(self, tool_type: ToolType, tool_input: str | None = None) -> bool:
+        """Whether plan steps using this tool, or this input, must run one at a time in step order."""
+        tool = self.tool_registry.get(tool_type)
+        return (
+            tool is None
+            or not tool.is_thread_safe()
+            or self.has_side_effects(tool_type, tool_input)
+        )
+
+    @staticmethod
+    def is_error_output(tool_output: str) -> bool:
+        """Checks whether a tool output reports a failure rather than a result."""
+        return tool_output.startswith(
+            ("Error", "Command failed", "An unexpected error occurred")
+        )
 
     def execute_tool(
         self, tool_type: ToolType, tool_input: str, confirmed: bool = False
@@ -46,8 +114,40 @@ class ToolManager:
             raise ValueError(f"Tool '{tool_type}' not found in registry.")
 
         tool = self.tool_registry[tool_type]
-        # The tool_input is a JSON string which execute_with_confirmation will parse and validate
-        return tool.execute_with_confirmation(tool_input, confirmed)
+        start = time.perf_counter()
+        with tracer.span(
+            "tool.execute",
+            **{"tool.type": tool_type.value, "tool.input_bytes": len(tool_input or "")},
+        ) as span:
+            try:
+                # The tool_input is a JSON string which execute_with_confirmation will parse and validate
+                if tool.is_thread_safe():
+                    result, needs_confirmation = tool.execute_with_confirmation(
+                        tool_input, confirmed
+                    )
+                else:
+                    with self._tool_locks[tool_type]:
+                        result, needs_confirmation = tool.execute_with_confirmation(
+                            tool_input, confirmed
+                        )
+            except Exception:
+                TOOL_EXECUTIONS.labels(tool_type.value, "exception").inc()
+                raise
+            is_error = self.is_error_output(result or "")
+            span.set_attributes(
+                {
+                    "tool.output_bytes": len(result or ""),
+                    "tool.error": is_error,
+                    "tool.needs_confirmation": needs_confirmation,
+                }
+            )
+        if needs_confirmation:
+            outcome = "needs_confirmation"
+        else:
+            TOOL_SECONDS.labels(tool_type.value).observe(time.perf_counter() - start)
+            outcome = "error" if is_error else "ok"
+        TOOL_EXECUTIONS.labels(tool_type.value, outcome).inc()
+        return result, needs_confirmation
 
     def store_pending_confirmation(
         self, conversation_id: str, tool_type: ToolType, tool_input: str
@@ -0,0 +1,202 @@
+import argparse
+import os
+import sqlite3
+import threading
+from datetime import date
+from logger import logger
+
+
+class UsageLedger:
+    """
+    Token usage of every completion across all conversations, aggregated per
+    day, model and stage in an SQLite table, so usage can be reported without
+    loading any conversation. Completions are added up in memory and written
+    in one transaction every `flush_every` completions, on query and on close.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS usage (
+            day TEXT NOT NULL,
+            model TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            calls INTEGER NOT NULL DEFAULT 0,
+            input_tokens INTEGER NOT NULL DEFAULT 0,
+            output_tokens INTEGER NOT NULL DEFAULT 0,
+            cached_tokens INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, model, stage)
+        ) WITHOUT ROWID;
+    """
+    COLUMNS = ("day", "model", "stage")
+
+    def __init__(self, db_path: str, flush_every: int = 50):
+        self.db_path = db_path
+        self.flush_every = flush_every
+
+        # (day, model, stage) -> [calls, input, output, cached] not yet written
+        self._pending: dict[tuple[str, str, str], list[int]] = {}
+        self._pending_calls = 0
+        self._lock = threading.Lock()
+
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.SCHEMA)
+        self.connection.commit()
+
+    def record(
+        self,
+        model: str,
+        stage: str,
+        input_tokens: int,
+        output_tokens: int,
+        cached_tokens: int = 0,
+    ):
+        """Adds the usage of one completion to today's totals."""
+        key = (date.today().isoformat(), model, stage)
+        with self._lock:
+            totals = self._pending.setdefault(key, [0, 0, 0, 0])
+            totals[0] += 1
+            totals[1] += input_tokens
+            totals[2] += output_tokens
+            totals[3] += cached_tokens
+            self._pending_calls += 1
+            if self._pending_calls >= self.flush_every:
+                self._write_pending()
+
+    def _write_pending(self):
+        if not self._pending or self.connection is None:
+            return
+        try:
+            with self.connection:
+                self.connection.executemany(
+                    """
+                    INSERT INTO usage
+                        (day, model, stage, calls, input_tokens, output_tokens, cached_tokens)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (day, model, stage) DO UPDATE SET
+                        calls = calls + excluded.calls,
+                        input_tokens = input_tokens + excluded.input_tokens,
+                        output_tokens = output_tokens + excluded.output_tokens,
+                        cached_tokens = cached_tokens + excluded.cached_tokens
+                    """,
+                    [key + tuple(totals) for key, totals in self._pending.items()],
+                )
+        except sqlite3.Error as e:
+            # Kept pending and retried with the next write
+            logger.error(f"Could not write usage ledger: {e}")
+            return
+        self._pending.clear()
+        self._pending_calls = 0
+
+    def flush(self):
+        with self._lock:
+            self._write_pending()
+
+    def query(
+        self,
+        since: str | None = None,
+        until: str | None = None,
+        group_by: tuple[str, ...] = COLUMNS,
+    ) -> list[dict]:
+        """
+        Returns usage totals per combination of the `group_by` columns ("day",
+        "model", "stage"), for the days from `since` to `until` inclusive
+        (ISO dates), ordered by the grouping columns.
+        """
+        for column in group_by:
+            if column not in self.COLUMNS:
+                raise ValueError(f"Cannot group usage by {column!r}")
+        conditions, parameters = [], []
+        if since:
+            conditions.append("day >= ?")
+            parameters.append(since)
+        if until:
+            conditions.append("day <= ?")
+            parameters.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        columns = ", ".join(group_by)
+        select = f"{columns}, " if group_by else ""
+        group = f"GROUP BY {columns} ORDER BY {columns}" if group_by else ""
+
+        with self._lock:
+            self._write_pending()
+            rows = self.connection.execute(
+                f"""
+                SELECT {select}SUM(calls), SUM(input_tokens), SUM(output_tokens), SUM(cached_tokens)
+                FROM usage {where} {group}
+                """,
+                parameters,
+            ).fetchall()
+        count = len(group_by)
+        return [
+            {
+                **dict(zip(group_by, row)),
+                "calls": row[count] or 0,
+                "input_tokens": row[count + 1] or 0,
+                "output_tokens": row[count + 2] or 0,
+                "cached_tokens": row[count + 3] or 0,
+            }
+            for row in rows
+        ]
+
+    def close(self):
+        with self._lock:
+            self._write_pending()
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+def main():
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(
+        description="Report token usage by day, model and stage."
+    )
+    parser.add_argument(
+        "--db",
+        default=os.path.join(project_root, "conversations", "usage_ledger.db"),
+    )
+    parser.add_argument("--since", help="First day to include, as YYYY-MM-DD")
+    parser.add_argument("--until", help="Last day to include, as YYYY-MM-DD")
+    parser.add_argument(
+        "--by",
+        default="day,model,stage",
+        help="Comma-separated columns to group by: day, model, stage",
+    )
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"No usage recorded yet ({args.db} does not exist)")
+        return
+    group_by = tuple(column for column in args.by.split(",") if column)
+    ledger = UsageLedger(args.db)
+    try:
+        rows = ledger.query(args.since, args.until, group_by)
+    finally:
+        ledger.close()
+
+    widths = [
+        max([len(column)] + [len(str(row[column])) for row in rows])
+        for column in group_by
+    ]
+    header = [column.ljust(width) for column, width in zip(group_by, widths)]
+    print(
+        " ".join(header + [f"{'calls':>8} {'input':>12} {'output':>12} {'cached':>12}"])
+    )
+    for row in rows:
+        labels = [
+            str(row[column]).ljust(width) for column, width in zip(group_by, widths)
+        ]
+        print(
+            " ".join(
+                labels
+                + [
+                    f"{row['calls']:>8} {row['input_tokens']:>12} "
+                    f"{row['output_tokens']:>12} {row['cached_tokens']:>12}"
+                ]
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,8 @@ setup(
     entry_points={
         "console_scripts": [
             "ai-agent=services.cli_service:main",
+            "ai-agent-server=services.agent_server:main",
+            "ai-agent-usage=services.usage_ledger:main",
         ],
     },
     install_requires=requirements,
@@ -0,0 +1,52 @@
+from abc import ABC, abstractmethod
+from typing import Optional
+from models.chat import Conversation, ConversationSummary, MessageView
+
+
+class BaseConversationStore(ABC):
+    @abstractmethod
+    def read_conversation(self, conversation_id: int) -> Optional[Conversation]:
+        """Read a full conversation, or None if it does not exist."""
+        pass
+
+    @abstractmethod
+    def write_conversation(self, conversation: Conversation):
+        """Persist a conversation. Stores may only write what changed since the last write."""
+        pass
+
+    @abstractmethod
+    def delete_conversation(self, conversation_id: int) -> bool:
+        """Delete a conversation. Returns False if it did not exist."""
+        pass
+
+    @abstractmethod
+    def list_conversations(self) -> list[ConversationSummary]:
+        """List conversation metadata ordered by id, without loading messages."""
+        pass
+
+    @abstractmethod
+    def get_next_conversation_id(self) -> int:
+        pass
+
+    def read_recent_messages(self, conversation_id: int, n: int) -> list[MessageView]:
+        """
+        Override this method to read only the tail of the stored history.
+        The default implementation loads the full conversation.
+        """
+        conversation = self.read_conversation(conversation_id)
+        if conversation is None:
+            return []
+        return [
+            MessageView.from_message(message) for message in conversation.messages[-n:]
+        ]
+
+    def archive_conversations(self, max_age_seconds: float) -> int:
+        """
+        Override this method to move conversations that have not been written for
+        max_age_seconds into a cold tier. Returns the number of archived conversations.
+        """
+        return 0
+
+    def close(self):
+        """Override this method to release resources or finish background work"""
+        pass
@@ -0,0 +1,602 @@
+import os
+import re
+import gzip
+import json
+import mmap
+import time
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterator, Optional
+from models.chat import Conversation, ConversationSummary, MessageView
+from storage.base_store import BaseConversationStore
+from logger import logger
+from tracing import tracer
+
+
+class JsonConversationStore(BaseConversationStore):
+    # Archived conversations only keep their .meta.json header in the hot tier
+    CONVERSATION_FILE_PATTERN = re.compile(r"^conversation_(\d+)(?:\.meta)?\.json$")
+    ARCHIVE_COMPRESS_LEVEL = 9
+    # Share of a pack taken by dead members at which the pack is rewritten
+    ARCHIVE_GARBAGE_RATIO = 0.5
+
+    def __init__(
+        self,
+        conversation_dir: str,
+        append_log: bool = True,
+        compact_threshold: int = 200,
+    ):
+        """
+        Without `append_log`, conversation_N.json is rewritten on every write.
+        With `append_log`, new messages are appended to conversation_N.log (one
+        JSON record per line) and title/timestamps/totals are kept in a small
+        conversation_N.meta.json header. A background compactor folds the log
+        back into the snapshot once it holds more than `compact_threshold`
+        messages.
+
+        Snapshots are written with one message per line so that the tail of a
+        conversation can be read backwards without parsing the whole file.
+
+        archive_conversations() moves cold conversations into gzip members packed
+        per month under archive/. Their header stays in place with a pointer to
+        the member, so listing never decompresses anything and reads are
+        transparent. The next write brings a conversation back to the hot tier.
+
+        Deleting or rehydrating an archived conversation leaves a dead member in
+        its pack. Once dead members make up ARCHIVE_GARBAGE_RATIO of a pack, the
+        live ones are copied into a new pack and the old one is removed; every
+        archive pass also runs compact_archive() over all packs.
+        """
+        self.conversation_dir = conversation_dir
+        self.archive_dir = os.path.join(conversation_dir, "archive")
+        self.append_log = append_log
+        self.compact_threshold = compact_threshold
+        os.makedirs(self.conversation_dir, exist_ok=True)
+
+        # Number of messages already on disk (snapshot + log) per conversation
+        self._persisted_counts: dict[int, int] = {}
+        # Number of messages in the log that are not yet folded into the snapshot
+        self._log_counts: dict[int, int] = {}
+        self._max_id: int | None = None
+        # Archived conversations read since they were last written
+        self._rehydrating: set[int] = set()
+        self._io_lock = threading.Lock()
+
+        self._compaction_queue: set[int] = set()
+        self._compaction_event = threading.Event()
+        self._compactor_stopped = False
+        self._compactor_thread = None
+        if self.append_log:
+            self._compactor_thread = threading.Thread(
+                target=self._run_compactor, name="conversation-compactor", daemon=True
+            )
+            self._compactor_thread.start()
+
+    def _get_conversation_file_path(self, conversation_id: int) -> str:
+        return os.path.join(
+            self.conversation_dir, f"conversation_{conversation_id}.json"
+        )
+
+    def _get_log_file_path(self, conversation_id: int) -> str:
+        return os.path.join(
+            self.conversation_dir, f"conversation_{conversation_id}.log"
+        )
+
+    def _get_header_file_path(self, conversation_id: int) -> str:
+        return os.path.join(
+            self.conversation_dir, f"conversation_{conversation_id}.meta.json"
+        )
+
+    def _parse_conversation_id(self, filename: str) -> Optional[int]:
+        match = self.CONVERSATION_FILE_PATTERN.match(filename)
+        return int(match.group(1)) if match else None
+
+    def _list_conversation_ids(self) -> list[int]:
+        return sorted(
+            {
+                conversation_id
+                for conversation_id in map(
+                    self._parse_conversation_id, os.listdir(self.conversation_dir)
+                )
+                if conversation_id is not None
+            }
+        )
+
+    def _read_header(self, conversation_id: int) -> Optional[dict]:
+        header_path = self._get_header_file_path(conversation_id)
+        if not os.path.exists(header_path):
+            return None
+        with open(header_path, "r") as file:
+            return json.load(file)
+
+    def _exists(self, conversation_id: int) -> bool:
+        return os.path.exists(
+            self._get_conversation_file_path(conversation_id)
+        ) or os.path.exists(self._get_header_file_path(conversation_id))
+
+    def _read_archived_snapshot(self, archive: dict) -> bytes:
+        with open(os.path.join(self.archive_dir, archive["pack"]), "rb") as pack:
+            pack.seek(archive["offset"])
+            return gzip.decompress(pack.read(archive["length"]))
+
+    def _write_text_atomic(self, file_path: str, text: str):
+        """Write to a temp file and rename it over the target."""
+        temp_path = f"{file_path}.tmp"
+        with open(temp_path, "w") as file:
+            file.write(text)
+        os.replace(temp_path, file_path)
+
+    def _write_json_atomic(self, file_path: str, data: dict):
+        self._write_text_atomic(file_path, json.dumps(data))
+
+    def _format_snapshot(self, conversation: Conversation) -> str:
+        """
+        Formats a conversation as JSON with the metadata on the first line,
+        one message per line, and a closing "]}" line.
+        """
+        conversation_data = conversation.model_dump(mode="json")
+        messages = conversation_data.pop("messages")
+        head = json.dumps(conversation_data)[:-1] + ', "messages": ['
+        if not messages:
+            return f"{head}\n]}}\n"
+        body = ",\n".join(json.dumps(message) for message in messages)
+        return f"{head}\n{body}\n]}}\n"
+
+    def _iter_lines_reversed(self, file_path: str) -> Iterator[bytes]:
+        """Yields the non-empty lines of a file from last to first."""
+        with open(file_path, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                end = len(data)
+                while end > 0:
+                    newline = data.rfind(b"\n", 0, end)
+                    line = data[newline + 1 : end]
+                    if line.strip():
+                        yield line
+                    end = newline
+
+    def _serialize_header(self, conversation: Conversation) -> dict:
+        token_info = conversation.get_total_tokens()
+        return {
+            "id": conversation.id,
+            "title": conversation.title,
+            "created_at": conversation.created_at.isoformat(),
+            "updated_at": conversation.updated_at.isoformat(),
+            "message_count": len(conversation.messages),
+            "input_tokens": token_info["input_tokens"],
+            "output_tokens": token_info["output_tokens"],
+            "usage": conversation.usage.model_dump(mode="json"),
+        }
+
+    def _read_conversation(self, conversation_id: int) -> Conversation:
+        """Reads the snapshot, applies the header and replays the log tail."""
+        header = self._read_header(conversation_id)
+        file_path = self._get_conversation_file_path(conversation_id)
+        archived = not os.path.exists(file_path)
+        if archived:
+            if not header or "archive" not in header:
+                raise ValueError(f"Conversation {conversation_id} has no snapshot.")
+            conversation_data = json.loads(
+                self._read_archived_snapshot(header["archive"])
+            )
+        else:
+            with open(file_path, "r") as file:
+                conversation_data = json.load(file)
+
+        if header:
+            for key in ("title", "created_at", "updated_at", "usage"):
+                if key in header:
+                    conversation_data[key] = header[key]
+
+        messages = conversation_data["messages"]
+        snapshot_count = len(messages)
+        log_path = self._get_log_file_path(conversation_id)
+        if os.path.exists(log_path):
+            with open(log_path, "r") as file:
+                for line in file:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError as e:
+                        # A torn final line from an interrupted append
+                        logger.error(f"Skipping corrupt log record in {log_path}: {e}")
+                        continue
+                    # Records already folded into the snapshot are skipped so that
+                    # replaying after an interrupted compaction is idempotent
+                    if record.get("id", 0) >= len(messages):
+                        messages.append(record)
+
+        conversation = Conversation.model_validate(conversation_data)
+        if archived:
+            # Forces a full snapshot on the next write, which rehydrates it
+            self._persisted_counts.pop(conversation_id, None)
+            self._rehydrating.add(conversation_id)
+        else:
+            self._persisted_counts[conversation_id] = len(conversation.messages)
+        self._log_counts[conversation_id] = len(conversation.messages) - snapshot_count
+        return conversation
+
+    def read_conversation(self, conversation_id: int) -> Optional[Conversation]:
+        file_path = self._get_conversation_file_path(conversation_id)
+        if not self._exists(conversation_id):
+            logger.info(f"Conversation file {file_path} does not exist.")
+            return None
+        try:
+            with self._io_lock:
+                return self._read_conversation(conversation_id)
+        except (ValueError, json.JSONDecodeError) as e:
+            logger.error(f"Error loading conversation from {file_path}: {e}")
+            return None
+
+    def read_recent_messages(self, conversation_id: int, n: int) -> list[MessageView]:
+        if n <= 0 or not self._exists(conversation_id):
+            return []
+        try:
+            with self._io_lock:
+                records = self._read_tail_records(conversation_id, n)
+                if records is None:
+                    # Archived, or a pretty-printed snapshot from before the line format
+                    conversation = self._read_conversation(conversation_id)
+                    return [
+                        MessageView.from_message(message)
+                        for message in conversation.messages[-n:]
+                    ]
+        except (ValueError, json.JSONDecodeError) as e:
+            logger.error(
+                f"Error reading recent messages of conversation {conversation_id}: {e}"
+            )
+            return []
+        return [MessageView.from_record(record) for record in records]
+
+    def _read_tail_records(self, conversation_id: int, n: int) -> Optional[list[dict]]:
+        """
+        Reads the last n message records by scanning the log and then the
+        snapshot backwards. Returns None if the snapshot is archived or not
+        line-formatted.
+        """
+        records: dict[int, dict] = {}
+
+        log_path = self._get_log_file_path(conversation_id)
+        if os.path.exists(log_path):
+            for line in self._iter_lines_reversed(log_path):
+                if len(records) >= n:
+                    break
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                records.setdefault(record["id"], record)
+
+        if len(records) < n:
+            if not os.path.exists(self._get_conversation_file_path(conversation_id)):
+                return None
+            lines = self._iter_lines_reversed(
+                self._get_conversation_file_path(conversation_id)
+            )
+            if next(lines, b"").strip() != b"]}":
+                return None
+            for line in lines:
+                line = line.rstrip()
+                # The first line holds the metadata and ends with the opening bracket
+                if len(records) >= n or line.endswith(b"["):
+                    break
+                record = json.loads(line.rstrip(b","))
+                records.setdefault(record["id"], record)
+
+        return [records[message_id] for message_id in sorted(records)[-n:]]
+
+    def _read_summary(self, conversation_id: int) -> ConversationSummary:
+        header_path = self._get_header_file_path(conversation_id)
+        if os.path.exists(header_path):
+            with open(header_path, "r") as file:
+                return ConversationSummary.model_validate(json.load(file))
+
+        # Conversations written before headers existed: derive the header from
+        # the snapshot once and keep it for the next listing
+        with open(self._get_conversation_file_path(conversation_id), "r") as file:
+            conversation_data = json.load(file)
+        messages = conversation_data.get("messages", [])
+        header = {
+            "id": conversation_id,
+            "title": conversation_data["title"],
+            "created_at": conversation_data["created_at"],
+            "updated_at": conversation_data["updated_at"],
+            "message_count": len(messages),
+            "input_tokens": sum(m.get("input_tokens", 0) for m in messages),
+            "output_tokens": sum(m.get("output_tokens", 0) for m in messages),
+        }
+        if self.append_log and not os.path.exists(
+            self._get_log_file_path(conversation_id)
+        ):
+            self._write_json_atomic(header_path, header)
+        return ConversationSummary.model_validate(header)
+
+    def list_conversations(self) -> list[ConversationSummary]:
+        summaries = []
+        for conversation_id in self._list_conversation_ids():
+            try:
+                with self._io_lock:
+                    summaries.append(self._read_summary(conversation_id))
+            except (ValueError, KeyError, json.JSONDecodeError) as e:
+                logger.error(
+                    f"Error reading metadata of conversation {conversation_id}: {e}"
+                )
+        return summaries
+
+    def write_conversation(self, conversation: Conversation):
+        with self._io_lock:
+            persisted_count = self._persisted_counts.get(conversation.id)
+            if (
+                not self.append_log
+                or persisted_count is None
+                or persisted_count > len(conversation.messages)
+            ):
+                self._write_snapshot(conversation)
+            else:
+                self._append_messages(conversation, persisted_count)
+            if self._max_id is not None:
+                self._max_id = max(self._max_id, conversation.id)
+
+    def _write_snapshot(self, conversation: Conversation):
+        file_path = self._get_conversation_file_path(conversation.id)
+        snapshot = self._format_snapshot(conversation)
+        self._write_text_atomic(file_path, snapshot)
+        tracer.current_span().set_attribute("storage.bytes_written", len(snapshot))
+        header_path = self._get_header_file_path(conversation.id)
+        previous_header = None
+        if conversation.id in self._rehydrating:
+            self._rehydrating.discard(conversation.id)
+            previous_header = self._read_header(conversation.id)
+        # Also replaces the header of a conversation coming back from the archive
+        if self.append_log or os.path.exists(header_path):
+            self._write_json_atomic(header_path, self._serialize_header(conversation))
+        if self.append_log:
+            log_path = self._get_log_file_path(conversation.id)
+            if os.path.exists(log_path):
+                os.remove(log_path)
+        self._persisted_counts[conversation.id] = len(conversation.messages)
+        self._log_counts[conversation.id] = 0
+        logger.info(f"Conversation {conversation.id} saved to {file_path}.")
+
+        if previous_header and "archive" in previous_header:
+            # Its archived member is dead now that the header no longer points to it
+            self._collect_pack_safely(previous_header["archive"]["pack"])
+
+    def _append_messages(self, conversation: Conversation, persisted_count: int):
+        new_messages = conversation.messages[persisted_count:]
+        if new_messages:
+            log_path = self._get_log_file_path(conversation.id)
+            records = "".join(
+                json.dumps(message.model_dump(mode="json")) + "\n"
+                for message in new_messages
+            )
+            with open(log_path, "a") as file:
+                file.write(records)
+            tracer.current_span().set_attribute("storage.bytes_written", len(records))
+
+        self._write_json_atomic(
+            self._get_header_file_path(conversation.id),
+            self._serialize_header(conversation),
+        )
+        self._persisted_counts[conversation.id] = len(conversation.messages)
+        log_count = self._log_counts.get(conversation.id, 0) + len(new_messages)
+        self._log_counts[conversation.id] = log_count
+        logger.info(
+            f"Conversation {conversation.id}: appended {len(new_messages)} message(s) to log."
+        )
+
+        if log_count > self.compact_threshold:
+            self._compaction_queue.add(conversation.id)
+            self._compaction_event.set()
+
+    def _run_compactor(self):
+        while not self._compactor_stopped:
+            self._compaction_event.wait()
+            self._compaction_event.clear()
+            while self._compaction_queue:
+                conversation_id = self._compaction_queue.pop()
+                self.compact_conversation(conversation_id)
+
+    def compact_conversation(self, conversation_id: int):
+        """Folds the message log of a conversation back into its snapshot."""
+        try:
+            with self._io_lock:
+                if not os.path.exists(self._get_log_file_path(conversation_id)):
+                    return
+                conversation = self._read_conversation(conversation_id)
+                self._write_snapshot(conversation)
+                logger.info(f"Compacted log of conversation {conversation_id}.")
+        except (IOError, ValueError, json.JSONDecodeError) as e:
+            logger.error(f"Error compacting conversation {conversation_id}: {e}")
+
+    def archive_conversations(self, max_age_seconds: float) -> int:
+        cutoff = time.time() - max_age_seconds
+        archived = 0
+        for conversation_id in self._list_conversation_ids():
+            try:
+                with self._io_lock:
+                    if self._archive_conversation(conversation_id, cutoff):
+                        archived += 1
+            except (IOError, ValueError, json.JSONDecodeError) as e:
+                logger.error(f"Error archiving conversation {conversation_id}: {e}")
+        if archived:
+            logger.info(f"Archived {archived} conversations to {self.archive_dir}.")
+        self.compact_archive()
+        return archived
+
+    def _archive_conversation(self, conversation_id: int, cutoff: float) -> bool:
+        file_path = self._get_conversation_file_path(conversation_id)
+        if not os.path.exists(file_path):
+            return False
+        last_modified = max(
+            os.path.getmtime(path)
+            for path in (
+                file_path,
+                self._get_log_file_path(conversation_id),
+                self._get_header_file_path(conversation_id),
+            )
+            if os.path.exists(path)
+        )
+        if last_modified >= cutoff:
+            return False
+
+        # Reading folds any log tail into the archived snapshot
+        conversation = self._read_conversation(conversation_id)
+        data = gzip.compress(
+            self._format_snapshot(conversation).encode(),
+            compresslevel=self.ARCHIVE_COMPRESS_LEVEL,
+        )
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        month = datetime.fromtimestamp(last_modified).strftime("%Y-%m")
+        pack_name = f"conversations-{month}.pack"
+        with open(os.path.join(self.archive_dir, pack_name), "ab") as pack:
+            pack.seek(0, os.SEEK_END)
+            offset = pack.tell()
+            pack.write(data)
+            pack.flush()
+            os.fsync(pack.fileno())
+
+        header = self._serialize_header(conversation)
+        header["archive"] = {"pack": pack_name, "offset": offset, "length": len(data)}
+        self._write_json_atomic(self._get_header_file_path(conversation_id), header)
+        os.remove(file_path)
+        log_path = self._get_log_file_path(conversation_id)
+        if os.path.exists(log_path):
+            os.remove(log_path)
+        self._persisted_counts.pop(conversation_id, None)
+        self._log_counts.pop(conversation_id, None)
+        return True
+
+    def _archived_members(self) -> dict[str, list[tuple[int, dict]]]:
+        """Headers of the archived conversations by the pack holding their member."""
+        members = defaultdict(list)
+        for conversation_id in self._list_conversation_ids():
+            header = self._read_header(conversation_id)
+            if header and "archive" in header:
+                members[header["archive"]["pack"]].append((conversation_id, header))
+        return members
+
+    def _collect_pack(
+        self,
+        pack_name: str,
+        members: list[tuple[int, dict]] | None = None,
+        min_garbage_ratio: float | None = None,
+    ) -> int:
+        """
+        Removes a pack without live members, or copies the live members of a
+        pack that is at least `min_garbage_ratio` garbage into a new pack.
+        Headers are repointed only once the new pack is on disk, so a crash
+        leaves at most an unreferenced pack behind. Returns the bytes reclaimed.
+        """
+        pack_path = os.path.join(self.archive_dir, pack_name)
+        if not os.path.exists(pack_path):
+            return 0
+        if members is None:
+            members = self._archived_members().get(pack_name, [])
+        if min_garbage_ratio is None:
+            min_garbage_ratio = self.ARCHIVE_GARBAGE_RATIO
+
+        pack_size = os.path.getsize(pack_path)
+        live_size = sum(header["archive"]["length"] for _, header in members)
+        garbage = pack_size - live_size
+        if members and (garbage <= 0 or garbage < pack_size * min_garbage_ratio):
+            return 0
+
+        if members:
+            new_name = f"{pack_name.split('.')[0]}.{time.time_ns()}.pack"
+            new_pointers = []
+            with open(pack_path, "rb") as source, open(
+                os.path.join(self.archive_dir, new_name), "wb"
+            ) as target:
+                for _, header in sorted(
+                    members, key=lambda member: member[1]["archive"]["offset"]
+                ):
+                    archive = header["archive"]
+                    source.seek(archive["offset"])
+                    new_pointers.append((header, target.tell()))
+                    target.write(source.read(archive["length"]))
+                target.flush()
+                os.fsync(target.fileno())
+            for header, offset in new_pointers:
+                header["archive"] = dict(
+                    header["archive"], pack=new_name, offset=offset
+                )
+            for conversation_id, header in members:
+                self._write_json_atomic(
+                    self._get_header_file_path(conversation_id), header
+                )
+        os.remove(pack_path)
+        logger.info(
+            f"Reclaimed {garbage} bytes from {pack_name} ({len(members)} live members)."
+        )
+        return garbage
+
+    def _collect_pack_safely(self, pack_name: str):
+        # The write or delete itself already succeeded
+        try:
+            self._collect_pack(pack_name)
+        except (IOError, ValueError, json.JSONDecodeError) as e:
+            logger.error(f"Error compacting {pack_name}: {e}")
+
+    def compact_archive(self, min_garbage_ratio: float | None = None) -> int:
+        """
+        Collects every pack in archive/ (see _collect_pack), e.g. with
+        min_garbage_ratio=0 to drop all dead members. Returns the bytes reclaimed.
+        """
+        if not os.path.isdir(self.archive_dir):
+            return 0
+        reclaimed = 0
+        try:
+            with self._io_lock:
+                members = self._archived_members()
+                for pack_name in sorted(os.listdir(self.archive_dir)):
+                    if pack_name.endswith(".pack"):
+                        reclaimed += self._collect_pack(
+                            pack_name, members.get(pack_name, []), min_garbage_ratio
+                        )
+        except (IOError, ValueError, json.JSONDecodeError) as e:
+            logger.error(f"Error compacting archive {self.archive_dir}: {e}")
+        return reclaimed
+
+    def delete_conversation(self, conversation_id: int) -> bool:
+        if not self._exists(conversation_id):
+            logger.info(f"Conversation {conversation_id} does not exist.")
+            return False
+
+        with self._io_lock:
+            header = self._read_header(conversation_id)
+            for path in (
+                self._get_conversation_file_path(conversation_id),
+                self._get_log_file_path(conversation_id),
+                self._get_header_file_path(conversation_id),
+            ):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._persisted_counts.pop(conversation_id, None)
+            self._log_counts.pop(conversation_id, None)
+            self._rehydrating.discard(conversation_id)
+            if header and "archive" in header:
+                self._collect_pack_safely(header["archive"]["pack"])
+        return True
+
+    def get_next_conversation_id(self) -> int:
+        # The directory is only scanned once; writes keep the maximum up to date
+        if self._max_id is None:
+            existing_ids = self._list_conversation_ids()
+            self._max_id = existing_ids[-1] if existing_ids else 0
+        return self._max_id + 1
+
+    def close(self):
+        """Stops the background compactor and folds any remaining logs."""
+        if self._compactor_thread:
+            self._compactor_stopped = True
+            self._compaction_event.set()
+            self._compactor_thread.join()
+            self._compactor_thread = None
+        for conversation_id in list(self._compaction_queue):
+            self.compact_conversation(conversation_id)
+        self._compaction_queue.clear()
@@ -0,0 +1,56 @@
+import argparse
+import os
+from storage.json_store import JsonConversationStore
+from storage.sqlite_store import SqliteConversationStore
+from logger import logger
+
+
+def migrate_json_to_sqlite(conversation_dir: str, db_path: str) -> int:
+    """
+    Copies every conversation from a JSON conversation directory into a SQLite store.
+    Conversations that already exist in the database are overwritten.
+    Returns the number of migrated conversations.
+    """
+    source = JsonConversationStore(conversation_dir, append_log=False)
+    target = SqliteConversationStore(db_path)
+    migrated = 0
+    try:
+        for conversation_id in source._list_conversation_ids():
+            conversation = source.read_conversation(conversation_id)
+            if conversation is None:
+                continue
+            target.write_conversation(conversation)
+            migrated += 1
+    finally:
+        source.close()
+        target.close()
+
+    logger.info(
+        f"Migrated {migrated} conversations from {conversation_dir} to {db_path}."
+    )
+    return migrated
+
+
+def main():
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    default_dir = os.path.join(project_root, "conversations")
+
+    parser = argparse.ArgumentParser(
+        description="Migrate JSON conversations into a SQLite conversation store."
+    )
+    parser.add_argument(
+        "--source", default=default_dir, help="JSON conversation directory"
+    )
+    parser.add_argument(
+        "--target",
+        default=os.path.join(default_dir, "conversations.db"),
+        help="SQLite database path",
+    )
+    args = parser.parse_args()
+
+    migrated = migrate_json_to_sqlite(args.source, args.target)
+    print(f"Migrated {migrated} conversations to {args.target}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import argparse
+import os
+import sqlite3
+import threading
+from models.chat import ChatRole, Conversation, SearchHit
+from storage.base_store import BaseConversationStore
+from logger import logger
+
+
+class SearchIndex:
+    """
+    Incrementally maintained SQLite FTS5 index over message content. It lives in
+    its own database so it works with every conversation store.
+    """
+
+    # rowid = (conversation_id << MESSAGE_ID_BITS) | message_id, so a conversation
+    # occupies one contiguous rowid range and can be removed without a table scan
+    MESSAGE_ID_BITS = 24
+    SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(
+            content,
+            role UNINDEXED,
+            tokenize = 'porter unicode61'
+        );
+        CREATE TABLE IF NOT EXISTS indexed_conversations (
+            conversation_id INTEGER PRIMARY KEY,
+            message_count INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.SCHEMA)
+        self.connection.commit()
+        self._lock = threading.Lock()
+
+    def index_conversation(self, conversation: Conversation):
+        """Indexes the messages that were added since the last call."""
+        with self._lock, self.connection:
+            row = self.connection.execute(
+                "SELECT message_count FROM indexed_conversations WHERE conversation_id = ?",
+                (conversation.id,),
+            ).fetchone()
+            indexed_count = row[0] if row else 0
+            if indexed_count > len(conversation.messages):
+                self._remove(conversation.id)
+                indexed_count = 0
+
+            self.connection.executemany(
+                "INSERT INTO message_fts (rowid, content, role) VALUES (?, ?, ?)",
+                [
+                    (
+                        self._get_rowid(conversation.id, message.id),
+                        str(message.content),
+                        message.role.value,
+                    )
+                    for message in conversation.messages[indexed_count:]
+                    # The system prompt is the same in every conversation
+                    if message.role != ChatRole.SYSTEM
+                ],
+            )
+            self.connection.execute(
+                """
+                INSERT INTO indexed_conversations (conversation_id, message_count) VALUES (?, ?)
+                ON CONFLICT (conversation_id) DO UPDATE SET message_count = excluded.message_count
+                """,
+                (conversation.id, len(conversation.messages)),
+            )
+
+    def _get_rowid(self, conversation_id: int, message_id: int) -> int:
+        return (conversation_id << self.MESSAGE_ID_BITS) | message_id
+
+    def _remove(self, conversation_id: int):
+        self.connection.execute(
+            "DELETE FROM message_fts WHERE rowid BETWEEN ? AND ?",
+            (
+                self._get_rowid(conversation_id, 0),
+                self._get_rowid(conversation_id + 1, 0) - 1,
+            ),
+        )
+        self.connection.execute(
+            "DELETE FROM indexed_conversations WHERE conversation_id = ?",
+            (conversation_id,),
+        )
+
+    def remove_conversation(self, conversation_id: int):
+        with self._lock, self.connection:
+            self._remove(conversation_id)
+
+    def _build_match_query(self, query: str) -> str:
+        # Quote every term so user input can never be parsed as FTS5 syntax
+        return " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+
+    def search(self, query: str, limit: int = 20) -> list[SearchHit]:
+        """Returns the best matching messages, most relevant first."""
+        match_query = self._build_match_query(query)
+        if not match_query:
+            return []
+        with self._lock:
+            rows = self.connection.execute(
+                """
+                SELECT rowid, role,
+                       snippet(message_fts, 0, '[', ']', '...', 12), bm25(message_fts)
+                FROM message_fts WHERE message_fts MATCH ?
+                ORDER BY rank LIMIT ?
+                """,
+                (match_query, limit),
+            ).fetchall()
+        return [
+            SearchHit(
+                conversation_id=row[0] >> self.MESSAGE_ID_BITS,
+                message_id=row[0] & ((1 << self.MESSAGE_ID_BITS) - 1),
+                role=row[1],
+                snippet=row[2],
+                # bm25() is lower for better matches
+                score=-row[3],
+            )
+            for row in rows
+        ]
+
+    def rebuild(self, store: BaseConversationStore) -> int:
+        """Drops the index and re-indexes every conversation in the store."""
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM message_fts")
+            self.connection.execute("DELETE FROM indexed_conversations")
+        indexed = 0
+        for summary in store.list_conversations():
+            conversation = store.read_conversation(summary.id)
+            if conversation is not None:
+                self.index_conversation(conversation)
+                indexed += 1
+        logger.info(f"Rebuilt search index with {indexed} conversations.")
+        return indexed
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+
+def main():
+    from storage.json_store import JsonConversationStore
+    from storage.sqlite_store import SqliteConversationStore
+
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    conversation_dir = os.path.join(project_root, "conversations")
+
+    parser = argparse.ArgumentParser(
+        description="Search or rebuild the conversation search index."
+    )
+    parser.add_argument("query", nargs="?", help="Search query")
+    parser.add_argument(
+        "--rebuild", action="store_true", help="Re-index all conversations"
+    )
+    parser.add_argument(
+        "--sqlite", action="store_true", help="Rebuild from the SQLite store"
+    )
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    index = SearchIndex(os.path.join(conversation_dir, "search.db"))
+    try:
+        if args.rebuild:
+            if args.sqlite:
+                store = SqliteConversationStore(
+                    os.path.join(conversation_dir, "conversations.db")
+                )
+            else:
+                store = JsonConversationStore(conversation_dir, append_log=False)
+            print(f"Indexed {index.rebuild(store)} conversations")
+            store.close()
+        if args.query:
+            for hit in index.search(args.query, limit=args.limit):
+                print(
+                    f"{hit.conversation_id:>6} #{hit.message_id:<5} {hit.role.value:<9} {hit.snippet}"
+                )
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import json
+import sqlite3
+import threading
+from typing import Optional
+from models.chat import (
+    Conversation,
+    ConversationSummary,
+    ConversationUsage,
+    Message,
+    MessageView,
+)
+from storage.base_store import BaseConversationStore
+from logger import logger
+from tracing import tracer
+
+
+class SqliteConversationStore(BaseConversationStore):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS conversations (
+            id INTEGER PRIMARY KEY,
+            title TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            input_tokens INTEGER NOT NULL DEFAULT 0,
+            output_tokens INTEGER NOT NULL DEFAULT 0,
+            usage TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_conversations_updated_at
+            ON conversations (updated_at);
+        CREATE INDEX IF NOT EXISTS idx_conversations_title
+            ON conversations (title);
+        CREATE TABLE IF NOT EXISTS messages (
+            conversation_id INTEGER NOT NULL
+                REFERENCES conversations (id) ON DELETE CASCADE,
+            id INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            type TEXT,
+            created_at TEXT NOT NULL,
+            input_tokens INTEGER NOT NULL DEFAULT 0,
+            output_tokens INTEGER NOT NULL DEFAULT 0,
+            data TEXT NOT NULL,
+            PRIMARY KEY (conversation_id, id)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(self.SCHEMA)
+        self._add_missing_columns()
+        self.connection.commit()
+
+        # Number of messages already stored per conversation
+        self._persisted_counts: dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def _add_missing_columns(self):
+        """Adds columns introduced after a database was created."""
+        columns = {
+            row[1]
+            for row in self.connection.execute("PRAGMA table_info(conversations)")
+        }
+        if "usage" not in columns:
+            self.connection.execute("ALTER TABLE conversations ADD COLUMN usage TEXT")
+
+    def read_conversation(self, conversation_id: int) -> Optional[Conversation]:
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT id, title, created_at, updated_at, usage FROM conversations WHERE id = ?",
+                (conversation_id,),
+            ).fetchone()
+            if row is None:
+                logger.info(f"Conversation {conversation_id} does not exist.")
+                return None
+            message_rows = self.connection.execute(
+                "SELECT data FROM messages WHERE conversation_id = ? ORDER BY id",
+                (conversation_id,),
+            ).fetchall()
+
+        try:
+            conversation = Conversation(
+                id=row[0],
+                title=row[1],
+                created_at=row[2],
+                updated_at=row[3],
+                messages=[
+                    Message.model_validate_json(data) for (data,) in message_rows
+                ],
+            )
+            # Databases from before the running totals get them on the first write
+            if row[4]:
+                conversation.usage = ConversationUsage.model_validate_json(row[4])
+        except ValueError as e:
+            logger.error(f"Error loading conversation {conversation_id}: {e}")
+            return None
+
+        self._persisted_counts[conversation_id] = len(conversation.messages)
+        return conversation
+
+    def read_recent_messages(self, conversation_id: int, n: int) -> list[MessageView]:
+        if n <= 0:
+            return []
+        with self._lock:
+            rows = self.connection.execute(
+                """
+                SELECT data FROM messages WHERE conversation_id = ?
+                ORDER BY id DESC LIMIT ?
+                """,
+                (conversation_id, n),
+            ).fetchall()
+        return [MessageView.from_record(json.loads(data)) for (data,) in reversed(rows)]
+
+    def write_conversation(self, conversation: Conversation):
+        with self._lock:
+            persisted_count = self._persisted_counts.get(conversation.id)
+            token_info = conversation.get_total_tokens()
+            with self.connection:
+                if persisted_count is None or persisted_count > len(
+                    conversation.messages
+                ):
+                    # Unknown or shrunk conversation: replace all of its messages
+                    self.connection.execute(
+                        "DELETE FROM messages WHERE conversation_id = ?",
+                        (conversation.id,),
+                    )
+                    persisted_count = 0
+                self.connection.execute(
+                    """
+                    INSERT INTO conversations
+                        (id, title, created_at, updated_at, message_count, input_tokens, output_tokens, usage)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (id) DO UPDATE SET
+                        title = excluded.title,
+                        updated_at = excluded.updated_at,
+                        message_count = excluded.message_count,
+                        input_tokens = excluded.input_tokens,
+                        output_tokens = excluded.output_tokens,
+                        usage = excluded.usage
+                    """,
+                    (
+                        conversation.id,
+                        conversation.title,
+                        conversation.created_at.isoformat(),
+                        conversation.updated_at.isoformat(),
+                        len(conversation.messages),
+                        token_info["input_tokens"],
+                        token_info["output_tokens"],
+                        conversation.usage.model_dump_json(),
+                    ),
+                )
+                rows = [
+                    (
+                        conversation.id,
+                        message.id,
+                        message.role.value,
+                        message.type.value if message.type else None,
+                        message.created_at.isoformat(),
+                        message.input_tokens,
+                        message.output_tokens,
+                        message.model_dump_json(),
+                    )
+                    for message in conversation.messages[persisted_count:]
+                ]
+                self.connection.executemany(
+                    """
+                    INSERT OR REPLACE INTO messages
+                        (conversation_id, id, role, type, created_at, input_tokens, output_tokens, data)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    rows,
+                )
+                tracer.current_span().set_attribute(
+                    "storage.bytes_written", sum(len(row[-1]) for row in rows)
+                )
+            self._persisted_counts[conversation.id] = len(conversation.messages)
+        logger.info(f"Conversation {conversation.id} saved to {self.db_path}.")
+
+    def delete_conversation(self, conversation_id: int) -> bool:
+        with self._lock, self.connection:
+            cursor = self.connection.execute(
+                "DELETE FROM conversations WHERE id = ?", (conversation_id,)
+            )
+            self._persisted_counts.pop(conversation_id, None)
+        return cursor.rowcount > 0
+
+    def list_conversations(self) -> list[ConversationSummary]:
+        with self._lock:
+            rows = self.connection.execute("""
+                SELECT id, title, created_at, updated_at, message_count, input_tokens, output_tokens
+                FROM conversations ORDER BY id
+                """).fetchall()
+        return [
+            ConversationSummary(
+                id=row[0],
+                title=row[1],
+                created_at=row[2],
+                updated_at=row[3],
+                message_count=row[4],
+                input_tokens=row[5],
+                output_tokens=row[6],
+            )
+            for row in rows
+        ]
+
+    def get_next_conversation_id(self) -> int:
+        with self._lock:
+            (max_id,) = self.connection.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM conversations"
+            ).fetchone()
+        return max_id + 1
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
@@ -30,6 +30,14 @@ class BaseTool(ABC):
         """Override this method to indicate if the tool requires user confirmation"""
         return False
 
+    def is_thread_safe(self) -> bool:
+        """Override this method to indicate if several runs of the tool may execute concurrently"""
+        return False
+
+    def has_side_effects(self, **kwargs) -> bool:
+        """Override this method to indicate if the tool can change state that later runs may depend on; with the arguments of a run, if that run can"""
+        return False
+
     def preview(self, **kwargs) -> str:
         """Override this method to provide a preview of what the tool will do"""
         params_str = self.create_params_string(kwargs)
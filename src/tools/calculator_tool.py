@@ -1,6 +1,7 @@
 from asteval import Interpreter
 from tools.base_tool import BaseTool
 import math
+import threading
 from logger import logger
 from pydantic import BaseModel, Field
 from typing import Type
@@ -14,8 +15,19 @@ class CalculatorTool(BaseTool):
     schema: Type[BaseModel] = CalculatorInput
 
     def __init__(self):
-        self.aeval = Interpreter()
-        self.aeval.symtable["math"] = math
+        # An Interpreter keeps its symbol table and errors between calls, so each thread gets its own
+        self._local = threading.local()
+
+    @property
+    def aeval(self) -> Interpreter:
+        aeval = getattr(self._local, "aeval", None)
+        if aeval is None:
+            aeval = self._local.aeval = Interpreter()
+            aeval.symtable["math"] = math
+        return aeval
+
+    def is_thread_safe(self) -> bool:
+        return True
 
     def run(self, **kwargs) -> str:
         expression = kwargs.get("expression")
@@ -26,12 +38,13 @@ class CalculatorTool(BaseTool):
     def calculate(self, expression: str) -> str:
         logger.info(f"Calculating expression: {expression}")
 
-        result = self.aeval(expression)
-        if self.aeval.error:
-            error_message = f"Error calculating expression: {self.aeval.error}"
+        aeval = self.aeval
+        result = aeval(expression)
+        if aeval.error:
+            error_message = f"Error calculating expression: {aeval.error}"
             logger.error(error_message)
             # Extract the actual error message from the asteval error object
-            detailed_error = self.aeval.error[0].get_error()
+            detailed_error = aeval.error[0].get_error()
             return f"Error: {detailed_error}"
 
         logger.info(f"Result: {result}")
@@ -17,6 +17,9 @@ class CodeTool(BaseTool):
     def requires_confirmation(self) -> bool:
         return True
 
+    def has_side_effects(self, **kwargs) -> bool:
+        return True
+
     def preview(self, **kwargs) -> str:
         code = kwargs.get("code", "")
         clean_code = self.extract_code_blocks(code)
@@ -1,5 +1,6 @@
 from tools.base_tool import BaseTool
 from logger import logger
+import shlex
 import subprocess
 from pydantic import BaseModel, Field
 from typing import Type
@@ -12,9 +13,81 @@ class CommandTool(BaseTool):
     description = "Executes a shell command on the user's system. Use with extreme caution."
     schema: Type[BaseModel] = CommandInput
 
+    # Programs that only read, and the options that would make them write or run other programs
+    READ_ONLY_PROGRAMS = {
+        "basename": set(), "cat": set(), "cmp": set(), "cut": set(), "df": set(),
+        "diff": set(), "dirname": set(), "du": set(), "echo": set(), "grep": set(),
+        "head": set(), "id": set(), "ls": set(), "md5sum": set(), "nl": set(),
+        "printenv": set(), "pwd": set(), "readlink": set(), "realpath": set(),
+        "sha256sum": set(), "stat": set(), "tail": set(), "tr": set(), "uname": set(),
+        "wc": set(), "which": set(), "whoami": set(),
+        "date": {"-s", "--set"},
+        "file": {"-C", "--compile"},
+        "find": {"-delete", "-exec", "-execdir", "-ok", "-okdir", "-fprint", "-fprint0", "-fprintf", "-fls"},
+        "sort": {"-o", "--output"},
+        "git": {"--output"},
+    }
+    # Only these git subcommands are allowed, without the options above
+    READ_ONLY_GIT_COMMANDS = {"diff", "log", "show", "status"}
+    COMMAND_SEPARATORS = {"|", "||", "&&", ";"}
+
     def requires_confirmation(self) -> bool:
         return True
 
+    def has_side_effects(self, **kwargs) -> bool:
+        command = kwargs.get("command")
+        return command is None or not self.is_read_only(command)
+
+    @classmethod
+    def is_read_only(cls, command: str) -> bool:
+        """
+        Whether the command only runs known read-only programs, joined by pipes
+        or command separators, without output redirection, expansions or
+        placeholders whose value is not known before the plan runs.
+        """
+        if any(character in command for character in "$`\n"):
+            return False
+        try:
+            lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+            lexer.whitespace_split = True
+            tokens = list(lexer)
+        except ValueError:
+            return False
+
+        simple_commands = [[]]
+        for token in tokens:
+            if token in cls.COMMAND_SEPARATORS:
+                simple_commands.append([])
+            else:
+                simple_commands[-1].append(token)
+        for arguments in simple_commands:
+            if not arguments:
+                return False
+            program, options = arguments[0], arguments[1:]
+            if program not in cls.READ_ONLY_PROGRAMS:
+                return False
+            if program == "git" and (not options or options[0] not in cls.READ_ONLY_GIT_COMMANDS):
+                return False
+            forbidden = cls.READ_ONLY_PROGRAMS[program]
+            if any(cls._is_forbidden_option(option, forbidden) for option in options):
+                return False
+            if any(set(option) & set("<>();&|") for option in options):
+                return False
+        return True
+
+    @staticmethod
+    def _is_forbidden_option(option: str, forbidden: set[str]) -> bool:
+        if option.split("=")[0] in forbidden:
+            return True
+        # Single-letter options may be combined, as in "sort -ro out"
+        if option.startswith("-") and not option.startswith("--"):
+            letters = {f"-{letter}" for letter in option[1:]}
+            return bool(letters & {flag for flag in forbidden if len(flag) == 2})
+        return False
+
+    def is_thread_safe(self) -> bool:
+        return True
+
     def preview(self, **kwargs) -> str:
         command = kwargs.get("command", "").strip()
         return f"!!  COMMAND PREVIEW !!\nAbout to execute shell command:\n'{command}'\n\nThis will run on your system. Do you want to proceed? (y/n)"
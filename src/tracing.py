@@ -0,0 +1,228 @@
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+
+SERVICE_NAME = "agent-sandbox"
+
+
+class Span:
+    """A timed operation with attributes; children are nested through the context."""
+
+    def __init__(
+        self, name: str, trace_id: str, parent_id: str | None, attributes: dict
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: dict):
+        self.attributes.update(attributes)
+
+    def record_error(self, error: BaseException):
+        self.error = f"{type(error).__name__}: {error}"
+
+    def to_otlp(self) -> dict:
+        """The span in the OTLP/JSON encoding of OpenTelemetry."""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)}
+                for key, value in self.attributes.items()
+                if value is not None
+            ],
+            # STATUS_CODE_ERROR, or unset
+            "status": {"code": 2, "message": self.error} if self.error else {},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class _NoopSpan:
+    """Stands in for spans while tracing is disabled or the trace is not sampled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+    def set_attribute(self, key: str, value):
+        pass
+
+    def set_attributes(self, attributes: dict):
+        pass
+
+    def record_error(self, error: BaseException):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+# The innermost open span of the current task or thread; _NOOP_SPAN inside an unsampled trace
+_current_span: contextvars.ContextVar[Span | _NoopSpan | None] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+class _SpanScope:
+    def __init__(self, tracer: "Tracer", span: Span):
+        self.tracer = tracer
+        self.span = span
+        self.token = None
+
+    def __enter__(self) -> Span:
+        self.token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.span.end_ns = time.time_ns()
+        if exc is not None:
+            self.span.record_error(exc)
+        _current_span.reset(self.token)
+        self.tracer._export(self.span)
+        return False
+
+
+class _UnsampledScope:
+    """Marks the context as inside an unsampled trace, so child spans are skipped too."""
+
+    def __init__(self):
+        self.token = None
+
+    def __enter__(self) -> _NoopSpan:
+        self.token = _current_span.set(_NOOP_SPAN)
+        return _NOOP_SPAN
+
+    def __exit__(self, exc_type, exc, traceback):
+        _current_span.reset(self.token)
+        return False
+
+
+class Tracer:
+    """
+    Records nested spans and appends them to a JSONL file, one OTLP/JSON
+    `resourceSpans` batch per line, so the file can be loaded by OpenTelemetry
+    tooling. Traces are sampled when their root span starts, with probability
+    `sample_rate`; spans of an unsampled trace are not created at all.
+
+    Tracing is off until configure() is called. While off, span() returns a
+    shared no-op object, so a disabled span costs about as much as an empty
+    `with` statement, around a microsecond, or roughly ten per turn.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.sample_rate = 1.0
+        self.batch_size = 64
+        self.exported = 0
+        self._batch: list[Span] = []
+        self._lock = threading.Lock()
+
+    def configure(self, path: str, sample_rate: float = 1.0, batch_size: int = 64):
+        """Starts tracing to `path`; spans are written in batches of `batch_size`."""
+        self.shutdown()
+        self.path = path
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.enabled = True
+
+    def configure_from_env(self):
+        """Starts tracing if AGENT_TRACE_FILE is set, sampling AGENT_TRACE_SAMPLE_RATE."""
+        path = os.getenv("AGENT_TRACE_FILE")
+        if path:
+            self.configure(path, float(os.getenv("AGENT_TRACE_SAMPLE_RATE", "1.0")))
+
+    def span(self, name: str, **attributes):
+        """
+        Context manager for a span named `name`, a child of the current span.
+        Attributes can be passed here or set on the span inside the block.
+        """
+        if not self.enabled:
+            return _NOOP_SPAN
+        parent = _current_span.get()
+        if parent is _NOOP_SPAN:
+            return _NOOP_SPAN
+        if parent is None:
+            if random.random() >= self.sample_rate:
+                return _UnsampledScope()
+            return _SpanScope(
+                self, Span(name, f"{random.getrandbits(128):032x}", None, attributes)
+            )
+        return _SpanScope(self, Span(name, parent.trace_id, parent.span_id, attributes))
+
+    def current_span(self) -> Span | _NoopSpan:
+        """The innermost open span, to add attributes from deeper code."""
+        return _current_span.get() or _NOOP_SPAN
+
+    def _export(self, span: Span):
+        with self._lock:
+            self._batch.append(span)
+            if len(self._batch) >= self.batch_size:
+                self._write_batch()
+
+    def _write_batch(self):
+        if not self._batch or not self.path:
+            return
+        record = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": SERVICE_NAME},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": SERVICE_NAME},
+                            "spans": [span.to_otlp() for span in self._batch],
+                        }
+                    ],
+                }
+            ]
+        }
+        with open(self.path, "a") as file:
+            file.write(json.dumps(record) + "\n")
+        self.exported += len(self._batch)
+        self._batch = []
+
+    def flush(self):
+        with self._lock:
+            self._write_batch()
+
+    def shutdown(self):
+        """Writes the remaining spans and stops tracing."""
+        self.flush()
+        self.enabled = False
+
+
+tracer = Tracer()